@@ -1,4 +1,13 @@
+// Define DIODBERG_FRAMED to receive the framed serial protocol
+// (DMXSerialRenderer(framed = True), see libraries/DiodbergFrame) instead
+// of DMX.
+// #define DIODBERG_FRAMED
+
+#ifdef DIODBERG_FRAMED
+#include <DiodbergFrame.h>
+#else
 #include <DMXSerial.h>
+#endif
 
 /*
     Basic Pin setup:
@@ -51,11 +60,26 @@
 
 #include "Tlc5940.h"
 #define NUM_LEDS 16
+#define FRAME_UNIVERSE 0
+#define FRAME_BAUD 115200
 
 static int bright[3] = {0, 1224, 2650};
 boolean demo_mode = false;
 uint_fast16_t dmx_address;
 
+#ifdef DIODBERG_FRAMED
+DiodbergFrame frames(FRAME_UNIVERSE, NUM_LEDS*3);
+#endif
+
+// Value of a DMX channel, counting from 1.
+uint8_t read_channel(uint_fast16_t channel) {
+#ifdef DIODBERG_FRAMED
+  return frames.read(channel - 1);
+#else
+  return DMXSerial.read(channel);
+#endif
+}
+
 void setup()
 {
   /* Call Tlc.init() to setup the tlc.
@@ -73,7 +97,11 @@ void setup()
   pinMode(2, OUTPUT);
   
   // Setup the DMX interrupts / parsing code.
+#ifdef DIODBERG_FRAMED
+  Serial.begin(FRAME_BAUD);
+#else
   DMXSerial.init(DMXReceiver);
+#endif
   Tlc.set(1, 4095);
   Tlc.update();
   delay(500);
@@ -81,6 +109,9 @@ void setup()
   // Get the preset dmx address from DIP switch
   dmx_address = PINC & 0x0F;
   dmx_address = dmx_address ^ 0x0F;
+#ifdef DIODBERG_FRAMED
+  frames.begin(dmx_address*NUM_LEDS*3);
+#endif
   // Check for demo mode.
   if (dmx_address > 10) {
     demo_mode = true;
@@ -95,8 +126,13 @@ void setup()
 void loop()
 {
    if (!demo_mode) {
+#ifdef DIODBERG_FRAMED
+     while (Serial.available()) {
+       frames.feed(Serial.read());
+     }
+#endif
      for (uint_fast16_t i = 0; i < 48; i++) {
-       Tlc.set(i, DMXSerial.read(i + 1 + dmx_address*NUM_LEDS*3) << 4);
+       Tlc.set(i, read_channel(i + 1 + dmx_address*NUM_LEDS*3) << 4);
      }
 
    }
@@ -1,4 +1,13 @@
+// Define DIODBERG_FRAMED to receive the framed serial protocol
+// (DMXSerialRenderer(framed = True), see libraries/DiodbergFrame) instead
+// of DMX.
+// #define DIODBERG_FRAMED
+
+#ifdef DIODBERG_FRAMED
+#include <DiodbergFrame.h>
+#else
 #include <DMXSerial.h>
+#endif
 #include <Adafruit_NeoPixel.h>
 
 // Parameter 1 = number of pixels in strip
@@ -11,10 +20,25 @@
 Adafruit_NeoPixel strip = Adafruit_NeoPixel(2, 9, NEO_GRB + NEO_KHZ800);
 
 #define NUM_LEDS 16
+#define FRAME_UNIVERSE 0
+#define FRAME_BAUD 115200
 
 boolean demo_mode = false;
 uint_fast16_t dmx_address;
 
+#ifdef DIODBERG_FRAMED
+DiodbergFrame frames(FRAME_UNIVERSE, NUM_LEDS*3);
+#endif
+
+// Value of a DMX channel, counting from 1.
+uint8_t read_channel(uint_fast16_t channel) {
+#ifdef DIODBERG_FRAMED
+  return frames.read(channel - 1);
+#else
+  return DMXSerial.read(channel);
+#endif
+}
+
 
 void setup() {
   strip.begin();
@@ -42,7 +66,11 @@ void setup() {
   digitalWrite(2, LOW);
   pinMode(2, OUTPUT);
   // Setup the DMX interrupts / parsing code.
+#ifdef DIODBERG_FRAMED
+  Serial.begin(FRAME_BAUD);
+#else
   DMXSerial.init(DMXReceiver);
+#endif
   
   colorWipe(strip.Color(0,0,255), 50);
   colorWipe(strip.Color(0,0,0), 50);
@@ -50,6 +78,9 @@ void setup() {
   // Get DIP switch settings for DMX address
   dmx_address = (PIND >> 5) + ((PINB & 1) << 3);
   dmx_address = dmx_address ^ 0x0F;
+#ifdef DIODBERG_FRAMED
+  frames.begin(dmx_address*NUM_LEDS*3);
+#endif
   // Check for demo mode
   if (dmx_address > 10) {
     demo_mode = true;
@@ -62,9 +93,14 @@ void setup() {
 
 void loop() {  
   if (!demo_mode) {
+#ifdef DIODBERG_FRAMED
+    while (Serial.available()) {
+      frames.feed(Serial.read());
+    }
+#endif
     for (uint_fast16_t c = 0; c < NUM_LEDS; c++) {
         uint_fast16_t start = dmx_address*(NUM_LEDS*3) + c*3;
-        setPixelColor(c, strip.Color(DMXSerial.read(start+1),DMXSerial.read(start+2), DMXSerial.read(start+3)));
+        setPixelColor(c, strip.Color(read_channel(start+1),read_channel(start+2), read_channel(start+3)));
     }
   }
   else {
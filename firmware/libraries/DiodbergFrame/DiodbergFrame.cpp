@@ -0,0 +1,155 @@
+#include "DiodbergFrame.h"
+
+#define FRAME_SYNC0 0xD1
+#define FRAME_SYNC1 0xB0
+#define FRAME_RAW 0
+#define FRAME_RLE 1
+#define FRAME_XOR 2
+#define FRAME_KEY 0x80
+#define UNIVERSE_SIZE 512
+#define MAX_PAYLOAD (UNIVERSE_SIZE + 4)
+
+static uint16_t crc_update(uint16_t crc, uint8_t b) {
+  crc ^= (uint16_t)b << 8;
+  for (uint8_t i = 0; i < 8; i++) {
+    crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+  }
+  return crc;
+}
+
+DiodbergFrame::DiodbergFrame(uint8_t universe, uint8_t count) {
+  _universe = universe;
+  _count = count < DIODBERG_FRAME_MAX_WINDOW ? count : DIODBERG_FRAME_MAX_WINDOW;
+  begin(0);
+}
+
+void DiodbergFrame::begin(uint16_t first) {
+  _first = first;
+  _sequence = -1;
+  errors = 0;
+  memset(_live, 0, sizeof(_live));
+  reset();
+}
+
+void DiodbergFrame::reset() {
+  _state = SYNC0;
+  _header_pos = 0;
+  _crc = 0xFFFF;
+  _bad = false;
+}
+
+uint8_t DiodbergFrame::read(uint16_t channel) {
+  if (channel < _first || channel >= _first + _count) {
+    return 0;
+  }
+  return _live[channel - _first];
+}
+
+void DiodbergFrame::stage(uint8_t value) {
+  uint16_t offset = ((uint16_t)_header[3] << 8) | _header[4];
+  uint16_t count = ((uint16_t)_header[5] << 8) | _header[6];
+  if (_decoded >= count) {
+    _bad = true;
+    return;
+  }
+  uint16_t channel = offset + _decoded++;
+  if (channel >= _first && channel < _first + _count) {
+    _staged[channel - _first] = value;
+  }
+}
+
+boolean DiodbergFrame::feed(uint8_t b) {
+  switch (_state) {
+  case SYNC0:
+    if (b == FRAME_SYNC0) {
+      _state = SYNC1;
+    }
+    return false;
+  case SYNC1:
+    _state = b == FRAME_SYNC1 ? HEADER : (b == FRAME_SYNC0 ? SYNC1 : SYNC0);
+    return false;
+  case HEADER:
+    _crc = crc_update(_crc, b);
+    _header[_header_pos++] = b;
+    if (_header_pos == sizeof(_header)) {
+      uint16_t offset = ((uint16_t)_header[3] << 8) | _header[4];
+      uint16_t count = ((uint16_t)_header[5] << 8) | _header[6];
+      _payload_left = ((uint16_t)_header[7] << 8) | _header[8];
+      uint8_t encoding = _header[0] & ~FRAME_KEY;
+      if (_payload_left > MAX_PAYLOAD || offset + count > UNIVERSE_SIZE ||
+          encoding > FRAME_XOR) {
+        errors++;
+        reset();
+        return false;
+      }
+      _decoded = 0;
+      _run_left = 0;
+      _state = _payload_left ? PAYLOAD : CRC_HI;
+    }
+    return false;
+  case PAYLOAD:
+    _crc = crc_update(_crc, b);
+    _payload_left--;
+    if (_header[1] == _universe && !_bad) {
+      if ((_header[0] & ~FRAME_KEY) == FRAME_RAW) {
+        stage(b);
+      } else if (_run_left == 0) {
+        // Control byte: a literal block, or a repeat whose value follows.
+        _run_repeat = b >= 128;
+        _run_left = _run_repeat ? b - 125 : b + 1;
+      } else if (_run_repeat) {
+        while (_run_left) {
+          stage(b);
+          _run_left--;
+        }
+      } else {
+        stage(b);
+        _run_left--;
+      }
+    }
+    if (_payload_left == 0) {
+      _state = CRC_HI;
+    }
+    return false;
+  case CRC_HI:
+    _received_crc = (uint16_t)b << 8;
+    _state = CRC_LO;
+    return false;
+  case CRC_LO: {
+    _received_crc |= b;
+    boolean applied = false;
+    if (_received_crc != _crc) {
+      errors++;
+    } else if (_header[1] == _universe) {
+      applied = commit();
+    }
+    reset();
+    return applied;
+  }
+  }
+  return false;
+}
+
+boolean DiodbergFrame::commit() {
+  uint8_t encoding = _header[0] & ~FRAME_KEY;
+  boolean keyframe = _header[0] & FRAME_KEY;
+  uint16_t offset = ((uint16_t)_header[3] << 8) | _header[4];
+  uint16_t count = ((uint16_t)_header[5] << 8) | _header[6];
+  if (_bad || _decoded != count || _run_left != 0 ||
+      (keyframe && encoding == FRAME_XOR)) {
+    errors++;
+    return false;
+  }
+  if (!keyframe && _sequence != (int16_t)((_header[2] + 255) & 0xFF)) {
+    errors++;
+    return false;
+  }
+  _sequence = _header[2];
+  uint16_t start = offset > _first ? offset : _first;
+  uint16_t stop = offset + count < _first + _count ? offset + count : _first + _count;
+  for (uint16_t channel = start; channel < stop; channel++) {
+    uint8_t i = channel - _first;
+    _live[i] = encoding == FRAME_XOR ? _live[i] ^ _staged[i] : _staged[i];
+  }
+  return start < stop;
+}
@@ -0,0 +1,76 @@
+/*
+    DiodbergFrame: receiver for the framed serial protocol of
+    python/diodberg/core/framing.py, an alternative to DMX for slow links.
+
+    Frame layout (multi-byte fields big-endian):
+
+      sync 0xD1 0xB0 | encoding | universe | sequence | first channel (2) |
+      channel count (2) | payload length (2) | payload | CRC-16 (2)
+
+    The CRC is CRC-16/CCITT-FALSE over everything between the sync and the CRC.
+    Encodings are raw, run-length (RLE) or a run-length encoded XOR delta,
+    with bit 7 set on keyframes. RLE blocks: a control byte c < 128 is followed
+    by c + 1 literal bytes, c >= 128 by one byte repeated c - 125 times.
+
+    An ATmega168 has no room for a whole universe, let alone a frame, so the
+    decoder works on the fly and only keeps the channels the board drives:
+    a window of `count` channels from `first`, plus as many staging bytes.
+    Payload bytes that land in the window are staged, and committed only
+    once the frame's CRC checks out. Frames other than keyframes are dropped
+    unless they follow the last applied sequence number; after a bad frame
+    the decoder hunts for the next sync, and the next keyframe resyncs it.
+*/
+
+#ifndef DIODBERG_FRAME_H
+#define DIODBERG_FRAME_H
+
+#include <Arduino.h>
+
+#define DIODBERG_FRAME_MAX_WINDOW 64
+
+class DiodbergFrame {
+ public:
+  DiodbergFrame(uint8_t universe, uint8_t count);
+
+  // Sets the window to count channels from first, and clears it.
+  void begin(uint16_t first);
+
+  // Consumes one received byte. Returns true if it completed a frame that
+  // updated the window.
+  boolean feed(uint8_t b);
+
+  // Channel value, counting from 0 at the start of the universe (DMX channel
+  // 1). Channels outside of the window read as 0.
+  uint8_t read(uint16_t channel);
+
+  // Frames rejected for a bad CRC, a malformed header or payload, or a broken
+  // sequence.
+  uint16_t errors;
+
+ private:
+  enum State { SYNC0, SYNC1, HEADER, PAYLOAD, CRC_HI, CRC_LO };
+
+  void stage(uint8_t value);
+  boolean commit();
+  void reset();
+
+  uint8_t _universe;
+  uint16_t _first;
+  uint8_t _count;
+  uint8_t _live[DIODBERG_FRAME_MAX_WINDOW];
+  uint8_t _staged[DIODBERG_FRAME_MAX_WINDOW];
+  int16_t _sequence;
+
+  State _state;
+  uint8_t _header[9];
+  uint8_t _header_pos;
+  uint16_t _crc;
+  uint16_t _received_crc;
+  uint16_t _payload_left;
+  uint16_t _decoded;
+  uint8_t _run_left;
+  boolean _run_repeat;
+  boolean _bad;
+};
+
+#endif
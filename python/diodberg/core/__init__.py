@@ -1 +1 @@
-__all__ = ["renderer", "runner", "types"]
+__all__ = ["calibration", "clip", "compositor", "eventloop", "framing", "index", "instrumentation", "kernels", "patch", "renderer", "runner", "scheduler", "spec", "transitions", "types"]
@@ -0,0 +1,122 @@
+# Output calibration: gamma, white balance and a master dimmer, precomputed as
+# one 256-entry lookup table per color channel and applied by renderers as they
+# encode a frame, so that effects can work in plain RGB.
+
+import numpy as np
+import threading
+
+from diodberg.core.types import COLOR_MAX
+from diodberg.core.types import gamma_table
+
+
+_channels = 3
+_levels = COLOR_MAX + 1
+
+# Offsets of the red, green and blue tables in Calibration.flat_table.
+CHANNEL_OFFSETS = _levels*np.arange(_channels)
+
+
+def _per_channel(value, name):
+    values = np.broadcast_to(np.asarray(value, dtype = np.float64), (_channels,))
+    if (values < 0).any():
+        raise ValueError("Calibration %s must not be negative: %s" % (name, value))
+    return tuple(values.tolist())
+
+
+class Calibration(object):
+    """ Calibration maps channel values through a gamma curve, then scales them
+    by the white point and the master brightness. gamma and white may be a
+    single value or one per channel (red, green, blue); white and brightness
+    are factors in [0, 1].
+
+    The mapping is kept as a (3, 256) uint8 table, rebuilt only when a
+    parameter changes. A rebuild makes a new table and swaps it in, so a
+    renderer that took table or flat_table at the start of a frame is never
+    stalled or handed a half-built table, and brightness can be changed from
+    any thread while frames are being rendered.
+    """
+
+    __slots__ = {'__gamma', '__white', '__brightness', '__table', '__revision',
+                 '__lock'}
+
+    def __init__(self, gamma = 1., white = 1., brightness = 1.):
+        self.__lock = threading.Lock()
+        self.__gamma = _per_channel(gamma, "gamma")
+        self.__white = _per_channel(white, "white")
+        self.__brightness = float(brightness)
+        self.__revision = 0
+        self.__rebuild()
+
+    def __rebuild(self):
+        table = np.empty((_channels, _levels), dtype = np.uint8)
+        for channel in xrange(_channels):
+            table[channel] = gamma_table(self.__gamma[channel],
+                                         self.__white[channel]*self.__brightness)
+        self.__table = table.reshape(-1)
+        self.__revision += 1
+
+    def __get_gamma(self):
+        return self.__gamma
+    def __set_gamma(self, val):
+        with self.__lock:
+            self.__gamma = _per_channel(val, "gamma")
+            self.__rebuild()
+
+    def __get_white(self):
+        return self.__white
+    def __set_white(self, val):
+        with self.__lock:
+            self.__white = _per_channel(val, "white")
+            self.__rebuild()
+
+    def __get_brightness(self):
+        return self.__brightness
+    def __set_brightness(self, val):
+        if val < 0:
+            raise ValueError("Calibration brightness must not be negative: %s" % val)
+        with self.__lock:
+            self.__brightness = float(val)
+            self.__rebuild()
+
+    gamma = property(__get_gamma, __set_gamma, None,
+                     "Gamma of each channel (red, green, blue).")
+    white = property(__get_white, __set_white, None,
+                     "White point: scale of each channel (red, green, blue).")
+    brightness = property(__get_brightness, __set_brightness, None,
+                          "Master brightness, in [0, 1].")
+
+    @property
+    def table(self):
+        """ (3, 256) uint8 lookup table, one row per channel.
+        """
+        return self.__table.reshape(_channels, _levels)
+
+    @property
+    def flat_table(self):
+        """ The table as one 768-entry array: channel c maps value v to
+        flat_table[CHANNEL_OFFSETS[c] + v].
+        """
+        return self.__table
+
+    @property
+    def identity(self):
+        """ Does the calibration leave every value unchanged?
+        """
+        return (self.__gamma == (1.,)*_channels and
+                self.__white == (1.,)*_channels and self.__brightness == 1.)
+
+    @property
+    def revision(self):
+        """ Incremented every time the table is rebuilt.
+        """
+        return self.__revision
+
+    def apply(self, colors):
+        """ Returns a calibrated copy of an (..., 3) uint8 array of colors, with
+        a single table lookup.
+        """
+        return self.__table[colors + CHANNEL_OFFSETS]
+
+    def __repr__(self):
+        return "Calibration<gamma = %s, white = %s, brightness = %s>" % (
+            self.__gamma, self.__white, self.__brightness)
@@ -0,0 +1,423 @@
+# Precomputed animation clips: a Runner's output rendered offline into a file of
+# uint8 frames, and played back by memory-mapping it. Deterministic loops (hue
+# cycles, chases, route reveals) then cost one copy per frame on the Pi instead
+# of a fill.
+#
+# A clip file is a small JSON header followed by raw arrays:
+#
+#   magic "DBCLIP\x00\x01" | header length (uint32, little-endian) | header |
+#   cells (int64) | RGB frames (frames x cells x 3) | DMX frames (frames x
+#   universes x 512) | DMX channel colors (universes x 512, uint16)
+#
+# Only the cells the clip was recorded from (by default the live pixels) are
+# stored. DMX frames are the channel buffers of each universe, for renderers
+# that send them as is (see Renderer.render_buffers). They are stored before
+# calibration, along with the offset of each channel's color into a
+# Calibration's flat table, so that playback applies the renderer's current
+# calibration with one lookup. Arrays start on 64-byte boundaries, at offsets
+# given in the header relative to the first 64-byte boundary after it.
+
+import json
+import numpy as np
+import struct
+
+from diodberg.core.patch import DMX_CHANNELS_PER_PIXEL
+from diodberg.core.patch import DMX_UNIVERSE_SIZE
+from diodberg.core.patch import DMXPatchMap
+from diodberg.core.renderer import Renderer
+from diodberg.core.runner import Runner
+from diodberg.util.utils import monotonic
+
+
+CLIP_MAGIC = b"DBCLIP\x00\x01"
+CLIP_VERSION = 1
+
+_align = 64
+_length = struct.Struct("<I")
+
+
+def _aligned(offset):
+    return -(-offset//_align)*_align
+
+
+def _check_loop(loop, frames):
+    start, stop = int(loop[0]), int(loop[1])
+    if not 0 <= start < stop <= frames:
+        raise ValueError("Loop (%d, %d) is outside of the clip's %d frames." %
+                         (start, stop, frames))
+    return start, stop
+
+
+def record_clip(runner, filename, frames, rgb = True, dmx = False, universes = 1,
+                live_only = True, fps = None, loop = None):
+    """ Renders frames frames of a runner offline into a clip file, driving
+    its fill() synchronously without starting its thread or pacing frames
+    (see headless_renderers.record). Stores the colors of the panel's live
+    pixels (or, without live_only, of every cell) and, with dmx, the DMX
+    buffers of universes 0..universes-1 and any patched ones, uncalibrated.
+    fps defaults to the runner's frame rate, and loop, the
+    (start, stop) frames that playback loops over, to the whole clip.
+    Returns the Clip.
+    """
+    if not (rgb or dmx):
+        raise ValueError("A clip needs RGB or DMX frames.")
+    panel = runner.panel
+    runner.init()
+    if live_only:
+        cells = panel.live_cells
+    else:
+        cells = np.arange(panel.width*panel.height)
+    cells = np.asarray(cells, dtype = '<i8')
+    patch = DMXPatchMap(panel, xrange(universes)) if dmx else None
+    if fps is None:
+        period = runner.scheduler.period
+        fps = 1./period if period > 0 else 30.
+    shapes = [("cells", cells.shape, '<i8'),
+              ("rgb", (frames, len(cells), DMX_CHANNELS_PER_PIXEL) if rgb else None, 'u1'),
+              ("dmx", (frames, len(patch.universes), DMX_UNIVERSE_SIZE) if dmx else None, 'u1'),
+              ("colors", (len(patch.universes), DMX_UNIVERSE_SIZE) if dmx else None, '<u2')]
+    offsets = {}
+    end = 0
+    for name, shape, dtype in shapes:
+        if shape is not None:
+            offsets[name] = end
+            end = _aligned(end + int(np.prod(shape))*np.dtype(dtype).itemsize)
+    header = json.dumps({"version": CLIP_VERSION,
+                         "name": runner.name,
+                         "size": [panel.width, panel.height],
+                         "frames": frames,
+                         "fps": fps,
+                         "loop": list(_check_loop(loop or (0, frames), frames)),
+                         "cells": len(cells),
+                         "universes": list(patch.universes) if dmx else [],
+                         "offsets": offsets})
+    base = _aligned(len(CLIP_MAGIC) + _length.size + len(header))
+    with open(filename, "wb") as f:
+        f.write(CLIP_MAGIC)
+        f.write(_length.pack(len(header)))
+        f.write(header)
+        f.truncate(base + end)
+    data = np.memmap(filename, dtype = np.uint8, mode = 'r+')
+    arrays = {}
+    for name, shape, dtype in shapes:
+        if shape is not None:
+            start = base + offsets[name]
+            size = int(np.prod(shape))*np.dtype(dtype).itemsize
+            arrays[name] = data[start:start + size].view(dtype).reshape(shape)
+    arrays["cells"][...] = cells
+    if dmx:
+        arrays["colors"][...] = patch.table_offsets()
+    for frame in xrange(frames):
+        runner.fill()
+        if rgb:
+            arrays["rgb"][frame] = panel.live_colors(cells)
+        if dmx:
+            patch.apply(panel)
+            arrays["dmx"][frame] = patch.buffers
+    data.flush()
+    del arrays, data
+    return Clip(filename)
+
+
+class Clip(object):
+    """ A clip file, memory-mapped read-only. rgb(frame) and dmx(frame) are
+    views onto the mapping, so frames are only paged in as they are played.
+    """
+
+    __slots__ = {'__filename', '__header', '__cells', '__rgb', '__dmx', '__colors'}
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            if f.read(len(CLIP_MAGIC)) != CLIP_MAGIC:
+                raise ValueError("%s is not a clip file." % filename)
+            length, = _length.unpack(f.read(_length.size))
+            header = json.loads(f.read(length))
+        if header["version"] > CLIP_VERSION:
+            raise ValueError("Clip version %s is newer than %d." %
+                             (header["version"], CLIP_VERSION))
+        self.__filename = filename
+        self.__header = header
+        data = np.memmap(filename, dtype = np.uint8, mode = 'r')
+        base = _aligned(len(CLIP_MAGIC) + _length.size + length)
+        offsets = header["offsets"]
+        frames = header["frames"]
+        def array(name, shape, dtype):
+            if name not in offsets:
+                return None
+            start = base + offsets[name]
+            size = int(np.prod(shape))*np.dtype(dtype).itemsize
+            return data[start:start + size].view(dtype).reshape(shape)
+        self.__cells = array("cells", (header["cells"],), '<i8')
+        self.__rgb = array("rgb", (frames, header["cells"], DMX_CHANNELS_PER_PIXEL),
+                           'u1')
+        self.__dmx = array("dmx", (frames, len(header["universes"]), DMX_UNIVERSE_SIZE),
+                           'u1')
+        self.__colors = array("colors", (len(header["universes"]), DMX_UNIVERSE_SIZE),
+                              '<u2')
+
+    @property
+    def filename(self):
+        return self.__filename
+
+    @property
+    def name(self):
+        return self.__header["name"]
+
+    @property
+    def size(self):
+        """ (width, height) of the panel the clip was recorded from.
+        """
+        return tuple(self.__header["size"])
+
+    @property
+    def fps(self):
+        return self.__header["fps"]
+
+    @property
+    def loop(self):
+        """ The (start, stop) frames that playback loops over by default.
+        """
+        return tuple(self.__header["loop"])
+
+    @property
+    def cells(self):
+        """ Flat indices of the recorded cells, the rows of each RGB frame.
+        """
+        return self.__cells
+
+    @property
+    def universes(self):
+        """ DMX universes of the rows of each DMX frame.
+        """
+        return self.__header["universes"]
+
+    @property
+    def has_rgb(self):
+        return self.__rgb is not None
+
+    @property
+    def has_dmx(self):
+        return self.__dmx is not None
+
+    def rgb(self, frame):
+        """ (cells, 3) colors of a frame.
+        """
+        return self.__rgb[frame]
+
+    def dmx(self, frame):
+        """ (universes, 512) DMX buffers of a frame, uncalibrated.
+        """
+        return self.__dmx[frame]
+
+    @property
+    def colors(self):
+        """ (universes, 512) offsets of each DMX channel's color into a
+        Calibration's flat table (see DMXPatchMap.table_offsets).
+        """
+        return self.__colors
+
+    def __len__(self):
+        return self.__header["frames"]
+
+    def __repr__(self):
+        return "Clip<%s, %d frames, rgb = %s, dmx = %s>" % (
+            self.name, len(self), self.has_rgb, self.has_dmx)
+
+
+class _ClipOutput(Renderer):
+    """ Stands in for a ClipRunner's renderer when the clip's DMX frames can
+    be sent as is: each frame goes from the mapping to render_buffers, through
+    the renderer's calibration if it has one.
+    """
+
+    __slots__ = {'__renderer', '__runner', '__index', '__buffers'}
+
+    def __init__(self, renderer, runner):
+        super(_ClipOutput, self).__init__()
+        self.__renderer = renderer
+        self.__runner = runner
+        self.__index = None
+        self.__buffers = None
+
+    def render(self, panel):
+        clip = self.__runner.clip
+        buffers = clip.dmx(self.__runner.frame)
+        calibration = self.__renderer.calibration
+        if calibration is not None and not calibration.identity:
+            if self.__index is None:
+                self.__index = np.empty(buffers.shape, dtype = np.intp)
+                self.__buffers = np.empty(buffers.shape, dtype = np.uint8)
+            np.add(buffers, clip.colors, out = self.__index)
+            buffers = np.take(calibration.flat_table, self.__index, out = self.__buffers)
+        self.__renderer.render_buffers(clip.universes, buffers)
+
+    @property
+    def nonblocking(self):
+        return self.__renderer.nonblocking
+
+    def fileno(self):
+        return self.__renderer.fileno()
+
+    def flush(self):
+        return self.__renderer.flush()
+
+    def __get_instruments(self):
+        return self.__renderer.instruments
+    def __set_instruments(self, val):
+        self.__renderer.instruments = val
+
+    def __get_calibration(self):
+        return self.__renderer.calibration
+    def __set_calibration(self, val):
+        self.__renderer.calibration = val
+
+    instruments = property(__get_instruments, __set_instruments)
+    calibration = property(__get_calibration, __set_calibration)
+
+    def __repr__(self):
+        return "ClipOutput<%r>" % self.__renderer
+
+
+def _clip_output(renderer, runner, clip):
+    # What a ClipRunner renders to: the clip's DMX frames straight to a
+    # renderer that takes buffers, or else the panel filled from its RGB ones.
+    if clip.has_dmx and getattr(renderer, 'renders_buffers', False):
+        return _ClipOutput(renderer, runner)
+    if not clip.has_rgb:
+        raise ValueError("Clip %s only has DMX frames, and %s can't render "
+                         "them." % (clip.name, type(renderer).__name__))
+    return renderer
+
+
+class ClipRunner(Runner):
+    """ ClipRunner plays a Clip (or clip file) back. Each fill copies the frame
+    due at the playback position into the panel's recorded cells with one
+    scatter, and nothing at all if that frame is already there. If the clip
+    has DMX frames and the renderer renders_buffers, frames are instead sent
+    straight from the mapping, through the renderer's calibration, and the
+    panel isn't touched.
+
+    Playback runs on a clock from when the runner starts, at the clip's frame
+    rate times speed (negative plays backwards). With looping, the position
+    wraps around loop, (start, stop) frames defaulting to the clip's; without,
+    it stops at either end and finished is set. seek() jumps to a frame.
+
+    As a Runner, a clip with RGB frames can be a Controller layer or the
+    source of a transition; setting the renderer of a clip with only DMX
+    frames to one that doesn't render_buffers, e.g. a Layer, raises
+    ValueError.
+    """
+
+    __slots__ = {'__clip', '__speed', '__loop', '__looping',
+                 '__clock', '__origin', '__frame', '__filled'}
+
+    def __init__(self, panel, renderer, clip, sleep = None, speed = 1., loop = None,
+                 looping = True, clock = None, **kwargs):
+        if not isinstance(clip, Clip):
+            clip = Clip(clip)
+        if clip.size != (panel.width, panel.height):
+            raise ValueError("Clip %s is %dx%d, the panel %dx%d." %
+                             ((clip.name,) + clip.size + (panel.width, panel.height)))
+        output = _clip_output(renderer, self, clip)
+        if sleep is None:
+            sleep = 1./clip.fps
+        super(ClipRunner, self).__init__(panel, clip.name, output, sleep, **kwargs)
+        self.__clip = clip
+        self.__speed = float(speed)
+        self.__loop = _check_loop(loop or clip.loop, len(clip))
+        self.__looping = looping
+        self.__clock = clock or monotonic
+        self.__origin = (self.__clock(), 0.)
+        self.__frame = 0
+        self.__filled = None
+
+    def init(self):
+        # The clock starts with the runner, from wherever it was seeked to.
+        self.__origin = (self.__clock(), self.__origin[1])
+
+    def fill(self):
+        frame = self.__frame_at(self.position)
+        self.__frame = frame
+        if isinstance(self.renderer, _ClipOutput):
+            # The frame goes straight from the clip to the output.
+            return
+        panel = self.panel
+        if self.__filled == (frame, panel):
+            return
+        panel.set_live_colors(self.__clip.rgb(frame), self.__clip.cells)
+        self.__filled = (frame, panel)
+
+    def __frame_at(self, position):
+        return min(max(int(np.floor(position)), 0), len(self.__clip) - 1)
+
+    def __unwrapped(self):
+        start, position = self.__origin
+        return position + (self.__clock() - start)*self.__clip.fps*self.__speed
+
+    def __wrap(self, position):
+        start, stop = self.__loop
+        if self.__looping:
+            if position >= stop or (position < start and self.__speed < 0):
+                position = start + (position - start) % (stop - start)
+        return min(max(position, 0.), float(len(self.__clip)))
+
+    @property
+    def position(self):
+        """ Current playback position, in frames.
+        """
+        return self.__wrap(self.__unwrapped())
+
+    def seek(self, frame):
+        """ Moves playback to a frame; it continues from there.
+        """
+        self.__origin = (self.__clock(), float(frame))
+
+    @property
+    def frame(self):
+        """ The frame of the last fill.
+        """
+        return self.__frame
+
+    @property
+    def finished(self):
+        """ Has playback without looping run off either end?
+        """
+        position = self.__unwrapped()
+        return not self.__looping and (position >= len(self.__clip) or
+                                       (position < 0 and self.__speed < 0))
+
+    @property
+    def clip(self):
+        return self.__clip
+
+    def __get_renderer(self):
+        return Runner.renderer.fget(self)
+    def __set_renderer(self, val):
+        Runner.renderer.fset(self, _clip_output(val, self, self.__clip))
+
+    def __get_speed(self):
+        return self.__speed
+    def __set_speed(self, val):
+        self.__origin = (self.__clock(), self.position)
+        self.__speed = float(val)
+
+    def __get_loop(self):
+        return self.__loop
+    def __set_loop(self, val):
+        self.__loop = _check_loop(val, len(self.__clip))
+
+    def __get_looping(self):
+        return self.__looping
+    def __set_looping(self, val):
+        self.__origin = (self.__clock(), self.position)
+        self.__looping = val
+
+    renderer = property(__get_renderer, __set_renderer, None,
+                        "Renderer; frames go straight to one that renders_buffers.")
+    speed = property(__get_speed, __set_speed, None,
+                     "Playback speed, as a multiple of the clip's frame rate.")
+    loop = property(__get_loop, __set_loop, None, "(start, stop) frames to loop over.")
+    looping = property(__get_looping, __set_looping, None, "Does playback loop?")
+
+    def __repr__(self):
+        return super(ClipRunner, self).__repr__() + ":" + self.name
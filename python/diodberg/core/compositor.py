@@ -0,0 +1,193 @@
+# Layer compositing for running several visualizations at once. Every Runner
+# draws into its own Layer; the Controller blends the layers, bottom to top,
+# into the panel that is sent to the real renderer.
+
+import threading
+import numpy as np
+
+from diodberg.core.renderer import Renderer
+
+
+BLEND_OVER = "over"
+BLEND_ADD = "add"
+BLEND_MULTIPLY = "multiply"
+BLEND_MAX = "max"
+BLEND_MODES = (BLEND_OVER, BLEND_ADD, BLEND_MULTIPLY, BLEND_MAX)
+
+
+def _div255(values):
+    """ Divides a uint16 array by 255 in place, rounding to nearest. Exact for
+    values up to 255*255, and much cheaper than integer division.
+    """
+    values += 128
+    values += values >> 8
+    values >>= 8
+    return values
+
+
+def blend(dest, src, mode = BLEND_OVER, opacity = 1., mask = None, scratch = None):
+    """ Blends a (..., 3) uint8 src into dest in place. The blend mode combines
+    the two colors, then the result is mixed into dest by opacity in [0, 1].
+    With a boolean mask over the leading dimensions, only the masked pixels are
+    touched. scratch is an optional (2,) + dest.shape uint16 work array, to
+    avoid allocating every frame.
+    """
+    assert mode in BLEND_MODES, "Unknown blend mode: " + str(mode)
+    alpha = int(round(min(max(opacity, 0.), 1.)*255))
+    if alpha == 0:
+        return dest
+    if mask is not None:
+        where = np.nonzero(mask)
+        selected = dest[where]
+        dest[where] = blend(selected, src[where], mode, opacity)
+        return dest
+    if scratch is None:
+        scratch = np.empty((2,) + dest.shape, dtype = np.uint16)
+    out, mixed = scratch[0], scratch[1]
+    out[...] = dest
+    # All intermediate values stay below 255*255, so uint16 is enough.
+    if mode == BLEND_OVER:
+        mixed[...] = src
+    elif mode == BLEND_ADD:
+        np.add(out, src, out = mixed)
+        np.minimum(mixed, 255, out = mixed)
+    elif mode == BLEND_MULTIPLY:
+        np.multiply(out, src, out = mixed)
+        _div255(mixed)
+    elif mode == BLEND_MAX:
+        np.maximum(out, src, out = mixed)
+    if alpha < 255:
+        out *= 255 - alpha
+        mixed *= alpha
+        mixed += out
+        _div255(mixed)
+    dest[...] = mixed
+    return dest
+
+
+class Layer(Renderer):
+    """ A Layer is the Renderer a composited Runner draws into. Each frame the
+    runner renders is snapshotted, and the Controller blends the latest
+    snapshot with the given mode and opacity. If group is set, the layer only
+    covers the pixels in that group (e.g. one climbing route); if mask is set,
+    only the pixels in that (H, W) boolean mask.
+    """
+
+    __slots__ = {'__colors', '__lock', '__mode', '__opacity', '__group',
+                 '__mask', '__frames'}
+
+    nonblocking = True
+
+    def __init__(self, size, mode = BLEND_OVER, opacity = 1., group = None):
+        super(Layer, self).__init__()
+        assert mode in BLEND_MODES, "Unknown blend mode: " + str(mode)
+        x, y = size
+        self.__colors = np.zeros((y, x, 3), dtype = np.uint8)
+        self.__lock = threading.Lock()
+        self.__mode = mode
+        self.__opacity = opacity
+        self.__group = group
+        self.__mask = None
+        self.__frames = 0
+
+    def render(self, panel):
+        with self.__lock:
+            self.__colors[...] = panel.color_plane
+            self.__frames += 1
+
+    def composite(self, panel, scratch = None):
+        """ Blends the latest snapshot into the panel's color plane.
+        """
+        if self.__opacity <= 0:
+            return
+        mask = self.__mask
+        if self.__group is not None:
+            in_group = panel.group_mask(self.__group)
+            mask = in_group if mask is None else in_group & mask
+        with self.__lock:
+            blend(panel.color_plane, self.__colors, self.__mode, self.__opacity,
+                  mask, scratch)
+
+    @property
+    def frames(self):
+        """ Number of frames the layer has received.
+        """
+        return self.__frames
+
+    def __get_mode(self):
+        return self.__mode
+    def __set_mode(self, val):
+        assert val in BLEND_MODES, "Unknown blend mode: " + str(val)
+        self.__mode = val
+
+    def __get_opacity(self):
+        return self.__opacity
+    def __set_opacity(self, val):
+        self.__opacity = val
+
+    def __get_group(self):
+        return self.__group
+    def __set_group(self, val):
+        self.__group = val
+
+    def __get_mask(self):
+        return self.__mask
+    def __set_mask(self, val):
+        self.__mask = val
+
+    mode = property(__get_mode, __set_mode, None, "Blend mode.")
+    opacity = property(__get_opacity, __set_opacity, None, "Opacity in [0, 1].")
+    group = property(__get_group, __set_group, None, "Group the layer covers, or None.")
+    mask = property(__get_mask, __set_mask, None, "Pixels the layer covers, or None.")
+
+    def __repr__(self):
+        return "Layer<mode = %s, opacity = %0.2f, group = %s>" % (self.__mode,
+                                                                 self.__opacity,
+                                                                 self.__group)
+
+
+class Compositor(object):
+    """ Compositor blends an ordered stack of Layers, bottom first, onto a black
+    background in a panel's color plane.
+    """
+
+    __slots__ = {'__layers', '__scratch', '__lock'}
+
+    def __init__(self):
+        self.__layers = []
+        self.__scratch = None
+        self.__lock = threading.Lock()
+
+    def add(self, layer, index = None):
+        """ Adds a layer on top, or at index in the stack.
+        """
+        with self.__lock:
+            if index is None:
+                self.__layers.append(layer)
+            else:
+                self.__layers.insert(index, layer)
+
+    def remove(self, layer):
+        with self.__lock:
+            self.__layers.remove(layer)
+
+    @property
+    def layers(self):
+        with self.__lock:
+            return list(self.__layers)
+
+    def composite(self, panel):
+        """ Writes the blend of all layers into the panel's color plane.
+        """
+        shape = (2,) + panel.color_plane.shape
+        if self.__scratch is None or self.__scratch.shape != shape:
+            self.__scratch = np.empty(shape, dtype = np.uint16)
+        panel.color_plane[...] = 0
+        for layer in self.layers:
+            layer.composite(panel, self.__scratch)
+
+    def __len__(self):
+        return len(self.__layers)
+
+    def __repr__(self):
+        return "Compositor<%s>" % self.__layers
@@ -0,0 +1,393 @@
+# A single-threaded event loop for driving runners and outputs without a thread
+# each: frame timers, writability callbacks for non-blocking outputs and a
+# thread pool executor for CPU-heavy fills and renderers that block. See
+# Controller.run_loop.
+#
+# Callbacks run on the loop's thread, one at a time, so they can share panels
+# and layers without locks; only work handed to the executor runs elsewhere.
+
+from collections import deque
+import errno
+import fcntl
+import heapq
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import select
+import sys
+
+from diodberg.core.types import Panel
+from diodberg.util.utils import monotonic
+
+
+class Timer(object):
+    """ A callback scheduled on an EventLoop; cancel() unschedules it.
+    """
+
+    __slots__ = {'__when', '__callback', '__args', '__cancelled'}
+
+    def __init__(self, when, callback, args):
+        self.__when = when
+        self.__callback = callback
+        self.__args = args
+        self.__cancelled = False
+
+    def run(self):
+        if not self.__cancelled:
+            self.__callback(*self.__args)
+
+    def cancel(self):
+        self.__cancelled = True
+
+    @property
+    def when(self):
+        return self.__when
+
+    @property
+    def cancelled(self):
+        return self.__cancelled
+
+    def __repr__(self):
+        return "Timer<%0.4f, cancelled = %s>" % (self.__when, self.__cancelled)
+
+
+class EventLoop(object):
+    """ EventLoop is a select() loop: callbacks at monotonic times (call_at,
+    call_later, call_soon), when file descriptors become writable
+    (add_writer), and when work handed to a pool of worker threads
+    finishes (run_in_executor). run() runs it until stop().
+
+    Only call_soon_threadsafe() and stop() may be called from other threads.
+    """
+
+    __slots__ = {'__timers', '__sequence', '__writers', '__ready', '__wake',
+                 '__running', '__workers', '__executor'}
+
+    def __init__(self, workers = None):
+        self.__timers = []
+        self.__sequence = 0
+        self.__writers = {}
+        self.__ready = deque()
+        self.__wake = os.pipe()
+        for fd in self.__wake:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.__running = False
+        self.__workers = workers or multiprocessing.cpu_count()
+        self.__executor = None
+
+    def time(self):
+        """ The loop's clock, monotonic().
+        """
+        return monotonic()
+
+    def call_at(self, when, callback, *args):
+        """ Calls callback(*args) at monotonic time when. Returns the Timer.
+        """
+        timer = Timer(when, callback, args)
+        heapq.heappush(self.__timers, (when, self.__sequence, timer))
+        self.__sequence += 1
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.time() + delay, callback, *args)
+
+    def call_soon(self, callback, *args):
+        return self.call_at(self.time(), callback, *args)
+
+    def call_soon_threadsafe(self, callback, *args):
+        """ Calls callback(*args) on the loop's thread as soon as possible;
+        safe from any thread.
+        """
+        self.__ready.append((callback, args))
+        self.__wakeup()
+
+    def __wakeup(self):
+        try:
+            os.write(self.__wake[1], b"\0")
+        except OSError as err:
+            # A full pipe will wake the loop anyway.
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def add_writer(self, fd, callback, *args):
+        """ Calls callback(*args) whenever fd is writable, until remove_writer.
+        """
+        self.__writers[fd] = (callback, args)
+
+    def remove_writer(self, fd):
+        """ Stops watching fd. Returns whether it was watched.
+        """
+        return self.__writers.pop(fd, None) is not None
+
+    def run_in_executor(self, func, callback = None, *args):
+        """ Runs func(*args) on the executor, then callback(result, error) on
+        the loop, where error is the sys.exc_info() of an exception raised by
+        func, or None.
+        """
+        if self.__executor is None:
+            self.__executor = ThreadPool(self.__workers)
+        def task():
+            try:
+                outcome = (func(*args), None)
+            except Exception:
+                outcome = (None, sys.exc_info())
+            if callback is not None:
+                self.call_soon_threadsafe(callback, *outcome)
+        self.__executor.apply_async(task)
+
+    @property
+    def running(self):
+        return self.__running
+
+    def run(self):
+        """ Runs callbacks as they come due until stop().
+        """
+        self.__running = True
+        try:
+            while self.__running:
+                self.__run_once()
+        finally:
+            self.__running = False
+
+    def stop(self):
+        """ Makes run() return once the current callback is done.
+        """
+        self.__running = False
+        self.__wakeup()
+
+    def __run_once(self):
+        timers = self.__timers
+        timeout = None
+        if self.__ready:
+            timeout = 0
+        elif timers:
+            timeout = max(timers[0][0] - self.time(), 0)
+        try:
+            readable, writable, _ = select.select([self.__wake[0]], list(self.__writers),
+                                                  [], timeout)
+        except select.error as err:
+            if err.args[0] == errno.EINTR:
+                return
+            raise
+        if readable:
+            self.__drain_wakeups()
+        for fd in writable:
+            entry = self.__writers.get(fd)
+            if entry is not None:
+                entry[0](*entry[1])
+        now = self.time()
+        while timers and timers[0][0] <= now:
+            heapq.heappop(timers)[2].run()
+        self.__run_ready()
+
+    def __drain_wakeups(self):
+        try:
+            while os.read(self.__wake[0], 4096):
+                pass
+        except OSError as err:
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def __run_ready(self):
+        # Only what is ready now; callbacks added meanwhile wait a turn.
+        for i in xrange(len(self.__ready)):
+            callback, args = self.__ready.popleft()
+            callback(*args)
+
+    def close(self):
+        """ Waits for the executor's work to finish, delivers its callbacks and
+        releases the loop's resources.
+        """
+        while self.__executor is not None:
+            executor, self.__executor = self.__executor, None
+            executor.close()
+            executor.join()
+            self.__drain_wakeups()
+            self.__run_ready()
+        for fd in self.__wake:
+            os.close(fd)
+        self.__wake = ()
+
+    def __repr__(self):
+        return "EventLoop<%d timers, %d writers>" % (len(self.__timers),
+                                                     len(self.__writers))
+
+
+def _reraise(error):
+    raise error[0], error[1], error[2]
+
+
+class OutputTask(object):
+    """ OutputTask renders frames to a renderer from an EventLoop without
+    letting it hold up the loop. A nonblocking renderer renders on the loop,
+    and whatever it leaves pending is flushed as its fileno() becomes
+    writable. Any other renderer renders a copy of the frame on the executor;
+    frames that come while it is still busy are dropped, so a slow device
+    only loses its own frames.
+    """
+
+    __slots__ = {'__loop', '__renderer', '__frame', '__busy', '__waiting',
+                 '__dropped'}
+
+    def __init__(self, loop, renderer):
+        self.__loop = loop
+        self.__renderer = renderer
+        self.__frame = None
+        self.__busy = False
+        self.__waiting = None
+        self.__dropped = 0
+
+    def prepare(self, panel):
+        self.__renderer.prepare(panel)
+
+    def render(self, panel):
+        """ Renders a frame of the panel, or drops it if the renderer is busy.
+        """
+        renderer = self.__renderer
+        if renderer.nonblocking:
+            renderer.render(panel)
+            self.__flush()
+            return
+        if self.__busy:
+            self.__dropped += 1
+            return
+        frame = self.__frame
+        if frame is None or frame.layout is not panel.layout:
+            frame = self.__frame = Panel(panel = panel, share_layout = True)
+        else:
+            frame.color_plane[...] = panel.color_plane
+        self.__busy = True
+        self.__loop.run_in_executor(renderer.render, self.__rendered, frame)
+
+    def __flush(self):
+        done = self.__renderer.flush()
+        if done and self.__waiting is not None:
+            self.__loop.remove_writer(self.__waiting)
+            self.__waiting = None
+        elif not done and self.__waiting is None:
+            fd = self.__renderer.fileno()
+            if fd is not None:
+                self.__loop.add_writer(fd, self.__flush)
+                self.__waiting = fd
+
+    def __rendered(self, result, error):
+        self.__busy = False
+        if error is not None:
+            _reraise(error)
+
+    def stop(self):
+        """ Stops flushing the renderer.
+        """
+        if self.__waiting is not None:
+            self.__loop.remove_writer(self.__waiting)
+            self.__waiting = None
+
+    @property
+    def renderer(self):
+        return self.__renderer
+
+    @property
+    def dropped(self):
+        """ Frames dropped because the renderer was still busy.
+        """
+        return self.__dropped
+
+    def __repr__(self):
+        return "OutputTask<%r, dropped = %d>" % (self.__renderer, self.__dropped)
+
+
+class RunnerTask(object):
+    """ RunnerTask drives a Runner from an EventLoop in place of its thread.
+    start() opens and initializes the runner; then each frame, paced by the
+    runner's FrameScheduler, is filled (on the executor with offload, leaving
+    the loop free meanwhile) and rendered through an OutputTask. The next
+    frame is only scheduled once a fill has finished, so a slow fill makes
+    frames late, as in the runner's own loop, rather than piling up.
+    """
+
+    __slots__ = {'__loop', '__runner', '__offload', '__output', '__timer',
+                 '__filling', '__stopped'}
+
+    def __init__(self, loop, runner, offload = False):
+        self.__loop = loop
+        self.__runner = runner
+        self.__offload = offload
+        self.__output = None
+        self.__timer = None
+        self.__filling = False
+        self.__stopped = False
+
+    def start(self):
+        runner = self.__runner
+        runner.open()
+        runner.running = True
+        runner.init()
+        self.__output = OutputTask(self.__loop, runner.renderer)
+        self.__output.prepare(runner.panel)
+        runner.scheduler.start()
+        self.__timer = self.__loop.call_soon(self.__frame)
+
+    def __frame(self):
+        scheduler = self.__runner.scheduler
+        scheduler.begin_frame()
+        if scheduler.fill_due:
+            if self.__offload:
+                self.__filling = True
+                self.__loop.run_in_executor(self.__runner.fill_frame, self.__filled)
+                return
+            self.__runner.fill_frame()
+        self.__end_frame()
+
+    def __filled(self, result, error):
+        self.__filling = False
+        if error is not None:
+            _reraise(error)
+        if self.__stopped:
+            self.__close()
+        else:
+            self.__end_frame()
+
+    def __end_frame(self):
+        runner = self.__runner
+        scheduler = runner.scheduler
+        if scheduler.render_due:
+            if self.__output.renderer is not runner.renderer:
+                self.__output.stop()
+                self.__output = OutputTask(self.__loop, runner.renderer)
+            start = monotonic()
+            self.__output.render(runner.panel)
+            scheduler.record_render(monotonic() - start)
+        self.__timer = self.__loop.call_at(scheduler.finish_frame(), self.__frame)
+
+    def stop(self):
+        """ Stops driving the runner, and closes it on the executor once any
+        fill in progress has finished.
+        """
+        if self.__stopped:
+            return
+        self.__stopped = True
+        self.__runner.running = False
+        if self.__timer is not None:
+            self.__timer.cancel()
+        if not self.__filling:
+            self.__close()
+
+    def __close(self):
+        if self.__output is not None:
+            self.__output.stop()
+        self.__loop.run_in_executor(self.__runner.stop, self.__closed)
+
+    def __closed(self, result, error):
+        if error is not None:
+            _reraise(error)
+
+    @property
+    def runner(self):
+        return self.__runner
+
+    @property
+    def output(self):
+        return self.__output
+
+    def __repr__(self):
+        return "RunnerTask<%r>" % self.__runner
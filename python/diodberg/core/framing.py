@@ -0,0 +1,395 @@
+# Compact framed serial protocol between the Pi and the firmware sketches, an
+# alternative to raw DMX for slow links. Every frame carries one universe's
+# channel range, either absolute (raw or run-length encoded) or as a
+# run-length encoded XOR delta against the previous frame of that universe:
+#
+#   offset  size  field
+#   0       2     sync, 0xD1 0xB0
+#   2       1     encoding: FRAME_RAW, FRAME_RLE or FRAME_XOR, or'd with
+#                 FRAME_KEY for a keyframe
+#   3       1     universe
+#   4       1     sequence, per universe, incremented by every frame
+#   5       2     first channel (big-endian)
+#   7       2     channel count (big-endian)
+#   9       2     payload length (big-endian)
+#   11      n     payload
+#   11 + n  2     CRC-16/CCITT-FALSE of bytes 2 .. 11 + n (big-endian)
+#
+# Run-length payloads are a sequence of blocks: a control byte c < 128 is
+# followed by c + 1 literal bytes, and c >= 128 by one byte repeated c - 125
+# (3 to 130) times. A frame only applies if the receiver applied the previous
+# sequence number of its universe, except keyframes: absolute frames of the
+# whole universe that always apply, so that the periodic keyframes
+# resynchronize a receiver that lost frames.
+#
+# The firmware decoder is in firmware/libraries/DiodbergFrame.
+
+import binascii
+import numpy as np
+
+from diodberg.core.patch import DMX_UNIVERSE_SIZE
+
+
+FRAME_SYNC = b"\xD1\xB0"
+FRAME_RAW = 0
+FRAME_RLE = 1
+FRAME_XOR = 2
+FRAME_KEY = 0x80
+
+FRAME_HEADER_BYTES = 11
+FRAME_CRC_BYTES = 2
+FRAME_OVERHEAD = FRAME_HEADER_BYTES + FRAME_CRC_BYTES
+
+_max_literal = 128
+_min_repeat = 3
+_max_repeat = 130
+
+
+def crc16(data):
+    """ CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF) of data.
+    """
+    return binascii.crc_hqx(bytes(data), 0xFFFF)
+
+
+def rle_encode(data):
+    """ Run-length encodes a uint8 array, returning the payload as bytes.
+    Runs shorter than three bytes are kept in literal blocks.
+    """
+    data = np.asarray(data, dtype = np.uint8)
+    count = len(data)
+    if count == 0:
+        return b""
+    starts = np.flatnonzero(np.diff(data)) + 1
+    starts = np.concatenate(([0], starts))
+    lengths = np.diff(np.concatenate((starts, [count])))
+    runs = lengths >= _min_repeat
+    out = bytearray()
+    raw = data.tobytes()
+    literal = 0
+    for start, length in zip(starts[runs].tolist(), lengths[runs].tolist()):
+        # Flush the literals before this run, then the run itself.
+        _literals(out, raw, literal, start)
+        value = raw[start]
+        end = start + length
+        while end - start >= _min_repeat:
+            size = min(end - start, _max_repeat)
+            out.append(size + 125)
+            out += value
+            start += size
+        literal = start
+    _literals(out, raw, literal, count)
+    return bytes(out)
+
+
+def _literals(out, raw, start, stop):
+    while start < stop:
+        size = min(stop - start, _max_literal)
+        out.append(size - 1)
+        out += raw[start:start + size]
+        start += size
+
+
+def rle_decode(payload, count):
+    """ Decodes a run-length payload into a uint8 array of count bytes. Raises
+    ValueError if the payload doesn't decode to exactly count bytes.
+    """
+    payload = bytearray(payload)
+    out = np.empty(count, dtype = np.uint8)
+    i = j = 0
+    end = len(payload)
+    while i < end:
+        control = payload[i]
+        if control < 128:
+            size = control + 1
+            if i + 1 + size > end or j + size > count:
+                raise ValueError("Literal block overruns the frame.")
+            out[j:j + size] = payload[i + 1:i + 1 + size]
+            i += 1 + size
+        else:
+            size = control - 125
+            if i + 1 >= end or j + size > count:
+                raise ValueError("Repeat block overruns the frame.")
+            out[j:j + size] = payload[i + 1]
+            i += 2
+        j += size
+    if j != count:
+        raise ValueError("Payload decodes to %d bytes, expected %d." % (j, count))
+    return out
+
+
+def frame(encoding, universe, sequence, offset, count, payload):
+    """ Returns the bytes of a frame, header and CRC included.
+    """
+    length = len(payload)
+    body = bytes(bytearray([encoding, universe, sequence,
+                            offset >> 8, offset & 0xFF,
+                            count >> 8, count & 0xFF,
+                            length >> 8, length & 0xFF])) + payload
+    crc = crc16(body)
+    return FRAME_SYNC + body + bytes(bytearray([crc >> 8, crc & 0xFF]))
+
+
+class FrameEncoder(object):
+    """ FrameEncoder turns universe buffers into frames, keeping the last
+    channels sent and the sequence number of each universe. encode() sends the
+    smallest of a raw, run-length or XOR delta encoding of the channels that
+    changed, or a full absolute frame (a keyframe) when asked to or when the
+    universe hasn't been sent yet.
+
+    The encoder's state must follow what was actually written, so it belongs
+    to whoever writes the port (e.g. a SerialWriter), not to the renderer.
+    """
+
+    __slots__ = {'__sent', '__sequence', '__stats'}
+
+    def __init__(self):
+        self.__sent = {}
+        self.__sequence = {}
+        self.__stats = {'frames': 0, 'keyframes': 0, 'bytes': 0,
+                        'channels': 0, FRAME_RAW: 0, FRAME_RLE: 0, FRAME_XOR: 0}
+
+    def encode(self, universe, channels, keyframe = False):
+        """ Returns the frame for a universe's channels (a uint8 array of up to
+        512), or b"" if nothing changed since the last frame.
+        """
+        if not 0 <= universe < 256:
+            raise ValueError("Universe %d can't be framed (0 - 255)." % universe)
+        channels = np.asarray(channels, dtype = np.uint8)
+        previous = self.__sent.get(universe)
+        if previous is None or len(previous) != len(channels):
+            keyframe = True
+        if keyframe:
+            offset, stop = 0, len(channels)
+            delta = None
+        else:
+            delta = channels ^ previous
+            changed = np.flatnonzero(delta)
+            if len(changed) == 0:
+                return b""
+            offset, stop = int(changed[0]), int(changed[-1]) + 1
+            delta = delta[offset:stop]
+        data = channels[offset:stop]
+        encoding, payload = FRAME_RAW, data.tobytes()
+        rle = rle_encode(data)
+        if len(rle) < len(payload):
+            encoding, payload = FRAME_RLE, rle
+        if delta is not None:
+            xor = rle_encode(delta)
+            if len(xor) < len(payload):
+                encoding, payload = FRAME_XOR, xor
+        sequence = (self.__sequence.get(universe, -1) + 1) % 256
+        self.__sequence[universe] = sequence
+        self.__sent[universe] = channels.copy()
+        packet = frame(encoding | (FRAME_KEY if keyframe else 0), universe,
+                       sequence, offset, stop - offset, payload)
+        stats = self.__stats
+        stats['frames'] += 1
+        stats['keyframes'] += keyframe
+        stats['bytes'] += len(packet)
+        stats['channels'] += stop - offset
+        stats[encoding] += 1
+        return packet
+
+    def reset(self):
+        """ Forgets what was sent, so every universe's next frame is a keyframe.
+        """
+        self.__sent.clear()
+
+    @property
+    def stats(self):
+        """ Frames, keyframes, bytes and channels encoded, and frames per
+        encoding (keyed by FRAME_RAW, FRAME_RLE and FRAME_XOR).
+        """
+        return dict(self.__stats)
+
+    def __repr__(self):
+        return "FrameEncoder<universes = %s>" % sorted(self.__sent)
+
+
+class FrameDecoder(object):
+    """ FrameDecoder is the reference receiver: feed() it the byte stream from
+    the port, in chunks of any size, and it keeps the 512 channels of each
+    universe as the firmware would. Frames with a bad CRC are skipped by
+    searching for the next sync; XOR frames that don't follow the universe's
+    last applied sequence number are dropped until the next keyframe.
+    """
+
+    __slots__ = {'__buffer', '__universes', '__sequence', '__stats'}
+
+    __max_payload = DMX_UNIVERSE_SIZE + (DMX_UNIVERSE_SIZE + _max_literal - 1)//_max_literal
+
+    def __init__(self):
+        self.__buffer = bytearray()
+        self.__universes = {}
+        self.__sequence = {}
+        self.__stats = {'frames': 0, 'crc_errors': 0, 'bad_frames': 0,
+                        'out_of_sequence': 0, 'skipped_bytes': 0}
+
+    def feed(self, data):
+        """ Consumes bytes and returns the list of universes updated, in the
+        order their frames were applied.
+        """
+        buf = self.__buffer
+        buf += data
+        updated = []
+        stats = self.__stats
+        i = 0
+        while True:
+            start = buf.find(FRAME_SYNC, i)
+            if start < 0:
+                # Keep a trailing first sync byte, it may be completed later.
+                keep = len(buf) - 1 if buf[-1:] == FRAME_SYNC[:1] else len(buf)
+                stats['skipped_bytes'] += keep - i
+                i = keep
+                break
+            stats['skipped_bytes'] += start - i
+            if len(buf) - start < FRAME_HEADER_BYTES:
+                i = start
+                break
+            length = buf[start + 9] << 8 | buf[start + 10]
+            if length > FrameDecoder.__max_payload:
+                stats['bad_frames'] += 1
+                i = start + 1
+                continue
+            end = start + FRAME_HEADER_BYTES + length + FRAME_CRC_BYTES
+            if len(buf) < end:
+                i = start
+                break
+            crc = buf[end - 2] << 8 | buf[end - 1]
+            if crc16(buf[start + 2:end - 2]) != crc:
+                stats['crc_errors'] += 1
+                i = start + 1
+                continue
+            universe = self.__apply(buf[start + 2:end - 2])
+            if universe is not None:
+                updated.append(universe)
+            i = end
+        del buf[:i]
+        return updated
+
+    def __apply(self, body):
+        stats = self.__stats
+        encoding, universe, sequence = body[0], body[1], body[2]
+        keyframe = encoding & FRAME_KEY
+        encoding &= ~FRAME_KEY
+        offset = body[3] << 8 | body[4]
+        count = body[5] << 8 | body[6]
+        payload = body[9:]
+        if offset + count > DMX_UNIVERSE_SIZE or encoding > FRAME_XOR or \
+           (keyframe and encoding == FRAME_XOR):
+            stats['bad_frames'] += 1
+            return None
+        if not keyframe and self.__sequence.get(universe) != (sequence - 1) % 256:
+            stats['out_of_sequence'] += 1
+            return None
+        try:
+            if encoding == FRAME_RAW:
+                if len(payload) != count:
+                    raise ValueError("Raw payload length mismatch.")
+                data = np.frombuffer(bytes(payload), dtype = np.uint8)
+            else:
+                data = rle_decode(payload, count)
+        except ValueError:
+            stats['bad_frames'] += 1
+            return None
+        channels = self.__universes.get(universe)
+        if channels is None:
+            channels = np.zeros(DMX_UNIVERSE_SIZE, dtype = np.uint8)
+            self.__universes[universe] = channels
+        if encoding == FRAME_XOR:
+            channels[offset:offset + count] ^= data
+        else:
+            channels[offset:offset + count] = data
+        self.__sequence[universe] = sequence
+        stats['frames'] += 1
+        return universe
+
+    def universe(self, universe):
+        """ The 512 channels of a universe, zeros if nothing was received.
+        """
+        channels = self.__universes.get(universe)
+        if channels is None:
+            return np.zeros(DMX_UNIVERSE_SIZE, dtype = np.uint8)
+        return channels
+
+    @property
+    def universes(self):
+        return sorted(self.__universes)
+
+    @property
+    def pending(self):
+        """ Bytes buffered while waiting for the rest of a frame.
+        """
+        return len(self.__buffer)
+
+    @property
+    def stats(self):
+        """ Frames applied, and frames rejected for a bad CRC, a malformed
+        header or payload, or a broken XOR sequence, plus bytes skipped while
+        searching for a sync.
+        """
+        return dict(self.__stats)
+
+    def __repr__(self):
+        return "FrameDecoder<universes = %s>" % self.universes
+
+
+def fuzz(frames = 1000, universes = 4, corrupt = 0.05, seed = 0):
+    """ Round-trips random universe updates through a FrameEncoder and a
+    FrameDecoder, corrupting about corrupt of the frames on the way (a flipped
+    byte, a truncation or a dropped frame), with a keyframe of each universe
+    every 16 rounds.
+    Raises AssertionError if a frame that arrived intact decodes to anything
+    but what was encoded (once the decoder has caught up with the stream), or
+    if the decoder hasn't resynchronized after two final rounds of keyframes.
+    Returns the encoder's and decoder's stats.
+    """
+    rng = np.random.RandomState(seed)
+    encoder = FrameEncoder()
+    decoder = FrameDecoder()
+    state = np.zeros((universes, DMX_UNIVERSE_SIZE), dtype = np.uint8)
+    broken = set()
+    for n in xrange(frames + 2*universes):
+        universe = n % universes
+        final = n >= frames
+        if not final:
+            # Sparse changes, runs, noise or a single channel.
+            kind = rng.randint(4)
+            start = rng.randint(DMX_UNIVERSE_SIZE)
+            stop = min(DMX_UNIVERSE_SIZE, start + rng.randint(1, 200))
+            if kind == 0:
+                index = rng.randint(DMX_UNIVERSE_SIZE, size = rng.randint(1, 8))
+                state[universe, index] = rng.randint(256, size = len(index))
+            elif kind == 1:
+                state[universe, start:stop] = rng.randint(256)
+            elif kind == 2:
+                state[universe, start:stop] = rng.randint(256, size = stop - start)
+            else:
+                state[universe, start] ^= 1
+        keyframe = final or (n // universes) % 16 == 0
+        packet = encoder.encode(universe, state[universe], keyframe)
+        if not packet:
+            continue
+        intact = final or rng.random_sample() >= corrupt
+        if not intact:
+            packet = bytearray(packet)
+            damage = rng.randint(3)
+            if damage == 0:
+                packet[rng.randint(len(packet))] ^= 1 << rng.randint(8)
+            elif damage == 1:
+                packet = packet[:rng.randint(len(packet))]
+            else:
+                packet = b""
+            packet = bytes(packet)
+        decoder.feed(packet)
+        if keyframe and intact:
+            broken.discard(universe)
+        elif not intact:
+            broken.add(universe)
+        if universe not in broken and not decoder.pending:
+            assert (decoder.universe(universe) == state[universe]).all(), \
+                "Universe %d diverged at frame %d." % (universe, n)
+    assert not broken and not decoder.pending
+    for universe in xrange(universes):
+        assert (decoder.universe(universe) == state[universe]).all()
+    return encoder.stats, decoder.stats
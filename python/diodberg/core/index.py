@@ -0,0 +1,233 @@
+# Lookup structures derived from a panel's layout: live pixels by DMX universe
+# and by position in a uniform grid for neighbor and radius queries (PanelIndex,
+# a snapshot built in a few vectorized passes), and cells by group (GroupIndex,
+# kept up to date as pixels change group). They are shared by everything that
+# uses the layout; see PanelLayout.index and PanelLayout.groups.
+#
+# Pixels are identified by their flat index i = y*width + x, as in
+# panel.color_plane.reshape(-1, 3) and the effect kernels.
+
+import numpy as np
+
+
+def _buckets(keys, values):
+    """ Groups values by keys. Returns (sorted unique keys, start offsets into
+    the grouped values, grouped values), values keeping their order within a
+    key.
+    """
+    order = np.argsort(keys, kind = 'mergesort')
+    keys = keys[order]
+    starts = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    if len(keys):
+        starts = np.append(0, starts)
+    return keys[starts], np.append(starts, len(keys)), values[order]
+
+
+class PanelIndex(object):
+    """ PanelIndex is built from a PanelLayout's planes and indexes its live
+    pixels two ways:
+
+    - universe(u): the live pixels on DMX universe u and their addresses,
+      in address order;
+    - within(x, y, radius) and nearest(x, y, count): spatial queries answered
+      from a uniform grid of cell x cell buckets.
+
+    The index is a snapshot: is_current() tells whether the layout has changed
+    since it was built. Groups are indexed separately, by GroupIndex.
+    """
+
+    __slots__ = {'__width', '__height', '__revision', '__live', '__universes',
+                 '__cell', '__grid_width', '__grid_height', '__grid_starts',
+                 '__grid_pixels'}
+
+    def __init__(self, layout, cell = 16):
+        height, width = layout.live_plane.shape
+        self.__width = width
+        self.__height = height
+        self.__revision = layout.revision
+        live = layout.live_cells
+        self.__live = live
+        # Universes, as {universe: (start, stop)} into grouped arrays.
+        universes = layout.universe_plane.reshape(-1)[live]
+        addresses = layout.address_plane.reshape(-1)[live]
+        # One sort on a combined key, rather than a lexsort.
+        order = np.argsort((universes.astype(np.int64) << 32) + addresses, 
+                           kind = 'mergesort')
+        keys, starts, pixels = _buckets(universes[order], live[order])
+        self.__universes = (dict((int(k), (s, e)) for k, s, e in
+                                 zip(keys, starts[:-1], starts[1:])),
+                            pixels, addresses[order])
+        # The grid is a CSR table: the pixels of bucket b are
+        # grid_pixels[grid_starts[b]:grid_starts[b + 1]]. Padding the panel to
+        # whole cells, buckets are a reshape away, with no sort.
+        self.__cell = cell
+        grid_width = self.__grid_width = -(-width//cell)
+        grid_height = self.__grid_height = -(-height//cell)
+        cells = np.empty((grid_height*cell, grid_width*cell), dtype = live.dtype)
+        cells.fill(-1)
+        cells[:height, :width] = np.where(layout.live_plane, 
+                                          np.arange(width*height).reshape(height, width), 
+                                          -1)
+        cells = cells.reshape(grid_height, cell, grid_width, cell).swapaxes(1, 2)
+        cells = cells.reshape(grid_height*grid_width, cell*cell)
+        used = cells >= 0
+        self.__grid_pixels = cells[used]
+        self.__grid_starts = np.append(0, np.cumsum(used.sum(axis = 1)))
+
+    def is_current(self, layout):
+        """ Was this index built from the layout's current planes?
+        """
+        return layout.revision == self.__revision
+
+    @property
+    def revision(self):
+        return self.__revision
+
+    @property
+    def live(self):
+        """ Flat indices of the live pixels, ascending.
+        """
+        return self.__live
+
+    @property
+    def universes(self):
+        """ Sorted DMX universes with live pixels.
+        """
+        return sorted(self.__universes[0])
+
+    def universe(self, universe):
+        """ Returns (flat indices, DMX addresses) of the live pixels on a
+        universe, in address order.
+        """
+        ranges, pixels, addresses = self.__universes
+        start, stop = ranges.get(universe, (0, 0))
+        return pixels[start:stop], addresses[start:stop]
+
+    def positions(self, pixels):
+        """ Returns the (x, y) arrays of flat pixel indices.
+        """
+        return pixels % self.__width, pixels//self.__width
+
+    def within(self, x, y, radius):
+        """ Flat indices of the live pixels within radius of (x, y), nearest
+        first.
+        """
+        cell = self.__cell
+        x0 = max(int(np.floor((x - radius)/cell)), 0)
+        x1 = min(int(np.floor((x + radius)/cell)), self.__grid_width - 1)
+        y0 = max(int(np.floor((y - radius)/cell)), 0)
+        y1 = min(int(np.floor((y + radius)/cell)), self.__grid_height - 1)
+        if x0 > x1 or y0 > y1:
+            return np.zeros(0, dtype = self.__live.dtype)
+        starts = self.__grid_starts
+        rows = np.arange(y0, y1 + 1)*self.__grid_width
+        # Buckets of a grid row are contiguous, so each row is one slice.
+        candidates = np.concatenate([self.__grid_pixels[starts[row + x0]:
+                                                        starts[row + x1 + 1]]
+                                     for row in rows])
+        px, py = self.positions(candidates)
+        distance = (px - x)**2 + (py - y)**2
+        inside = distance <= radius*radius
+        candidates, distance = candidates[inside], distance[inside]
+        return candidates[np.argsort(distance, kind = 'mergesort')]
+
+    def nearest(self, x, y, count = 1):
+        """ Flat indices of the count live pixels nearest to (x, y), nearest
+        first (fewer if the panel has fewer live pixels).
+        """
+        count = min(count, len(self.__live))
+        if count == 0:
+            return np.zeros(0, dtype = self.__live.dtype)
+        # Widen the search until it holds count pixels: every pixel closer than
+        # the count-th one found is then inside the searched radius.
+        radius = float(self.__cell)
+        limit = np.hypot(self.__width, self.__height) + abs(x) + abs(y)
+        while True:
+            found = self.within(x, y, radius)
+            if len(found) >= count or radius > limit:
+                return found[:count]
+            radius *= 2
+
+    def __len__(self):
+        return len(self.__live)
+
+    def __repr__(self):
+        return "PanelIndex<%d live pixels, %d universes>" % (
+            len(self.__live), len(self.__universes[0]))
+
+
+class GroupIndex(object):
+    """ GroupIndex maps group ids (e.g. climbing routes) to the cells in them,
+    live or not, so that a group can be updated without scanning the panel.
+    A cell belongs to its group in the group plane, plus any extra groups;
+    see PanelLayout.set_groups.
+
+    Unlike PanelIndex, it is built once and then maintained: the layout calls
+    add and remove as pixels change group. Changes are queued per group and
+    merged into its sorted cell array on the next members() call, so a move
+    costs O(1) and a lookup O(group size).
+    """
+
+    __slots__ = {'__members', '__pending'}
+
+    def __init__(self, group_plane, extra_groups = None):
+        cells = np.arange(group_plane.size)
+        keys, starts, cells = _buckets(group_plane.reshape(-1), cells)
+        self.__members = dict((int(k), cells[s:e]) for k, s, e in
+                              zip(keys, starts[:-1], starts[1:]))
+        self.__pending = {}
+        for cell, groups in (extra_groups or {}).iteritems():
+            for group in groups:
+                self.add(group, cell)
+
+    def __changes(self, group):
+        changes = self.__pending.get(group)
+        if changes is None:
+            changes = self.__pending[group] = (set(), set())
+        return changes
+
+    def add(self, group, cell):
+        """ Adds a flat cell index to a group.
+        """
+        added, removed = self.__changes(group)
+        added.add(cell)
+        removed.discard(cell)
+
+    def remove(self, group, cell):
+        """ Removes a flat cell index from a group.
+        """
+        added, removed = self.__changes(group)
+        removed.add(cell)
+        added.discard(cell)
+
+    def members(self, group):
+        """ Sorted flat indices of the cells in a group (empty if none).
+        """
+        cells = self.__members.get(group)
+        if group in self.__pending:
+            added, removed = self.__pending.pop(group)
+            if cells is None:
+                cells = np.zeros(0, dtype = np.intp)
+            if removed:
+                cells = cells[~np.in1d(cells, list(removed))]
+            if added:
+                cells = np.union1d(cells, list(added)).astype(np.intp)
+            if len(cells):
+                self.__members[group] = cells
+            else:
+                self.__members.pop(group, None)
+                cells = None
+        return np.zeros(0, dtype = np.intp) if cells is None else cells
+
+    @property
+    def groups(self):
+        """ Sorted ids of the groups with cells.
+        """
+        return sorted(group for group in set(self.__members) | set(self.__pending)
+                      if len(self.members(group)))
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __repr__(self):
+        return "GroupIndex<%d groups>" % len(self)
@@ -0,0 +1,287 @@
+# Low-overhead frame instrumentation: fixed-size timing histograms and counters
+# that runners, the controller and renderers record into every frame, periodic
+# dumps of them as JSON lines, and an opt-in yappi profiling window.
+
+import json
+import logging
+import math
+import sys
+import threading
+import time
+
+from diodberg.util.utils import monotonic
+
+use_yappi = False
+try:
+    import yappi
+    use_yappi = True
+except ImportError as err:
+    sys.stderr.write("Error: failed to import module ({})".format(err))
+
+
+# Standard timer names.
+FILL = "fill"
+COMPOSITE = "composite"
+ENCODE = "encode"
+WRITE = "write"
+
+
+class Histogram(object):
+    """ Histogram keeps a fixed number of log-spaced buckets of durations in
+    seconds, from lowest up to highest, with buckets_per_decade buckets per
+    factor of ten; anything outside lands in the first or last bucket.
+    Recording a value is O(1) and never allocates, so it is cheap enough to
+    call several times per frame. Percentiles are accurate to about a bucket
+    width (12% with the default 20 buckets per decade).
+
+    Histograms are locked, as renderers record into them from executor and
+    writer threads as well as from their frame loops.
+    """
+
+    __slots__ = {'__lowest', '__scale', '__counts', '__count', '__total',
+                 '__max', '__lock'}
+
+    def __init__(self, lowest = 1e-6, highest = 10., buckets_per_decade = 20):
+        self.__lowest = lowest
+        self.__scale = buckets_per_decade
+        buckets = int(math.ceil(math.log10(highest/lowest)*buckets_per_decade))
+        self.__counts = [0]*(buckets + 1)
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            for i in xrange(len(self.__counts)):
+                self.__counts[i] = 0
+            self.__count = 0
+            self.__total = 0.
+            self.__max = 0.
+
+    def record(self, seconds):
+        if seconds > self.__lowest:
+            bucket = int(math.log10(seconds/self.__lowest)*self.__scale) + 1
+            bucket = min(bucket, len(self.__counts) - 1)
+        else:
+            bucket = 0
+        with self.__lock:
+            self.__counts[bucket] += 1
+            self.__count += 1
+            self.__total += seconds
+            if seconds > self.__max:
+                self.__max = seconds
+
+    def percentile(self, p):
+        """ Returns the p'th percentile (p in [0, 100]) in seconds, as the
+        geometric center of the bucket it falls in.
+        """
+        with self.__lock:
+            return self.__percentile(p)
+
+    def __percentile(self, p):
+        if self.__count == 0:
+            return 0.
+        rank = p/100.*self.__count
+        seen = 0
+        for bucket, count in enumerate(self.__counts):
+            seen += count
+            if count and seen >= rank:
+                break
+        if bucket == 0:
+            return min(self.__lowest, self.__max)
+        center = self.__lowest*10**((bucket - 0.5)/self.__scale)
+        return min(center, self.__max)
+
+    @property
+    def count(self):
+        return self.__count
+
+    @property
+    def mean(self):
+        return self.__total/self.__count if self.__count else 0.
+
+    @property
+    def max(self):
+        return self.__max
+
+    def summary(self):
+        """ Returns {count, mean, p50, p95, p99, max}, times in seconds.
+        """
+        with self.__lock:
+            return {'count': self.__count,
+                    'mean': self.__total/self.__count if self.__count else 0.,
+                    'p50': self.__percentile(50),
+                    'p95': self.__percentile(95),
+                    'p99': self.__percentile(99),
+                    'max': self.__max}
+
+    def __repr__(self):
+        return "Histogram<count = %d, p50 = %0.6fs>" % (self.__count,
+                                                       self.percentile(50))
+
+
+class Instruments(object):
+    """ Instruments is a registry of named timing Histograms and counters, shared
+    by a Controller with its runners and renderer. Timers are usually FILL (per
+    runner, as "fill/<name>"), COMPOSITE, ENCODE and WRITE; counters include
+    bytes written per DMX universe.
+
+    Use the timers in a frame loop as:
+
+        start = monotonic()
+        ...
+        instruments.record(ENCODE, monotonic() - start)
+    """
+
+    __slots__ = {'__timers', '__counters', '__universe_bytes', '__lock',
+                 '__started'}
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__timers = {}
+        self.__counters = {}
+        self.__universe_bytes = {}
+        self.__started = monotonic()
+
+    def timer(self, name):
+        """ Returns the Histogram for a timer, creating it on first use.
+        """
+        histogram = self.__timers.get(name)
+        if histogram is None:
+            with self.__lock:
+                histogram = self.__timers.setdefault(name, Histogram())
+        return histogram
+
+    def record(self, name, seconds):
+        """ Records one duration for a timer.
+        """
+        self.timer(name).record(seconds)
+
+    def count(self, name, n = 1):
+        """ Adds n to a counter.
+        """
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + n
+
+    def count_bytes(self, universe, n):
+        """ Adds n to the bytes written for a DMX universe.
+        """
+        with self.__lock:
+            self.__universe_bytes[universe] = self.__universe_bytes.get(universe, 0) + n
+
+    def reset(self):
+        with self.__lock:
+            for histogram in self.__timers.itervalues():
+                histogram.reset()
+            self.__counters.clear()
+            self.__universe_bytes.clear()
+            self.__started = monotonic()
+
+    def snapshot(self):
+        """ Returns the current values as a JSON-serializable dict: timers
+        ({name: Histogram.summary()}), counters, bytes_per_universe and the
+        seconds elapsed since the last reset.
+        """
+        with self.__lock:
+            timers = dict(self.__timers)
+            counters = dict(self.__counters)
+            universe_bytes = dict((str(u), n) for u, n in
+                                  self.__universe_bytes.iteritems())
+        return {'elapsed_s': monotonic() - self.__started,
+                'timers': dict((name, h.summary()) for name, h in timers.iteritems()),
+                'counters': counters,
+                'bytes_per_universe': universe_bytes}
+
+    def __repr__(self):
+        return "Instruments<%s>" % sorted(self.__timers)
+
+
+class StatsDump(object):
+    """ StatsDump writes the dict returned by stats() (e.g. Controller.stats) at
+    most once per interval seconds, either as one JSON line appended to a file
+    or as an info message on a logging.Logger.
+    """
+
+    __slots__ = {'__target', '__intervalS', '__last', '__stats'}
+
+    def __init__(self, stats, target, interval = 10.):
+        self.__stats = stats
+        self.__target = target
+        self.__intervalS = interval
+        self.__last = monotonic()
+
+    def poll(self, now = None):
+        """ Writes a snapshot if the interval has passed.
+        """
+        now = monotonic() if now is None else now
+        if now - self.__last < self.__intervalS:
+            return
+        self.__last = now
+        self.write()
+
+    def write(self):
+        stats = self.__stats()
+        stats['time'] = time.time()
+        line = json.dumps(stats, sort_keys = True)
+        if isinstance(self.__target, logging.Logger):
+            self.__target.info(line)
+        else:
+            with open(self.__target, 'a') as f:
+                f.write(line + "\n")
+
+    def __repr__(self):
+        return "StatsDump<%s, %0.1fs>" % (self.__target, self.__intervalS)
+
+
+class Profiler(object):
+    """ Profiler turns yappi on for a window of frames: arm(frames) starts it,
+    and after frame() has been called that many times (or at stop(), if frames
+    is None) it is stopped and the stats are printed, or saved in pstat format
+    if a filename was given. Without yappi, arm() only warns.
+    """
+
+    __slots__ = {'__remaining', '__filename', '__armed'}
+
+    def __init__(self):
+        self.__remaining = None
+        self.__filename = None
+        self.__armed = False
+
+    def arm(self, frames = None, filename = None):
+        if not use_yappi:
+            sys.stderr.write("Warning: yappi isn't available; not profiling.\n")
+            return
+        self.stop()
+        self.__remaining = frames
+        self.__filename = filename
+        self.__armed = True
+        yappi.clear_stats()
+        yappi.start()
+
+    def frame(self):
+        """ Counts down one frame of an armed window.
+        """
+        if not self.__armed or self.__remaining is None:
+            return
+        self.__remaining -= 1
+        if self.__remaining <= 0:
+            self.stop()
+
+    def stop(self):
+        """ Ends the window and reports the stats.
+        """
+        if not self.__armed:
+            return
+        self.__armed = False
+        yappi.stop()
+        stats = yappi.get_func_stats()
+        if self.__filename is None:
+            stats.sort("tsub").print_all(out = sys.stdout)
+        else:
+            stats.save(self.__filename, type = "pstat")
+
+    @property
+    def active(self):
+        return self.__armed
+
+    def __repr__(self):
+        return "Profiler<active = %s>" % self.__armed
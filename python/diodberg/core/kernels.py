@@ -0,0 +1,302 @@
+# Effect kernels written against flat arrays of colors. Every kernel has a
+# vectorized NumPy backend and, when numba is installed, a loop backend compiled
+# with numba.njit. A self-test checks that the backends agree and picks the
+# fastest one for each kernel. It runs (and numba compiles) on the first lookup,
+# so runners that use kernels call selected() from open(), before their first
+# frame.
+#
+# Kernels take colors as a contiguous (N, 3) uint8 array, e.g.
+# panel.color_plane.reshape(-1, 3), and update it in place. Pixel i sits at
+# x = i % width, y = i // width.
+
+import sys
+import time
+import numpy as np
+
+from diodberg.core.types import COLOR_HUE_MAX
+from diodberg.core.types import hsv_to_rgb
+from diodberg.core.types import rgb_to_hsv
+
+use_numba = False
+try:
+    from numba import njit
+    use_numba = True
+except ImportError as err:
+    sys.stderr.write("Error: failed to import module ({})".format(err))
+
+
+NUMPY = "numpy"
+NUMBA = "numba"
+
+_kernels = {}       # name -> {backend: function}
+_selected = {}      # name -> backend
+_timings = {}       # name -> {backend: seconds}
+
+
+def register(name, backend):
+    """ Decorator that registers a kernel implementation for a backend. NUMBA
+    implementations are compiled with numba.njit, and skipped if numba isn't
+    available.
+    """
+    def decorator(func):
+        if backend == NUMBA:
+            if not use_numba:
+                return func
+            impl = njit(cache = False)(func)
+        else:
+            impl = func
+        _kernels.setdefault(name, {})[backend] = impl
+        _selected.pop(name, None)
+        return func
+    return decorator
+
+
+def names():
+    """ Names of all registered kernels.
+    """
+    return sorted(_kernels)
+
+
+def backends(name):
+    """ Backends available for a kernel.
+    """
+    return sorted(_kernels[name])
+
+
+def get(name, backend = None):
+    """ Returns the implementation of a kernel, for a specific backend or the one
+    picked by the self-test.
+    """
+    if backend is None:
+        if name not in _selected:
+            select_backends()
+        backend = _selected[name]
+    return _kernels[name][backend]
+
+
+def selected():
+    """ Returns {kernel name: backend} as picked by the self-test.
+    """
+    if len(_selected) < len(_kernels):
+        select_backends()
+    return dict(_selected)
+
+
+def timings():
+    """ Returns {kernel name: {backend: seconds}} from the last self-test.
+    """
+    return dict((name, dict(t)) for name, t in _timings.iteritems())
+
+
+# Self-test arguments for each kernel, after the colors array and width.
+_test_args = {}
+
+# Kernels whose result for a pixel doesn't depend on where it is, so they can
+# run on a gathered subset of pixels; see run_live. noise is seeded by array
+# index, so over a subset it gives a different but equally random pattern.
+_position_free = set(['hue_cycle', 'fade', 'noise'])
+
+
+def run_live(name, panel, *args):
+    """ Runs a kernel over the live pixels of a panel only: gathers their
+    colors, runs the kernel on them and scatters them back, so the cost
+    follows the live pixel count rather than the panel area. Raises
+    ValueError for kernels that depend on pixel positions.
+    """
+    if name not in _position_free:
+        raise ValueError("Kernel %s depends on pixel positions, so it can't "
+                         "run on the live pixels alone." % name)
+    cells = panel.live_cells
+    colors = panel.live_colors(cells)
+    get(name)(colors, panel.width, *args)
+    panel.set_live_colors(colors, cells)
+
+
+def select_backends(size = (160, 120), repeat = 3):
+    """ Runs every backend of every kernel on the same random frame, checks that
+    the results agree with NumPy to within one step of rounding, and selects
+    the fastest backend that does. Compilation time is excluded.
+    """
+    x, y = size
+    source = np.random.RandomState(0).randint(0, 256, (x*y, 3)).astype(np.uint8)
+    for name, impls in _kernels.iteritems():
+        args = _test_args.get(name, ())
+        reference = source.copy()
+        impls[NUMPY](reference, x, *args)
+        _timings[name] = {}
+        best = None
+        for backend, impl in impls.iteritems():
+            colors = source.copy()
+            impl(colors, x, *args)
+            if np.abs(colors.astype(np.int16) - reference).max() > 1:
+                sys.stderr.write("Warning: %s kernel %s disagrees with numpy; "
+                                 "not using it.\n" % (backend, name))
+                continue
+            elapsed = float("inf")
+            for i in xrange(repeat):
+                colors[...] = source
+                start = time.time()
+                impl(colors, x, *args)
+                elapsed = min(elapsed, time.time() - start)
+            _timings[name][backend] = elapsed
+            if best is None or elapsed < _timings[name][best]:
+                best = backend
+        _selected[name] = best
+
+
+# Hue cycle: rotate every hue by degrees.
+
+_test_args['hue_cycle'] = (20.,)
+
+
+@register('hue_cycle', NUMPY)
+def hue_cycle_numpy(colors, width, degrees):
+    hsv = rgb_to_hsv(colors)
+    hsv[:, 0] = (hsv[:, 0] + degrees) % COLOR_HUE_MAX
+    colors[...] = hsv_to_rgb(hsv)
+
+
+@register('hue_cycle', NUMBA)
+def hue_cycle_numba(colors, width, degrees):
+    shift = degrees/360.
+    for i in range(colors.shape[0]):
+        r = colors[i, 0]/255.
+        g = colors[i, 1]/255.
+        b = colors[i, 2]/255.
+        maxc = max(r, g, b)
+        minc = min(r, g, b)
+        if maxc == minc:
+            continue
+        delta = maxc - minc
+        s = delta/maxc
+        v = maxc
+        rc = (maxc - r)/delta
+        gc = (maxc - g)/delta
+        bc = (maxc - b)/delta
+        if r == maxc:
+            h = bc - gc
+        elif g == maxc:
+            h = 2. + rc - bc
+        else:
+            h = 4. + gc - rc
+        h = ((h/6.) % 1. + shift) % 1.
+        sector = int(h*6.)
+        f = h*6. - sector
+        p = v*(1. - s)
+        q = v*(1. - s*f)
+        t = v*(1. - s*(1. - f))
+        sector = sector % 6
+        if sector == 0:
+            r, g, b = v, t, p
+        elif sector == 1:
+            r, g, b = q, v, p
+        elif sector == 2:
+            r, g, b = p, v, t
+        elif sector == 3:
+            r, g, b = p, q, v
+        elif sector == 4:
+            r, g, b = t, p, v
+        else:
+            r, g, b = v, p, q
+        colors[i, 0] = min(int(r*255. + 0.5), 255)
+        colors[i, 1] = min(int(g*255. + 0.5), 255)
+        colors[i, 2] = min(int(b*255. + 0.5), 255)
+
+
+# Fade: scale every channel by factor.
+
+_test_args['fade'] = (0.75,)
+
+
+@register('fade', NUMPY)
+def fade_numpy(colors, width, factor):
+    scaled = np.floor(colors*factor + 0.5)
+    colors[...] = np.clip(scaled, 0, 255)
+
+
+@register('fade', NUMBA)
+def fade_numba(colors, width, factor):
+    for i in range(colors.shape[0]):
+        for c in range(3):
+            val = int(colors[i, c]*factor + 0.5)
+            colors[i, c] = min(max(val, 0), 255)
+
+
+# Noise: independent pseudo-random channel values from an integer hash of the
+# pixel index and a seed (e.g. the frame number), so every backend agrees.
+
+_test_args['noise'] = (7,)
+_hash_mask = 0xFFFFFFFF
+
+
+@register('noise', NUMPY)
+def noise_numpy(colors, width, seed):
+    index = np.arange(colors.shape[0]*3, dtype = np.uint64)
+    h = (index*np.uint64(2654435761) + np.uint64(seed)*np.uint64(40503)) & np.uint64(_hash_mask)
+    h ^= h >> np.uint64(15)
+    h = (h*np.uint64(2246822519)) & np.uint64(_hash_mask)
+    h ^= h >> np.uint64(13)
+    colors.reshape(-1)[...] = h & np.uint64(0xFF)
+
+
+@register('noise', NUMBA)
+def noise_numba(colors, width, seed):
+    flat = colors.reshape(-1)
+    for i in range(flat.shape[0]):
+        h = (np.uint64(i)*np.uint64(2654435761) + np.uint64(seed)*np.uint64(40503)) & np.uint64(0xFFFFFFFF)
+        h ^= h >> np.uint64(15)
+        h = (h*np.uint64(2246822519)) & np.uint64(0xFFFFFFFF)
+        h ^= h >> np.uint64(13)
+        flat[i] = h & np.uint64(0xFF)
+
+
+# Gradient: a horizontal blend from start to end color and back, scrolled by
+# phase in [0, 1).
+
+_test_args['gradient'] = (np.array([255, 0, 0], dtype = np.float64),
+                          np.array([0, 0, 255], dtype = np.float64),
+                          0.25)
+
+
+@register('gradient', NUMPY)
+def gradient_numpy(colors, width, start, end, phase):
+    x = np.arange(colors.shape[0]) % width
+    t = (x/float(width) + phase) % 1.
+    t = 1. - np.abs(2.*t - 1.)
+    mixed = start + (end - start)*t[:, None]
+    colors[...] = np.floor(mixed + 0.5)
+
+
+@register('gradient', NUMBA)
+def gradient_numba(colors, width, start, end, phase):
+    for i in range(colors.shape[0]):
+        t = ((i % width)/float(width) + phase) % 1.
+        t = 1. - abs(2.*t - 1.)
+        for c in range(3):
+            colors[i, c] = int(start[c] + (end[c] - start[c])*t + 0.5)
+
+
+# Chase: light every spacing'th pixel along each row, offset by step; the rest
+# are set to the background.
+
+_test_args['chase'] = (np.array([255, 255, 255], dtype = np.uint8),
+                       np.array([0, 0, 0], dtype = np.uint8),
+                       5, 3)
+
+
+@register('chase', NUMPY)
+def chase_numpy(colors, width, color, background, spacing, step):
+    lit = (np.arange(colors.shape[0]) % width + step) % spacing == 0
+    colors[...] = background
+    colors[lit] = color
+
+
+@register('chase', NUMBA)
+def chase_numba(colors, width, color, background, spacing, step):
+    for i in range(colors.shape[0]):
+        if ((i % width) + step) % spacing == 0:
+            for c in range(3):
+                colors[i, c] = color[c]
+        else:
+            for c in range(3):
+                colors[i, c] = background[c]
@@ -0,0 +1,106 @@
+# Compiled DMX patching: maps a Panel's live pixels onto per-universe channel
+# buffers once, so that renderers can fill every universe with a single
+# vectorized gather/scatter per frame.
+
+import numpy as np
+
+from diodberg.core.types import COLOR_MAX
+
+
+DMX_UNIVERSE_SIZE = 512
+DMX_CHANNELS_PER_PIXEL = 3
+
+
+class DMXPatchMap(object):
+    """ DMXPatchMap is compiled from a Panel's universe, address and live planes.
+    It owns a preallocated (universes, 512) uint8 buffer, one row per universe,
+    and the flat index arrays that map color plane slots to buffer offsets.
+    Addressing errors (out of range or overlapping channels) are raised as
+    ValueError when the map is built, not when a frame is rendered.
+    """
+
+    __slots__ = {'__universes', '__rows', '__buffers', '__source', '__dest',
+                 '__offsets', '__layout', '__key'}
+
+    def __init__(self, panel, universes = ()):
+        ys, xs = np.nonzero(panel.live_plane)
+        pixel_universes = panel.universe_plane[ys, xs]
+        addresses = panel.address_plane[ys, xs]
+        channels = DMX_CHANNELS_PER_PIXEL
+        bad = (addresses < 0) | (addresses + channels > DMX_UNIVERSE_SIZE)
+        if bad.any():
+            i = np.flatnonzero(bad)[0]
+            raise ValueError("Live pixel at (%d, %d) has DMX address %d, outside "
+                             "of [0, %d]." % (xs[i], ys[i], addresses[i],
+                                              DMX_UNIVERSE_SIZE - channels))
+        self.__universes = sorted(set(int(u) for u in universes) |
+                                  set(pixel_universes.tolist()))
+        self.__rows = dict((u, i) for i, u in enumerate(self.__universes))
+        self.__buffers = np.zeros((len(self.__universes), DMX_UNIVERSE_SIZE),
+                                  dtype = np.uint8)
+        offsets = np.arange(channels)
+        rows = np.searchsorted(self.__universes, pixel_universes)
+        dest = (rows*DMX_UNIVERSE_SIZE + addresses)[:, None] + offsets
+        source = ((ys*panel.width + xs)*channels)[:, None] + offsets
+        self.__dest = dest.ravel()
+        self.__source = source.ravel()
+        # Each slot's offset into a Calibration's flat table, by color channel.
+        self.__offsets = (self.__source % channels)*(COLOR_MAX + 1)
+        taken, counts = np.unique(self.__dest, return_counts = True)
+        if (counts > 1).any():
+            row, channel = divmod(int(taken[counts > 1][0]), DMX_UNIVERSE_SIZE)
+            raise ValueError("Overlapping live pixels on DMX universe %d, "
+                             "channel %d." % (self.__universes[row], channel))
+        self.__layout = panel.layout
+        self.__key = (panel.width, panel.height, panel.revision)
+
+    def is_current(self, panel):
+        """ Was this map compiled from the panel's current addressing? Panels
+        that share a layout share a patch map.
+        """
+        key = (panel.width, panel.height, panel.revision)
+        return panel.layout is self.__layout and key == self.__key
+
+    def apply(self, panel, calibration = None):
+        """ Copies the live pixel colors into the universe buffers, through a
+        Calibration's lookup table if one is given.
+        """
+        flat = self.__buffers.reshape(-1)
+        values = panel.color_plane.reshape(-1)[self.__source]
+        if calibration is not None and not calibration.identity:
+            values = calibration.flat_table[values + self.__offsets]
+        flat[self.__dest] = values
+
+    def table_offsets(self):
+        """ Returns a (universes, 512) uint16 array of each channel's offset
+        into a Calibration's flat table, by the color it carries; unpatched
+        channels map through the red table.
+        """
+        offsets = np.zeros(self.__buffers.shape, dtype = np.uint16)
+        offsets.reshape(-1)[self.__dest] = self.__offsets
+        return offsets
+
+    @property
+    def universes(self):
+        """ Sorted list of patched DMX universes.
+        """
+        return self.__universes
+
+    @property
+    def buffers(self):
+        """ (universes, 512) uint8 array of channel values, one row per entry in
+        universes.
+        """
+        return self.__buffers
+
+    def buffer(self, universe):
+        """ Returns the 512-channel buffer row for a universe.
+        """
+        return self.__buffers[self.__rows[universe]]
+
+    def __len__(self):
+        return len(self.__source)
+
+    def __repr__(self):
+        return "DMXPatchMap<universes = %s, channels = %d>" % (self.__universes,
+                                                              len(self))
@@ -1,9 +1,35 @@
+from diodberg.core.instrumentation import Instruments
+
+
 class Renderer(object):
     """ Renderer is an abstract base class for objects that actually render pixels
-    that have been filled in.
+    that have been filled in. Renderers record their encode and write times,
+    and bytes written, into instruments; a Controller shares its own with its
+    renderer.
+
+    Output renderers apply their calibration (a Calibration, or None for
+    none) to the colors as they encode a frame.
+
+    DMX renderers can also send frames that are already encoded, e.g. from a
+    clip, with render_buffers; those set renders_buffers.
+
+    Renderers whose render() never blocks on I/O set nonblocking, and leave
+    anything the device won't take yet to flush(); an EventLoop renders them
+    on the loop and calls flush() whenever fileno() is writable. Other
+    renderers are run on the loop's executor.
     """ 
 
+    renders_buffers = False
+    nonblocking = False
+
     def __init__(self, universes = 1):
+        self.__instruments = Instruments()
+        self.__calibration = None
+    
+    def prepare(self, panel):
+        """ Called once before the first frame of a panel is rendered. Subclass
+        this method to precompute anything derived from the panel's layout.
+        """
         pass
     
     def render(self, panel):
@@ -12,5 +38,39 @@ class Renderer(object):
         """
         pass
 
+    def render_buffers(self, universes, buffers):
+        """ Sends a frame given as DMX channel buffers, a (len(universes), 512)
+        uint8 array with one row per universe, as is: no calibration is
+        applied. Defined by renderers that set renders_buffers.
+        """
+        raise NotImplementedError("%s can't render DMX buffers." % type(self).__name__)
+
+    def fileno(self):
+        """ The file descriptor flush() writes to, or None.
+        """
+        return None
+
+    def flush(self):
+        """ Writes out whatever the last render() left pending, without
+        blocking. Returns True once nothing is pending.
+        """
+        return True
+
+    def __get_instruments(self):
+        return self.__instruments
+    def __set_instruments(self, val):
+        self.__instruments = val
+
+    instruments = property(__get_instruments, __set_instruments, None, 
+                           "Instruments the renderer records into.")
+
+    def __get_calibration(self):
+        return self.__calibration
+    def __set_calibration(self, val):
+        self.__calibration = val
+
+    calibration = property(__get_calibration, __set_calibration, None,
+                           "Calibration applied to the colors at encode time.")
+
     def __repr__(self):
         pass
@@ -1,24 +1,57 @@
+from collections import deque
+import multiprocessing
+import numpy as np
 import time
 import threading
 
-
-use_yappi = False
-try:
-    import yappi
-except ImportError as err:
-    sys.stderr.write("Error: failed to import module ({})".format(err))
+from diodberg.core.compositor import BLEND_OVER
+from diodberg.core.compositor import Compositor
+from diodberg.core.compositor import Layer
+from diodberg.core.eventloop import EventLoop
+from diodberg.core.eventloop import OutputTask
+from diodberg.core.eventloop import RunnerTask
+from diodberg.core.instrumentation import COMPOSITE
+from diodberg.core.instrumentation import FILL
+from diodberg.core.instrumentation import Instruments
+from diodberg.core.instrumentation import Profiler
+from diodberg.core.instrumentation import StatsDump
+from diodberg.core.transitions import CROSSFADE
+from diodberg.core.transitions import Transition
+from diodberg.core.scheduler import FrameScheduler
+from diodberg.core.types import Panel
+from diodberg.core.types import PanelBuffers
+from diodberg.util.utils import monotonic
 
 
 class Runner(threading.Thread):
     """ A Runner is the primary execution thread for a Panel visualization. An
     abstract class, it takes a Panel of pixels and a Renderer and executes 
-    a rendering action for that panel.
+    a rendering action for that panel. Frames are paced by a FrameScheduler
+    whose target period is sleep seconds; policy picks what to drop when a
+    frame runs late.
+
+    With buffers = 2 or 3, the panel is double or triple buffered: fill()
+    draws into the back buffer (self.panel) while a RenderThread renders the
+    last completed frame, so slow I/O overlaps with computing the next frame.
+
+    With live_only, fill() should only draw the panel's live pixels (see
+    Panel.live_cells), which on a sparse wall is a small fraction of the
+    cells; runners that support it check self.live_only.
+
+    Instead of running its own thread, a runner can be driven from an
+    EventLoop; see RunnerTask and Controller.run_loop.
+
+    Fill times are recorded into instruments as "fill/<name>". With profile =
+    True the frame loop is profiled with yappi until the runner stops, or with
+    profile = N for its first N frames; see also profile().
     """ 
 
-    __slots__ = {'__lock', '__panel', '__name', 
-                 '__renderer', '__sleepS', '__profile'}
+    __slots__ = {'__lock', '__panel', '__name', '__renderer', '__scheduler', 
+                 '__profile', '__buffers', '__instruments', '__profiler', 
+                 '__live_only'}
     
-    def __init__(self, panel, name, renderer, sleep, profile = False):
+    def __init__(self, panel, name, renderer, sleep, profile = False, 
+                 policy = FrameScheduler.DEGRADE, buffers = 1, live_only = False):
         super(Runner, self).__init__()
         self.daemon = True
         self.running = False
@@ -26,16 +59,12 @@ class Runner(threading.Thread):
         self.__panel = panel
         self.__name = name
         self.__renderer = renderer
-        self.__sleepS = sleep
+        self.__scheduler = FrameScheduler(sleep, policy)
+        self.__buffers = buffers
         self.__profile = profile
-        if self.__profile and use_yappi:
-            yappi.start()
-
-    def __del__(self):
-        if self.__profile and use_yappi:
-            yappi.print_stats(sort_type = yappi.SORTTYPE_TSUB, 
-                              limit = 15, 
-                              thread_stats_on = False)
+        self.__instruments = Instruments()
+        self.__profiler = Profiler()
+        self.__live_only = live_only
 
     def init(self):
         """ Initializes any environmental parameters based on the panel info.
@@ -49,15 +78,96 @@ class Runner(threading.Thread):
         """
         pass
 
+    def open(self):
+        """ Acquires any resources the runner needs before its first frame.
+        Called by start() from the starting thread, or by an EventLoop that
+        drives the runner instead. Defined by whatever subclasses Runner.
+        """
+        pass
+
+    def close(self):
+        """ Releases any resources held by the runner. Called once by stop()
+        after the frame loop has exited. Defined by whatever subclasses Runner.
+        """
+        pass
+
+    def start(self):
+        self.open()
+        super(Runner, self).start()
+
+    def profile(self, frames = None, filename = None):
+        """ Profiles the next frames frames (or until the runner stops) with
+        yappi; see Profiler.
+        """
+        self.__profiler.arm(frames, filename)
+
+    def stop(self, timeout = None):
+        """ Stops the frame loop, waits for the thread to exit and then releases
+        the runner's resources with close().
+        """
+        self.running = False
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+        self.close()
+
     def run(self):
         self.running = True
-        self.init()
+        if self.__profile:
+            frames = None if self.__profile is True else self.__profile
+            self.__profiler.arm(frames)
+        try:
+            self.init()
+            self.__renderer.prepare(self.__panel)
+            if self.__buffers > 1:
+                self.__run_buffered()
+            else:
+                self.__run()
+        finally:
+            self.__profiler.stop()
+
+    def fill_frame(self):
+        """ Runs fill() once, recording its time into the scheduler and
+        instruments.
+        """
+        start = monotonic()
+        self.fill()
+        elapsed = monotonic() - start
+        self.__scheduler.record_fill(elapsed)
+        self.__instruments.record(FILL + "/" + self.__name, elapsed)
+
+    def __run(self):
+        scheduler = self.__scheduler
+        scheduler.start()
         while self.running:
-            self.__lock.acquire()
-            self.fill()
-            self.__renderer.render(self.__panel)
-            self.__lock.release()
-            time.sleep(self.__sleepS)
+            scheduler.begin_frame()
+            with self.__lock:
+                if scheduler.fill_due:
+                    self.fill_frame()
+                if scheduler.render_due:
+                    start = monotonic()
+                    self.__renderer.render(self.__panel)
+                    scheduler.record_render(monotonic() - start)
+            scheduler.end_frame()
+            self.__profiler.frame()
+
+    def __run_buffered(self):
+        scheduler = self.__scheduler
+        buffers = PanelBuffers(self.__panel, self.__buffers)
+        output = RenderThread(buffers, self.__renderer, scheduler)
+        output.start()
+        scheduler.start()
+        try:
+            while self.running:
+                scheduler.begin_frame()
+                with self.__lock:
+                    if scheduler.fill_due:
+                        self.fill_frame()
+                        self.__panel = buffers.publish()
+                scheduler.end_frame()
+                self.__profiler.frame()
+        finally:
+            buffers.close()
+            output.join()
         
     def __get_panel(self): 
         return self.__panel
@@ -66,6 +176,11 @@ class Runner(threading.Thread):
     def __del_panel(self): 
         del self.__panel
 
+    def __get_instruments(self): 
+        return self.__instruments
+    def __set_instruments(self, val): 
+        self.__instruments = val
+
     def __get_name(self): 
         return self.__name
     def __set_name(self, val): 
@@ -80,34 +195,472 @@ class Runner(threading.Thread):
     def __del_renderer(self): 
         del self.__renderer
 
+    @property
+    def live_only(self):
+        """ Should fill() only draw the live pixels?
+        """
+        return self.__live_only
+
+    @property
+    def scheduler(self):
+        """ The FrameScheduler pacing this runner; see its stats for achieved
+        fps, jitter and late frames.
+        """
+        return self.__scheduler
+
     panel = property(__get_panel, __set_panel, __del_panel, "Panel.")
     name = property(__get_name, __set_name, __del_name, "Name of visualization.")
     renderer = property(__get_renderer, __set_renderer, __del_renderer, "Renderer.")
+    instruments = property(__get_instruments, __set_instruments, None, 
+                           "Instruments the runner records fill times into.")
 
     def __repr__(self):
         return "Runner"
 
 
-#TODO: Extend to multiple threads
+# Per-process state for ShardedRunner pool workers, set up by _init_shard_worker.
+_shard_colors = None
+_shard_fill = None
+
+
+def _init_shard_worker(shared, shape, tile_fill):
+    global _shard_colors, _shard_fill
+    _shard_colors = np.frombuffer(shared, dtype = np.uint8).reshape(shape)
+    _shard_fill = tile_fill
+
+
+def _fill_shard(task):
+    start, stop, frame = task
+    _shard_fill(_shard_colors[start:stop], (start, stop), frame)
+
+
+class ShardedRunner(Runner):
+    """ ShardedRunner spreads a CPU-heavy fill over a multiprocessing pool. The
+    panel's color plane is moved into shared memory when the runner opens, and
+    every frame each worker fills a band of rows in place, so no pixel data is
+    pickled; only (start row, stop row, frame) travels to the workers.
+
+    tile_fill(colors, rows, frame) does the work. colors is the (stop - start,
+    width, 3) band of the color plane, rows the (start, stop) rows it covers
+    and frame the frame number. It must be a module-level function so that it
+    can be handed to the workers.
+
+    Only the panel it opened with is in shared memory, so a ShardedRunner
+    can't be buffered: buffers > 1 raises ValueError.
+    """
+
+    __slots__ = {'__tile_fill', '__workers', '__bands', '__pool', '__frame', 
+                 '__tasks'}
+
+    def __init__(self, panel, name, renderer, sleep, tile_fill, workers = None, 
+                 bands = None, **kwargs):
+        if kwargs.get('buffers', 1) > 1:
+            raise ValueError("%s fills a single shared color plane and can't be "
+                             "buffered." % name)
+        super(ShardedRunner, self).__init__(panel, name, renderer, sleep, **kwargs)
+        self.__tile_fill = tile_fill
+        self.__workers = workers or multiprocessing.cpu_count()
+        self.__bands = bands or 2*self.__workers
+        self.__pool = None
+        self.__frame = 0
+        self.__tasks = []
+
+    def open(self):
+        # Fork the pool from the starting thread, before the frame loop runs.
+        panel = self.panel
+        shape = (panel.height, panel.width, 3)
+        shared = multiprocessing.RawArray('B', panel.height*panel.width*3)
+        colors = np.frombuffer(shared, dtype = np.uint8).reshape(shape)
+        self.panel = Panel(panel = panel, share_layout = True, colors = colors)
+        self.panel.color_plane[...] = panel.color_plane
+        self.__pool = multiprocessing.Pool(self.__workers, _init_shard_worker, 
+                                           (shared, shape, self.__tile_fill))
+        bounds = np.linspace(0, panel.height, min(self.__bands, panel.height) + 1)
+        bounds = bounds.astype(int)
+        self.__tasks = zip(bounds[:-1], bounds[1:])
+
+    def fill(self):
+        frame = self.__frame
+        self.__pool.map(_fill_shard, [(a, b, frame) for a, b in self.__tasks])
+        self.__frame += 1
+
+    def close(self):
+        if self.__pool is not None:
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__pool = None
+
+    @property
+    def workers(self):
+        return self.__workers
+
+    def __repr__(self):
+        return super(ShardedRunner, self).__repr__() + ":" + self.name
+
+
+class RenderThread(threading.Thread):
+    """ RenderThread is the output side of a buffered Runner: it renders each
+    frame published to a PanelBuffers until the buffers are closed.
+    """
+
+    __slots__ = {'__buffers', '__renderer', '__scheduler'}
+
+    __poll_timeoutS = 0.5
+
+    def __init__(self, buffers, renderer, scheduler = None):
+        super(RenderThread, self).__init__()
+        self.daemon = True
+        self.__buffers = buffers
+        self.__renderer = renderer
+        self.__scheduler = scheduler
+
+    def run(self):
+        buffers = self.__buffers
+        while True:
+            panel = buffers.acquire(RenderThread.__poll_timeoutS)
+            if panel is None:
+                if buffers.closed:
+                    return
+                continue
+            try:
+                start = monotonic()
+                self.__renderer.render(panel)
+                if self.__scheduler is not None:
+                    self.__scheduler.record_render(monotonic() - start)
+            finally:
+                buffers.release()
+
+    def __repr__(self):
+        return "RenderThread"
+
+
 class Controller(object):
-    """ Controller initializes a set of Runner threads and shares execution between
-    them. It this doesn't control switching between different runners, it's
-    much useless.
+    """ Controller runs a stack of Runner threads and composites their output.
+    Every runner added gets its own panel (sharing the controller panel's
+    layout) and renders into a Layer. The controller blends the layers, bottom
+    first, into its panel and renders that with its own renderer, paced by a
+    FrameScheduler with period sleep. In the scheduler stats, fill_s is the
+    compositing time.
+
+    The controller's Instruments are shared with its renderer and runners, so
+    fill, composite, encode and write timings and bytes written per universe
+    can be read at runtime from stats, or dumped periodically with
+    dump_stats(). profile() runs yappi over a window of frames.
+
+    transition_to() switches visualizations at runtime without stopping the
+    frame loop; outgoing runners are stopped and closed on a separate thread
+    so that joining them never delays a frame.
+
+    add_output() renders the composited panel to further renderers. run()
+    renders to each in turn; run_loop() runs everything on an EventLoop
+    instead of threads, and renders to the outputs independently.
     """
-    def __init__(self, panel, renderer):
+
+    __slots__ = {'__panel', '__renderer', '__running', '__compositor', 
+                 '__scheduler', '__runners', '__transitions', '__retiring',
+                 '__instruments', '__profiler', '__dump', '__outputs', '__loop',
+                 '__own_loop', '__offload', '__tasks', '__output_tasks', 
+                 '__frame_timer', '__stopped'}
+
+    def __init__(self, panel, renderer, sleep = 0.01, 
+                 policy = FrameScheduler.DEGRADE):
         self.__panel = panel
         self.__renderer = renderer
         self.__running = False
+        self.__compositor = Compositor()
+        self.__scheduler = FrameScheduler(sleep, policy)
+        self.__runners = []
+        self.__transitions = deque()
+        self.__retiring = []
+        self.__instruments = Instruments()
+        self.__profiler = Profiler()
+        self.__dump = None
+        self.__outputs = [renderer]
+        self.__loop = None
+        self.__own_loop = False
+        self.__offload = False
+        self.__tasks = {}
+        self.__output_tasks = []
+        self.__frame_timer = None
+        self.__stopped = False
+        renderer.instruments = self.__instruments
 
-    def run(self, runner):
-        # runner.panel = self.__panel
-        # runner.renderer = self.__renderer
-        try: 
+    def add_runner(self, runner, mode = BLEND_OVER, opacity = 1., group = None, 
+                   index = None):
+        """ Adds a runner as a layer, on top of the stack or at index, and returns
+        its Layer. The runner is started right away if the controller is running.
+        """
+        panel = self.__panel
+        layer = Layer((panel.width, panel.height), mode, opacity, group)
+        runner.renderer = layer
+        runner.panel = Panel(panel = panel, share_layout = True)
+        runner.instruments = self.__instruments
+        self.__compositor.add(layer, index)
+        self.__runners.append((runner, layer))
+        if self.__running:
+            self.__start(runner)
+        return layer
+
+    def add_output(self, renderer):
+        """ Adds a renderer the composited panel is rendered to, besides the
+        controller's own.
+        """
+        renderer.instruments = self.__instruments
+        self.__outputs.append(renderer)
+        if self.__loop is not None:
+            task = OutputTask(self.__loop, renderer)
+            task.prepare(self.__panel)
+            self.__output_tasks.append(task)
+        elif self.__running:
+            renderer.prepare(self.__panel)
+
+    @property
+    def outputs(self):
+        """ The renderers the composited panel is rendered to.
+        """
+        return list(self.__outputs)
+
+    def remove_runner(self, runner):
+        """ Stops a runner, releases its resources and removes its layer.
+        """
+        self.__detach(runner)
+        self.__stop(runner)
+
+    def __start(self, runner):
+        if self.__loop is None:
             runner.start()
-            while True:
-                time.sleep(1)
-        except KeyboardInterrupt:
+            return
+        task = RunnerTask(self.__loop, runner, self.__offload)
+        self.__tasks[runner] = task
+        task.start()
+
+    def __stop(self, runner):
+        task = self.__tasks.pop(runner, None)
+        if task is None:
+            runner.stop()
+        else:
+            task.stop()
+
+    def transition_to(self, runner, kind = CROSSFADE, duration = 1., warmup = 1, 
+                      mode = BLEND_OVER, opacity = 1., group = None):
+        """ Queues a switch to runner. When the transition reaches the head of
+        the queue, the runner is started on an invisible layer; after warmup
+        frames it is cut, crossfaded or wiped in over duration seconds, and then
+        every runner that was running before it is retired. Returns the
+        Transition.
+        """
+        transition = Transition(runner, kind, duration, warmup)
+        self.__transitions.append((transition, mode, opacity, group))
+        return transition
+
+    @property
+    def transitions(self):
+        """ Pending and in-progress transitions, in order.
+        """
+        return [entry[0] for entry in self.__transitions]
+
+    def __detach(self, runner):
+        for entry in self.__runners:
+            if entry[0] is runner:
+                self.__runners.remove(entry)
+                self.__compositor.remove(entry[1])
+                return
+
+    def __retire(self, runner):
+        # Stop and close off the frame loop's thread; stop() joins it. On an
+        # EventLoop, the runner is closed on the executor instead.
+        self.__detach(runner)
+        if runner in self.__tasks:
+            self.__stop(runner)
+            return
+        reaper = threading.Thread(target = runner.stop, name = "retire:" + str(runner))
+        reaper.daemon = True
+        reaper.start()
+        self.__retiring = [t for t in self.__retiring if t.is_alive()] + [reaper]
+
+    def __advance_transitions(self):
+        if not self.__transitions:
+            return
+        transition, mode, opacity, group = self.__transitions[0]
+        if transition.state == Transition.QUEUED:
+            outgoing = self.runners
+            layer = self.add_runner(transition.runner, mode, 0., group)
+            transition.begin(layer, outgoing, opacity)
+        state = transition.advance(monotonic(), self.__panel)
+        if state == Transition.DONE:
+            for runner in transition.outgoing:
+                self.__retire(runner)
+            self.__transitions.popleft()
+
+    @property
+    def runners(self):
+        return [runner for runner, layer in self.__runners]
+
+    @property
+    def instruments(self):
+        return self.__instruments
+
+    @property
+    def stats(self):
+        """ Runtime statistics: the shared instruments' timers (p50/p95/p99 per
+        timer), counters and bytes_per_universe, plus frame statistics for
+        the controller (frames) and for each runner, by name (runners), which
+        include late and dropped frames. Under run_loop(), outputs_dropped has
+        the frames each output dropped because it was still busy.
+        """
+        stats = self.__instruments.snapshot()
+        stats['frames'] = self.__scheduler.stats
+        stats['runners'] = dict((runner.name, runner.scheduler.stats) 
+                                for runner in self.runners)
+        if self.__output_tasks:
+            stats['outputs_dropped'] = [task.dropped for task in self.__output_tasks]
+        return stats
+
+    def dump_stats(self, target, interval = 10.):
+        """ Writes stats every interval seconds while running, as JSON lines
+        appended to the file target, or as messages on a logging.Logger. A
+        target of None stops dumping.
+        """
+        self.__dump = None if target is None else StatsDump(lambda: self.stats, 
+                                                            target, interval)
+
+    def profile(self, frames = 100, filename = None):
+        """ Profiles the next frames frames with yappi, then prints the stats or
+        saves them to filename; see Profiler.
+        """
+        self.__profiler.arm(frames, filename)
+
+    @property
+    def layers(self):
+        return self.__compositor.layers
+
+    @property
+    def panel(self):
+        return self.__panel
+
+    @property
+    def scheduler(self):
+        return self.__scheduler
+
+    def step(self):
+        """ Composites and renders a single frame.
+        """
+        scheduler = self.__scheduler
+        start = monotonic()
+        if self.__running:
+            self.__advance_transitions()
+        self.__compositor.composite(self.__panel)
+        elapsed = monotonic() - start
+        scheduler.record_fill(elapsed)
+        self.__instruments.record(COMPOSITE, elapsed)
+        if scheduler.render_due:
+            start = monotonic()
+            if self.__output_tasks:
+                for task in self.__output_tasks:
+                    task.render(self.__panel)
+            else:
+                for renderer in self.__outputs:
+                    renderer.render(self.__panel)
+            scheduler.record_render(monotonic() - start)
+        self.__profiler.frame()
+        if self.__dump is not None:
+            self.__dump.poll()
+
+    def stop(self):
+        """ Stops the compositing loop and every runner. Only the first call
+        after run() or run_loop() does anything.
+        """
+        if self.__stopped:
+            return
+        self.__stopped = True
+        self.__running = False
+        self.__profiler.stop()
+        for runner, layer in list(self.__runners):
             runner.running = False
+        for runner, layer in list(self.__runners):
+            self.__stop(runner)
+        for reaper in self.__retiring:
+            reaper.join()
+        self.__retiring = []
+        if self.__loop is not None:
+            if self.__frame_timer is not None:
+                self.__frame_timer.cancel()
+            for task in self.__output_tasks:
+                task.stop()
+            if self.__own_loop:
+                self.__loop.stop()
+            self.__loop = None
+            self.__output_tasks = []
+
+    def run(self, runner = None):
+        """ Starts every runner (adding runner first, if given) and composites
+        until interrupted.
+        """
+        if runner is not None:
+            self.add_runner(runner)
+        try: 
+            self.__running = True
+            self.__stopped = False
+            for runner, layer in self.__runners:
+                runner.start()
+            for renderer in self.__outputs:
+                renderer.prepare(self.__panel)
+            scheduler = self.__scheduler
+            scheduler.start()
+            while self.__running:
+                scheduler.begin_frame()
+                self.step()
+                scheduler.end_frame()
+        except KeyboardInterrupt:
+            pass
         finally:
+            self.stop()
             print "\nQuiting!"
             exit()
+
+    def run_loop(self, runner = None, loop = None, offload = True):
+        """ Like run(), but on an EventLoop rather than a thread per runner.
+        Each runner is ticked on the loop at its own frame rate (see
+        RunnerTask), its fill() on the loop's executor with offload, and each
+        output renders independently (see OutputTask): a nonblocking output is
+        written without blocking, any other on the executor, and an output
+        that is still busy drops the frame without holding up the others.
+
+        Without a loop, one is made and run until stop() or an interrupt, and
+        closed. Given a loop, the controller is only scheduled on it and
+        run_loop() returns at once; stop() then leaves the loop running. Call
+        stop() on the loop's thread, e.g. through loop.call_soon_threadsafe.
+        """
+        if runner is not None:
+            self.add_runner(runner)
+        self.__own_loop = loop is None
+        if loop is None:
+            loop = EventLoop()
+        self.__loop = loop
+        self.__offload = offload
+        self.__running = True
+        self.__stopped = False
+        self.__output_tasks = [OutputTask(loop, renderer) for renderer in self.__outputs]
+        for task in self.__output_tasks:
+            task.prepare(self.__panel)
+        for runner, layer in self.__runners:
+            self.__start(runner)
+        self.__scheduler.start()
+        self.__frame_timer = loop.call_soon(self.__frame)
+        if not self.__own_loop:
+            return
+        try:
+            loop.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            loop.close()
+
+    def __frame(self):
+        if not self.__running:
+            return
+        scheduler = self.__scheduler
+        scheduler.begin_frame()
+        self.step()
+        self.__frame_timer = self.__loop.call_at(scheduler.finish_frame(), self.__frame)
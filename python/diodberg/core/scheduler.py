@@ -0,0 +1,163 @@
+# Frame pacing for Runners: fixed-rate monotonic deadlines, a policy for what to
+# drop when a frame runs late, and frame timing statistics.
+
+from collections import deque
+import time
+
+from diodberg.util.utils import monotonic
+
+
+class FrameScheduler(object):
+    """ FrameScheduler paces a fill -> render loop at a fixed frame period using
+    monotonic deadlines, so that the frame rate doesn't drift with the time
+    spent filling and rendering. When a frame finishes after its deadline, the
+    policy decides how to recover:
+
+    SKIP_FILL: skip the next fill (re-render the last frame) and drop the
+    missed deadlines so the loop gets back on schedule.
+    SKIP_RENDER: skip the next render (keep the animation advancing) and drop
+    the missed deadlines.
+    DEGRADE: never skip work; start the next frame immediately and measure
+    deadlines from there, so the frame rate degrades instead.
+
+    A typical loop:
+
+        scheduler.start()
+        while running:
+            scheduler.begin_frame()
+            if scheduler.fill_due: ...fill, then scheduler.record_fill(seconds)
+            if scheduler.render_due: ...render, then scheduler.record_render(seconds)
+            scheduler.end_frame()
+    """
+
+    SKIP_FILL = "skip_fill"
+    SKIP_RENDER = "skip_render"
+    DEGRADE = "degrade"
+
+    __policies = {SKIP_FILL, SKIP_RENDER, DEGRADE}
+
+    __slots__ = {'__period', '__policy', '__deadline', '__frame_start',
+                 '__catch_up', '__starts', '__fills', '__renders', '__frames',
+                 '__late', '__dropped', '__skipped'}
+
+    def __init__(self, period, policy = DEGRADE, window = 120):
+        assert policy in FrameScheduler.__policies, "Unknown policy: " + str(policy)
+        self.__period = max(float(period), 0.)
+        self.__policy = policy
+        self.__starts = deque(maxlen = window)
+        self.__fills = deque(maxlen = window)
+        self.__renders = deque(maxlen = window)
+        self.start()
+
+    def start(self):
+        """ Resets statistics and starts the deadline clock from now.
+        """
+        self.__deadline = monotonic()
+        self.__frame_start = None
+        self.__catch_up = False
+        self.__starts.clear()
+        self.__fills.clear()
+        self.__renders.clear()
+        self.__frames = 0
+        self.__late = 0
+        self.__dropped = 0
+        self.__skipped = 0
+
+    def begin_frame(self):
+        """ Marks the start of a frame.
+        """
+        self.__frame_start = monotonic()
+        self.__starts.append(self.__frame_start)
+
+    @property
+    def fill_due(self):
+        """ Should this frame be filled?
+        """
+        return not (self.__catch_up and self.__policy == FrameScheduler.SKIP_FILL)
+
+    @property
+    def render_due(self):
+        """ Should this frame be rendered?
+        """
+        return not (self.__catch_up and self.__policy == FrameScheduler.SKIP_RENDER)
+
+    def record_fill(self, seconds):
+        self.__fills.append(seconds)
+
+    def record_render(self, seconds):
+        self.__renders.append(seconds)
+
+    def end_frame(self):
+        """ Ends the frame and sleeps until the next deadline, or applies the
+        late-frame policy if the deadline has already passed.
+        """
+        delay = self.finish_frame() - monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def finish_frame(self):
+        """ Ends the frame like end_frame(), but returns the monotonic time the
+        next frame is due instead of sleeping until then, for an EventLoop.
+        """
+        self.__frames += 1
+        if self.__catch_up:
+            self.__skipped += 1
+        self.__catch_up = False
+        self.__deadline += self.__period
+        now = monotonic()
+        lateness = now - self.__deadline
+        if lateness <= 0:
+            return self.__deadline
+        self.__late += 1
+        if self.__policy == FrameScheduler.DEGRADE or self.__period == 0:
+            self.__deadline = now
+        else:
+            missed = int(lateness/self.__period)
+            self.__deadline += missed*self.__period
+            self.__dropped += missed
+            self.__catch_up = True
+        return now
+
+    def __get_period(self):
+        return self.__period
+    def __set_period(self, val):
+        self.__period = max(float(val), 0.)
+
+    def __get_policy(self):
+        return self.__policy
+    def __set_policy(self, val):
+        assert val in FrameScheduler.__policies, "Unknown policy: " + str(val)
+        self.__policy = val
+
+    period = property(__get_period, __set_period, None, "Target frame period (s).")
+    policy = property(__get_policy, __set_policy, None, "Late-frame policy.")
+
+    @property
+    def stats(self):
+        """ Frame statistics over the recent window: achieved fps, jitter_s (mean
+        absolute deviation of frame intervals from the period), mean fill_s and
+        render_s, and the running totals frames, late_frames, dropped_frames
+        (missed deadlines) and skipped_frames (frames whose fill or render was
+        skipped to catch up).
+        """
+        starts = list(self.__starts)
+        intervals = [b - a for a, b in zip(starts, starts[1:])]
+        fps = 0.
+        jitter = 0.
+        if intervals:
+            elapsed = starts[-1] - starts[0]
+            fps = len(intervals)/elapsed if elapsed > 0 else 0.
+            jitter = sum(abs(i - self.__period) for i in intervals)/len(intervals)
+        mean = lambda xs: sum(xs)/len(xs) if xs else 0.
+        return {'fps': fps,
+                'jitter_s': jitter,
+                'fill_s': mean(self.__fills),
+                'render_s': mean(self.__renders),
+                'frames': self.__frames,
+                'late_frames': self.__late,
+                'dropped_frames': self.__dropped,
+                'skipped_frames': self.__skipped}
+
+    def __repr__(self):
+        return "FrameScheduler<period = %0.4f, policy = %s>" % (self.__period,
+                                                                self.__policy)
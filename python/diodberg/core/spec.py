@@ -0,0 +1,263 @@
+# Wall specification files: JSON descriptions of one or more panels, loaded
+# straight into array-backed Panels. A specification looks like
+#
+#   {"name": "test_wall", "comment": "...", "version": 1,
+#    "groups": {"1": "Blue V2"},
+#    "panels": [{"id": 0, "size": [width, height],
+#                "pixels": {"x": [...], "y": [...],
+#                           "universe": [...], "address": [...],
+#                           "live": [...], "group": [...],
+#                           "extra_groups": [[...], ...]}}]}
+#
+# Pixels are given as columns, one entry per pixel. live defaults to true,
+# group to 0 and extra_groups (the pixel's other groups, e.g. routes sharing
+# a hold) to none; cells that aren't listed are dead. A list of per-pixel objects
+# with the same keys is accepted too, for hand-written files. Everything but
+# "panels" is metadata, returned as is by read_spec.
+#
+# Parsing large walls is slow, so read_spec keeps the parsed columns in a
+# binary cache next to the file (filename + ".cache.npz"), keyed by a SHA-1 of
+# the JSON; a changed file is simply parsed again.
+
+import hashlib
+import json
+import numpy as np
+import os
+import sys
+
+from diodberg.core.types import Panel
+
+
+SPEC_VERSION = 1
+CACHE_SUFFIX = ".cache.npz"
+
+_columns = ("x", "y", "universe", "address", "live", "group")
+_defaults = {"live": True, "group": 0}
+# Extra groups are parsed into pairs of (pixel, group) columns.
+_extra_columns = ("extra_pixels", "extra_groups")
+
+
+def cache_filename(filename):
+    """ The binary cache of a specification file.
+    """
+    return filename + CACHE_SUFFIX
+
+
+def _records_to_columns(records):
+    columns = {}
+    for name in _columns:
+        default = _defaults.get(name)
+        try:
+            columns[name] = [r[name] if default is None else r.get(name, default)
+                             for r in records]
+        except KeyError:
+            raise ValueError("Pixel record without %r." % name)
+    if any("extra_groups" in r for r in records):
+        columns["extra_groups"] = [r.get("extra_groups", []) for r in records]
+    return columns
+
+
+def _extra_pairs(extra_groups):
+    """ Flattens per-pixel lists of extra groups into (pixel, group) columns.
+    """
+    pixels = [i for i, groups in enumerate(extra_groups) for group in groups]
+    groups = [group for groups in extra_groups for group in groups]
+    return (np.asarray(pixels, dtype = np.intp), np.asarray(groups, dtype = np.int32))
+
+
+def _parse(data):
+    """ Parses specification JSON into (metadata, [(panel id, size, columns)]),
+    with columns as arrays.
+    """
+    try:
+        spec = json.loads(data)
+    except ValueError as err:
+        raise ValueError("Invalid wall specification: %s" % err)
+    if not isinstance(spec, dict):
+        raise ValueError("A wall specification is a JSON object.")
+    version = spec.get("version", SPEC_VERSION)
+    if version > SPEC_VERSION:
+        raise ValueError("Wall specification version %s is newer than %d." %
+                         (version, SPEC_VERSION))
+    panels = []
+    for entry in spec.pop("panels", []):
+        pixels = entry.get("pixels", {})
+        if isinstance(pixels, list):
+            pixels = _records_to_columns(pixels)
+        count = len(pixels.get("x", []))
+        columns = {}
+        for name in _columns:
+            if name in pixels:
+                columns[name] = np.asarray(pixels[name])
+            elif name in _defaults:
+                columns[name] = np.empty(count, dtype = type(_defaults[name]))
+                columns[name].fill(_defaults[name])
+            else:
+                raise ValueError("Panel %s has no %r pixel column." %
+                                 (entry.get("id"), name))
+            if len(columns[name]) != count:
+                raise ValueError("Panel %s: pixel column %r has %d entries, "
+                                 "expected %d." % (entry.get("id"), name,
+                                                   len(columns[name]), count))
+        extra_groups = pixels.get("extra_groups", [])
+        if extra_groups and len(extra_groups) != count:
+            raise ValueError("Panel %s: pixel column 'extra_groups' has %d "
+                             "entries, expected %d." % (entry.get("id"),
+                                                        len(extra_groups), count))
+        columns.update(zip(_extra_columns, _extra_pairs(extra_groups)))
+        width, height = entry["size"]
+        panels.append((int(entry.get("id", len(panels))), (int(width), int(height)),
+                       columns))
+    return spec, panels
+
+
+def _build(panel_id, size, columns):
+    """ Returns a Panel with the pixel columns written into its planes.
+    """
+    width, height = size
+    x = columns["x"].astype(np.intp)
+    y = columns["y"].astype(np.intp)
+    outside = (x < 0) | (x >= width) | (y < 0) | (y >= height)
+    if outside.any():
+        i = np.flatnonzero(outside)[0]
+        raise ValueError("Panel %d: pixel at (%d, %d) is outside of %dx%d." %
+                         (panel_id, x[i], y[i], width, height))
+    cells = y*width + x
+    taken = np.bincount(cells, minlength = width*height)
+    if (taken > 1).any():
+        y0, x0 = divmod(int(np.flatnonzero(taken > 1)[0]), width)
+        raise ValueError("Panel %d: more than one pixel at (%d, %d)." %
+                         (panel_id, x0, y0))
+    planes = {}
+    for name, dtype in [("universe", np.int32), ("address", np.int32),
+                        ("live", np.bool_), ("group", np.int32)]:
+        plane = np.zeros((height, width), dtype = dtype)
+        plane[y, x] = columns[name]
+        planes[name] = plane
+    panel = Panel(size)
+    panel.set_planes(universes = planes["universe"], addresses = planes["address"],
+                     live = planes["live"], groups = planes["group"])
+    extra = {}
+    for pixel, group in zip(columns["extra_pixels"], columns["extra_groups"]):
+        extra.setdefault(int(pixel), []).append(int(group))
+    for pixel, groups in extra.iteritems():
+        panel.set_groups(x[pixel], y[pixel], [planes["group"][y[pixel], x[pixel]]] + groups)
+    # Build the index now rather than on the first frame.
+    panel.index
+    return panel
+
+
+def _read_cache(filename, digest):
+    try:
+        with np.load(cache_filename(filename)) as cache:
+            if str(cache["hash"]) != digest:
+                return None
+            metadata = json.loads(str(cache["metadata"]))
+            panels = []
+            for i, (panel_id, size) in enumerate(metadata.pop("__panels")):
+                columns = dict((name, cache["%d_%s" % (i, name)]) 
+                               for name in _columns + _extra_columns)
+                panels.append((panel_id, tuple(size), columns))
+            return metadata, panels
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def _write_cache(filename, digest, metadata, panels):
+    arrays = {"hash": np.asarray(digest)}
+    metadata = dict(metadata)
+    metadata["__panels"] = [(panel_id, size) for panel_id, size, columns in panels]
+    arrays["metadata"] = np.asarray(json.dumps(metadata))
+    for i, (panel_id, size, columns) in enumerate(panels):
+        for name in _columns + _extra_columns:
+            arrays["%d_%s" % (i, name)] = columns[name]
+    try:
+        with open(cache_filename(filename), "wb") as f:
+            np.savez(f, **arrays)
+    except (IOError, OSError) as err:
+        sys.stderr.write("Warning: can't write wall cache ({})".format(err))
+
+
+def read_spec(filename, cache = True):
+    """ Loads a wall specification file. Returns (metadata, {panel id: Panel}),
+    each panel's index built. Raises ValueError for a malformed specification.
+    With cache, the parsed pixels are read from (or saved to) the binary
+    cache when it matches the file.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+    parsed = _read_cache(filename, digest) if cache else None
+    if parsed is None:
+        parsed = _parse(data)
+        if cache:
+            _write_cache(filename, digest, *parsed)
+    metadata, panels = parsed
+    return metadata, dict((panel_id, _build(panel_id, size, columns))
+                          for panel_id, size, columns in panels)
+
+
+def read_file(filename, cache = True):
+    """ Loads the panels of a wall specification file, as {panel id: Panel}.
+    """
+    metadata, panels = read_spec(filename, cache)
+    return panels
+
+
+def read_panel(filename, panel_id = 0, cache = True):
+    """ Loads one panel of a wall specification file.
+    """
+    panels = read_file(filename, cache)
+    if panel_id not in panels:
+        raise ValueError("No panel %s in %s (panels: %s)." %
+                         (panel_id, filename, sorted(panels)))
+    return panels[panel_id]
+
+
+def panel_spec(panel, panel_id = 0):
+    """ Returns the specification of a panel: every cell that is live or has a
+    DMX address or group, as columns.
+    """
+    live = panel.live_plane
+    universes = panel.universe_plane
+    addresses = panel.address_plane
+    groups = panel.group_plane
+    extra = panel.layout.extra_groups
+    used = live | (universes != 0) | (addresses != 0) | (groups != 0)
+    if extra:
+        used.reshape(-1)[list(extra)] = True
+    y, x = np.nonzero(used)
+    pixels = {"x": x.tolist(), "y": y.tolist(),
+              "universe": universes[used].tolist(),
+              "address": addresses[used].tolist()}
+    if not live[used].all():
+        pixels["live"] = live[used].tolist()
+    if groups[used].any():
+        pixels["group"] = groups[used].tolist()
+    if extra:
+        pixels["extra_groups"] = [list(extra.get(cell, ()))
+                                  for cell in np.flatnonzero(used.reshape(-1))]
+    return {"id": panel_id, "size": [panel.width, panel.height], "pixels": pixels}
+
+
+def write_spec(filename, panels, metadata = None):
+    """ Writes {panel id: Panel} as a wall specification file, with metadata
+    (a dict, e.g. name and comment) at the top level.
+    """
+    spec = dict(metadata or {})
+    spec["version"] = SPEC_VERSION
+    spec["panels"] = [panel_spec(panels[panel_id], panel_id)
+                      for panel_id in sorted(panels)]
+    with open(filename, "w") as f:
+        json.dump(spec, f, sort_keys = True)
+
+
+def write_panel(filename, panel, panel_id = 0):
+    """ Saves one panel into a wall specification file, keeping the metadata
+    and other panels of an existing file.
+    """
+    metadata, panels = {}, {}
+    if os.path.exists(filename):
+        metadata, panels = read_spec(filename)
+    panels[panel_id] = panel
+    write_spec(filename, panels, metadata)
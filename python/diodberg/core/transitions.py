@@ -0,0 +1,108 @@
+# Transitions between runners on a Controller: an incoming runner is warmed up
+# off-screen, then cut, crossfaded or wiped in over the outgoing ones.
+
+import numpy as np
+
+
+CUT = "cut"
+CROSSFADE = "crossfade"
+WIPE = "wipe"
+TRANSITIONS = (CUT, CROSSFADE, WIPE)
+
+
+class Transition(object):
+    """ A Transition brings in one runner over a duration in seconds, once its
+    layer has rendered warmup frames off-screen. Controller.transition_to queues
+    transitions and advances the head of the queue once per frame:
+
+    QUEUED -> WARMING (runner started, layer invisible) -> FADING -> DONE
+
+    Once DONE, the runners that were on the controller when the transition
+    began are retired. A CUT switches as soon as warm-up is over; a CROSSFADE
+    ramps the incoming layer's opacity; a WIPE reveals it left to right.
+    """
+
+    QUEUED = "queued"
+    WARMING = "warming"
+    FADING = "fading"
+    DONE = "done"
+
+    __slots__ = {'__runner', '__kind', '__durationS', '__warmup', '__opacity',
+                 '__state', '__layer', '__outgoing', '__startS', '__columns'}
+
+    def __init__(self, runner, kind = CROSSFADE, duration = 1., warmup = 1):
+        assert kind in TRANSITIONS, "Unknown transition: " + str(kind)
+        self.__runner = runner
+        self.__kind = kind
+        self.__durationS = max(float(duration), 0.)
+        self.__warmup = warmup
+        self.__state = Transition.QUEUED
+        self.__layer = None
+        self.__outgoing = []
+        self.__opacity = 1.
+        self.__startS = None
+        self.__columns = None
+
+    def begin(self, layer, outgoing, opacity = 1.):
+        """ Starts warming up the incoming layer. outgoing are the runners to
+        retire once the transition is done, and opacity is the layer's final
+        opacity.
+        """
+        self.__layer = layer
+        self.__outgoing = list(outgoing)
+        self.__opacity = opacity
+        layer.opacity = 0.
+        self.__state = Transition.WARMING
+
+    def advance(self, now, panel):
+        """ Updates the incoming layer for time now (seconds) and returns the
+        state.
+        """
+        layer = self.__layer
+        if self.__state == Transition.WARMING:
+            if layer.frames < self.__warmup:
+                return self.__state
+            self.__startS = now
+            self.__state = Transition.FADING
+        if self.__state != Transition.FADING:
+            return self.__state
+        progress = 1.
+        if self.__kind != CUT and self.__durationS > 0:
+            progress = min((now - self.__startS)/self.__durationS, 1.)
+        if progress >= 1.:
+            layer.opacity = self.__opacity
+            layer.mask = None
+            self.__state = Transition.DONE
+        elif self.__kind == CROSSFADE:
+            layer.opacity = progress*self.__opacity
+        elif self.__kind == WIPE:
+            if self.__columns is None:
+                self.__columns = np.arange(panel.width)
+            edge = self.__columns < progress*panel.width
+            layer.mask = np.broadcast_to(edge, (panel.height, panel.width))
+            layer.opacity = self.__opacity
+        return self.__state
+
+    @property
+    def runner(self):
+        return self.__runner
+
+    @property
+    def layer(self):
+        return self.__layer
+
+    @property
+    def outgoing(self):
+        return self.__outgoing
+
+    @property
+    def kind(self):
+        return self.__kind
+
+    @property
+    def state(self):
+        return self.__state
+
+    def __repr__(self):
+        return "Transition<%s, %s, %0.2fs>" % (self.__kind, self.__state,
+                                               self.__durationS)
@@ -8,15 +8,8 @@ from copy import deepcopy
 import json
 import numpy as np
 import random
-
-use_numba = False
-try:
-    from numba import autojit    
-    use_numba = True
-except ImportError as err:
-    sys.stderr.write("Error: failed to import module ({})".format(err))
-
-from diodberg.util.utils import ConditionalDecorator
+import sys
+import threading
 
 
 COLOR_MIN = 0
@@ -24,7 +17,6 @@ COLOR_MAX = 255
 COLOR_HUE_MAX = 360
 
 
-@ConditionalDecorator(use_numba, autojit)
 class Color(object):
     """ Color representation, stored as RGB. Saturates for invalid values (FIX).
     """
@@ -66,24 +58,122 @@ class Color(object):
     def set_hsv(self, hue, saturation, value):
         """ Set HSV convenience method. Assumes that a max range of (360., 1., 1.).
         """ 
-        norm_hue = hue/COLOR_HUE_MAX
+        norm_hue = hue/float(COLOR_HUE_MAX)
         red, green, blue = colorsys.hsv_to_rgb(norm_hue, saturation, value)
         self.red = int(round(red*COLOR_MAX))
         self.green = int(round(green*COLOR_MAX))
         self.blue = int(round(blue*COLOR_MAX))
     
     def __repr__(self):
-        val = (self.red, self.green, self.blue, self.alpha)
+        val = self.rgba
         formatted = "<Color (r = %0.3f, g = %0.3f, b = %0.3f, alpha = %0.3f)>"
         return formatted % val
 
 
+# Batched color-space kernels. These operate on (..., 3) arrays of colors, e.g.
+# a Panel's whole color plane, with hue in [0, 360) and saturation and value in
+# [0, 1], matching Color.hsv and Color.set_hsv. Where a boolean mask is given,
+# only the masked colors are converted or changed.
+
+def rgb_to_hsv(rgb, mask = None):
+    """ Converts an (..., 3) array of RGB values to float HSV. With a mask,
+    returns an (N, 3) array for the masked colors only.
+    """
+    rgb = np.asarray(rgb)
+    if mask is not None:
+        rgb = rgb[mask]
+    rgb = rgb.astype(np.float64)/COLOR_MAX
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maxc = rgb.max(axis = -1)
+    minc = rgb.min(axis = -1)
+    delta = maxc - minc
+    gray = delta == 0
+    safe_delta = np.where(gray, 1., delta)
+    safe_max = np.where(maxc == 0, 1., maxc)
+    rc = (maxc - r)/safe_delta
+    gc = (maxc - g)/safe_delta
+    bc = (maxc - b)/safe_delta
+    hue = np.where(r == maxc, bc - gc, 
+                   np.where(g == maxc, 2. + rc - bc, 4. + gc - rc))
+    hue = np.where(gray, 0., (hue/6.) % 1.)
+    hsv = np.empty(rgb.shape, dtype = np.float64)
+    hsv[..., 0] = COLOR_HUE_MAX*hue
+    hsv[..., 1] = np.where(gray, 0., delta/safe_max)
+    hsv[..., 2] = maxc
+    return hsv
+
+
+def hsv_to_rgb(hsv):
+    """ Converts an (..., 3) array of HSV values to uint8 RGB, rounding the same
+    way Color.set_hsv does.
+    """
+    hsv = np.asarray(hsv, dtype = np.float64)
+    h = (hsv[..., 0]/COLOR_HUE_MAX) % 1.
+    s = hsv[..., 1]
+    v = hsv[..., 2]
+    i = np.floor(h*6.)
+    f = h*6. - i
+    i = i.astype(np.int8) % 6
+    p = v*(1. - s)
+    q = v*(1. - s*f)
+    t = v*(1. - s*(1. - f))
+    choices = [(v, t, p), (q, v, p), (p, v, t), (p, q, v), (t, p, v), (v, p, q)]
+    rgb = np.empty(hsv.shape, dtype = np.float64)
+    for channel in xrange(3):
+        rgb[..., channel] = np.choose(i, [c[channel] for c in choices])
+    return np.clip(np.floor(rgb*COLOR_MAX + 0.5), COLOR_MIN, COLOR_MAX).astype(np.uint8)
+
+
+def rotate_hue(rgb, degrees, mask = None):
+    """ Returns a copy of an (..., 3) RGB array with hues rotated by degrees.
+    """
+    out = np.array(rgb, dtype = np.uint8)
+    hsv = rgb_to_hsv(out, mask)
+    hsv[..., 0] = (hsv[..., 0] + degrees) % COLOR_HUE_MAX
+    if mask is None:
+        out[...] = hsv_to_rgb(hsv)
+    else:
+        out[mask] = hsv_to_rgb(hsv)
+    return out
+
+
+def scale_brightness(rgb, factor, mask = None):
+    """ Returns a copy of an (..., 3) RGB array with HSV value scaled by factor
+    and saturated to the RGB range.
+    """
+    out = np.array(rgb, dtype = np.uint8)
+    selected = out if mask is None else out[mask]
+    scaled = np.floor(selected*float(factor) + 0.5)
+    scaled = np.clip(scaled, COLOR_MIN, COLOR_MAX).astype(np.uint8)
+    if mask is None:
+        out[...] = scaled
+    else:
+        out[mask] = scaled
+    return out
+
+
+def gamma_table(gamma, brightness = 1.):
+    """ Returns a 256-entry uint8 lookup table mapping channel values through
+    a gamma curve, scaled by brightness; apply it with table[colors].
+    """
+    levels = np.arange(COLOR_MAX + 1, dtype = np.float64)/COLOR_MAX
+    table = np.floor(COLOR_MAX*float(brightness)*levels**float(gamma) + 0.5)
+    return np.clip(table, COLOR_MIN, COLOR_MAX).astype(np.uint8)
+
+
+def random_colors(shape):
+    """ Returns an array of uniformly random uint8 RGB values with the given
+    leading shape, e.g. (height, width).
+    """
+    return np.random.randint(COLOR_MIN, COLOR_MAX + 1, 
+                             size = tuple(shape) + (3,)).astype(np.uint8)
+
+
 DMX_INVALID = -1
-DMX_LOWER = -1
-DMX_UPPER = -1
+DMX_LOWER = 0
+DMX_UPPER = 512
 
 
-@ConditionalDecorator(use_numba, autojit)
 class DMXAddress(object):
     """Defines the DMX address for a live pixel.
     """
@@ -98,7 +188,7 @@ class DMXAddress(object):
         self.__address = address
 
     def is_valid(self): 
-        return self.__address != DMX_INVALID
+        return self.address != DMX_INVALID
 
     def __get_universe(self): 
         return self.__universe
@@ -122,27 +212,41 @@ class DMXAddress(object):
 
     def __repr__(self):
         formatted = "<DMXAddress (universe = %0.3f, address = %0.3f)>"
-        return formatted % (self.__universe, self.__address)
+        return formatted % (self.universe, self.address)
     
 
-@ConditionalDecorator(use_numba, autojit)
+def _unique_groups(groups):
+    """ Returns a tuple of group ids without repeats, in order.
+    """
+    unique = []
+    for group in groups:
+        if int(group) not in unique:
+            unique.append(int(group))
+    return tuple(unique)
+
+
 class Pixel(object):
     """ A pixel has a color and location and belong to a group. If it is live, it
-    must have a valid DMX address.  
-    TODO: Allow multiple route numbers?
+    must have a valid DMX address. A pixel can be in several groups (e.g. a
+    hold shared by climbing routes): groups lists them all, group being the
+    first.
     """
     
-    # __slots__ = {'__color', '__address', '__live', '__group'}
+    # __slots__ = {'__color', '__address', '__live', '__group', '__extra'}
     
     def __init__(self, 
                  color = Color(0, 0, 0, 0),
                  address = DMXAddress(0, 0), 
                  live = False, 
-                 group = 0):
+                 group = 0, 
+                 groups = None):
         self.__color = color
         self.__address = address
         self.__live = live
         self.__group = group
+        self.__extra = ()
+        if groups is not None:
+            self.groups = groups
         # assert not live or (live and address.is_valid())
         
     def __get_color(self): 
@@ -173,65 +277,549 @@ class Pixel(object):
     def __del_group(self): 
         del self.__group
 
+    def __get_groups(self): 
+        return _unique_groups((self.__group,) + self.__extra)
+    def __set_groups(self, val): 
+        if len(val) == 0:
+            raise ValueError("A pixel must be in at least one group.")
+        self.__group = val[0]
+        self.__extra = _unique_groups(val)[1:]
+
     color = property(__get_color, __set_color, __del_color, "RGB color.")
     address = property(__get_address, __set_address, __del_address, "DMX address.")
     live = property(__get_live, __set_live, __del_live, "Is live pixel?")
     group = property(__get_group, __set_group, __del_group, "Is the pixel part of a group?")
+    groups = property(__get_groups, __set_groups, None, "Every group of the pixel, group first.")
 
     def __repr__(self):
         return "".join(["<Pixel ", 
-                        str(self.__color), ",", 
-                        str(self.__address), ",", 
-                        "live = ", str(self.__live), ",", 
-                        "group = ", str(self.__group), ">"])
+                        str(self.color), ",", 
+                        str(self.address), ",", 
+                        "live = ", str(self.live), ",", 
+                        "groups = ", str(self.groups), ">"])
+
+
+def saturate(val):
+    """ Clamps a channel value into [COLOR_MIN, COLOR_MAX].
+    """
+    return min(max(int(val), COLOR_MIN), COLOR_MAX)
+
+
+class ColorView(Color):
+    """ A Color that reads and writes through to one cell of a Panel's color
+    plane. Alpha is not stored by the panel and always reads as zero.
+    """
+
+    __slots__ = {'__plane', '__row', '__col'}
+
+    def __init__(self, plane, row, col):
+        self.__plane = plane
+        self.__row = row
+        self.__col = col
+
+    def __get_red(self): 
+        return int(self.__plane[self.__row, self.__col, 0])
+    def __set_red(self, val): 
+        self.__plane[self.__row, self.__col, 0] = saturate(val)
+
+    def __get_green(self): 
+        return int(self.__plane[self.__row, self.__col, 1])
+    def __set_green(self, val): 
+        self.__plane[self.__row, self.__col, 1] = saturate(val)
+
+    def __get_blue(self): 
+        return int(self.__plane[self.__row, self.__col, 2])
+    def __set_blue(self, val): 
+        self.__plane[self.__row, self.__col, 2] = saturate(val)
+
+    def __get_alpha(self): 
+        return 0
+    def __set_alpha(self, val): 
+        pass
+
+    red = property(__get_red, __set_red, None, "Red channel.")
+    green = property(__get_green, __set_green, None, "Green channel.")
+    blue = property(__get_blue, __set_blue, None, "Blue channel.")
+    alpha = property(__get_alpha, __set_alpha, None, "Unused; always zero.")
+
+    @property
+    def rgba(self):
+        """ Raw RGB-Alpha tuple (not normalized).
+        """
+        r, g, b = self.__plane[self.__row, self.__col]
+        return (int(r), int(g), int(b), 0)
+
+    def set_rgb(self, red, green, blue, alpha = 0):
+        """ Set RGB convenience method, as a single write to the plane.
+        """ 
+        self.__plane[self.__row, self.__col] = (saturate(red), 
+                                                saturate(green), 
+                                                saturate(blue))
+
+
+class DMXAddressView(DMXAddress):
+    """ A DMXAddress that reads and writes through to one cell of a Panel's
+    universe and address planes.
+    """
+
+    __slots__ = {'__panel', '__x', '__y'}
+
+    def __init__(self, panel, x, y):
+        self.__panel = panel
+        self.__x = x
+        self.__y = y
+
+    def __get_universe(self): 
+        return int(self.__panel.universe_plane[self.__y, self.__x])
+    def __set_universe(self, val): 
+        self.__panel.set_pixel(self.__x, self.__y, universe = val)
+
+    def __get_address(self): 
+        return int(self.__panel.address_plane[self.__y, self.__x])
+    def __set_address(self, val):
+        if not DMX_LOWER <= val <= DMX_UPPER:
+            val = DMX_INVALID
+        self.__panel.set_pixel(self.__x, self.__y, address = val)
+
+    universe = property(__get_universe, __set_universe, None, "DMX universe.")
+    address = property(__get_address, __set_address, None, "DMX address.")
+
+
+class PixelView(Pixel):
+    """ A lightweight Pixel backed by one (x, y) cell of a Panel. Nothing is
+    copied: reading color or address returns views onto the panel planes, and
+    assigning a Color or DMXAddress copies its values into them.
+    """
+
+    __slots__ = {'__panel', '__x', '__y'}
+
+    def __init__(self, panel, x, y):
+        self.__panel = panel
+        self.__x = x
+        self.__y = y
+
+    def __get_color(self): 
+        return ColorView(self.__panel.color_plane, self.__y, self.__x)
+    def __set_color(self, val): 
+        self.__panel.color_plane[self.__y, self.__x] = (saturate(val.red), 
+                                                        saturate(val.green), 
+                                                        saturate(val.blue))
+
+    def __get_address(self): 
+        return DMXAddressView(self.__panel, self.__x, self.__y)
+    def __set_address(self, val): 
+        self.__panel.set_pixel(self.__x, self.__y, 
+                               universe = val.universe, 
+                               address = val.address)
+
+    def __get_live(self): 
+        return bool(self.__panel.live_plane[self.__y, self.__x])
+    def __set_live(self, val): 
+        self.__panel.set_pixel(self.__x, self.__y, live = val)
+
+    def __get_group(self): 
+        return int(self.__panel.group_plane[self.__y, self.__x])
+    def __set_group(self, val): 
+        self.__panel.set_pixel(self.__x, self.__y, group = val)
+
+    def __get_groups(self): 
+        return self.__panel.layout.groups_of(self.__x, self.__y)
+    def __set_groups(self, val): 
+        self.__panel.set_groups(self.__x, self.__y, val)
+
+    color = property(__get_color, __set_color, None, "RGB color.")
+    address = property(__get_address, __set_address, None, "DMX address.")
+    live = property(__get_live, __set_live, None, "Is live pixel?")
+    group = property(__get_group, __set_group, None, "Is the pixel part of a group?")
+    groups = property(__get_groups, __set_groups, None, "Every group of the pixel, group first.")
+
+
+class PanelLayout(object):
+    """ PanelLayout holds the (height, width) universe, address, live and group
+    planes of a Panel: everything except its colors. The planes are exposed as
+    read-only views; change them through set_pixel or set_planes, which bump
+    the layout revision so that anything compiled from the addressing (e.g. a
+    DMXPatchMap, or the PanelIndex) knows to rebuild. Buffered panels share a
+    single layout.
+
+    The flat indices of the live cells are kept in live_cells, updated in
+    place as pixels go live or dead, for code that only needs to touch those.
+    The group plane holds each cell's first group; cells in more than one
+    group keep the others in extra_groups. Group changes don't bump the
+    revision, as nothing compiled from the addressing depends on them;
+    instead they are applied in place to the GroupIndex.
+    """
+
+    __slots__ = {'__universes', '__addresses', '__live', '__groups', 
+                 '__views', '__revision', '__index', '__extra', '__group_index',
+                 '__live_cells'}
+
+    def __init__(self, size, group = 0, layout = None):
+        x, y = size
+        self.__universes = np.zeros((y, x), dtype = np.int32)
+        self.__addresses = np.zeros((y, x), dtype = np.int32)
+        self.__live = np.zeros((y, x), dtype = np.bool_)
+        self.__groups = np.empty((y, x), dtype = np.int32)
+        self.__groups.fill(group)
+        self.__views = {}
+        for name, plane in [('universe', self.__universes), 
+                            ('address', self.__addresses), 
+                            ('live', self.__live), 
+                            ('group', self.__groups)]:
+            view = plane.view()
+            view.flags.writeable = False
+            self.__views[name] = view
+        self.__revision = 0
+        self.__index = None
+        self.__extra = {}
+        self.__group_index = None
+        self.__set_live_cells(np.zeros(0, dtype = np.intp))
+        if layout is not None:
+            self.set_planes(universes = layout.universe_plane, 
+                            addresses = layout.address_plane, 
+                            live = layout.live_plane, 
+                            groups = layout.group_plane)
+            self.__extra = layout.extra_groups
+
+    @property
+    def universe_plane(self):
+        """ Read-only (height, width) array of DMX universes.
+        """
+        return self.__views['universe']
+
+    @property
+    def address_plane(self):
+        """ Read-only (height, width) array of DMX start addresses.
+        """
+        return self.__views['address']
+
+    @property
+    def live_plane(self):
+        """ Read-only (height, width) boolean array of live pixels.
+        """
+        return self.__views['live']
+
+    @property
+    def group_plane(self):
+        """ Read-only (height, width) array of pixel group ids.
+        """
+        return self.__views['group']
+
+    @property
+    def revision(self):
+        """ Counter that increases whenever any of the planes change.
+        """
+        return self.__revision
+
+    @property
+    def live_cells(self):
+        """ Read-only sorted array of the flat indices (y*width + x) of the
+        live cells. Changes replace the array rather than modify it, so one
+        taken at the start of a frame stays consistent.
+        """
+        return self.__live_cells
+
+    def __set_live_cells(self, cells):
+        cells.flags.writeable = False
+        self.__live_cells = cells
+
+    @property
+    def index(self):
+        """ The PanelIndex of the current planes (live pixels by group, by
+        universe and by position), rebuilt on first use after they change.
+        """
+        index = self.__index
+        if index is None or not index.is_current(self):
+            from diodberg.core.index import PanelIndex
+            index = self.__index = PanelIndex(self)
+        return index
+
+    @property
+    def group_index(self):
+        """ The GroupIndex of the cells in each group, built on first use and
+        then kept up to date.
+        """
+        if self.__group_index is None:
+            from diodberg.core.index import GroupIndex
+            self.__group_index = GroupIndex(self.__groups, self.__extra)
+        return self.__group_index
+
+    @property
+    def extra_groups(self):
+        """ {flat cell index: tuple of groups} for the cells in more than one
+        group, without the group in the group plane.
+        """
+        return dict(self.__extra)
+
+    def groups_of(self, x, y):
+        """ Every group of the pixel at (x, y), its group plane entry first.
+        """
+        cell = y*self.__groups.shape[1] + x
+        return (int(self.__groups[y, x]),) + self.__extra.get(cell, ())
+
+    def set_groups(self, x, y, groups):
+        """ Puts the pixel at (x, y) in groups, and only those: the first goes
+        in the group plane, the others in extra_groups.
+        """
+        groups = _unique_groups(groups)
+        if len(groups) == 0:
+            raise ValueError("A pixel must be in at least one group.")
+        cell = y*self.__groups.shape[1] + x
+        old = self.groups_of(x, y)
+        self.__groups[y, x] = groups[0]
+        if len(groups) > 1:
+            self.__extra[cell] = groups[1:]
+        else:
+            self.__extra.pop(cell, None)
+        index = self.__group_index
+        if index is not None:
+            for group in set(old) - set(groups):
+                index.remove(group, cell)
+            for group in set(groups) - set(old):
+                index.add(group, cell)
+
+    def set_pixel(self, x, y, universe = None, address = None, live = None, 
+                  group = None):
+        """ Sets the fields of the pixel at (x, y). Fields left as None are
+        unchanged. group replaces the pixel's first group, keeping any others.
+        """
+        if universe is not None:
+            self.__universes[y, x] = universe
+        if address is not None:
+            self.__addresses[y, x] = address
+        if live is not None and bool(live) != self.__live[y, x]:
+            self.__live[y, x] = live
+            cell = y*self.__live.shape[1] + x
+            cells = self.__live_cells
+            i = np.searchsorted(cells, cell)
+            self.__set_live_cells(np.insert(cells, i, cell) if live else 
+                                  np.delete(cells, i))
+        if group is not None:
+            self.set_groups(x, y, (group,) + self.groups_of(x, y)[1:])
+        if any(val is not None for val in (universe, address, live)):
+            self.__revision += 1
+
+    def set_planes(self, universes = None, addresses = None, live = None, 
+                   groups = None, mask = None):
+        """ Bulk version of set_pixel. Each value is broadcast into its whole
+        plane or, with a (height, width) boolean mask, into the masked cells.
+        """
+        where = Ellipsis if mask is None else mask
+        if universes is not None:
+            self.__universes[where] = universes
+        if addresses is not None:
+            self.__addresses[where] = addresses
+        if live is not None:
+            self.__live[where] = live
+            self.__set_live_cells(np.flatnonzero(self.__live))
+        if groups is not None:
+            self.__groups[where] = groups
+            for cell, extra in self.__extra.items():
+                group = int(self.__groups.flat[cell])
+                if group in extra:
+                    extra = tuple(g for g in extra if g != group)
+                    if extra:
+                        self.__extra[cell] = extra
+                    else:
+                        del self.__extra[cell]
+            # A bulk change rebuilds the group index on its next use.
+            self.__group_index = None
+        if any(val is not None for val in (universes, addresses, live)):
+            self.__revision += 1
+
+    def __repr__(self):
+        return "PanelLayout<revision = %d>" % self.__revision
 
 
 class Panel(object):
     """ Panel represents a collection of pixels, representing a climbing wall. It
-    is currently structured as a dictionary keyed by (x, y) and can be
-    constructed from a file specification or copy-constructed from another
-    panel.
-    TODO: Replace with a numpy matrix.
+    is stored as a structure of arrays: an (height, width, 3) uint8 color plane
+    plus a PanelLayout of (height, width) universe, address, live and group
+    planes. Pixels are keyed by (x, y), and panel[(x, y)] returns a PixelView
+    onto those planes. Effects and renderers that care about speed should work
+    on the planes directly. A panel can be loaded from a wall specification
+    file (panel panel_id of filename; see diodberg.core.spec) or
+    copy-constructed from another panel; with share_layout, the copy gets its
+    own colors but shares the other panel's layout. colors
+    may supply existing (height, width, 3) uint8 storage for the color plane,
+    e.g. an array in shared memory.
+
+    The color plane is freely writable. The other planes are read-only: change
+    them through set_pixel or set_planes. Groups (e.g. climbing routes) are
+    indexed, so that set_group_color and fade_group only touch their pixels.
+    Walls are mostly dead cells, so effects and renderers can work on the live
+    pixels alone: see live_cells, live_colors and iterlive.
     """
     
     __base_group = 0
-    __slots__ = {'__dim', '__pixels'}
+    __slots__ = {'__dim', '__colors', '__layout'}
 
-    def __init__(self, size = (1, 1), panel = None, filename = None, panel_id = 0):
+    def __init__(self, size = (1, 1), panel = None, filename = None, panel_id = 0, 
+                 share_layout = False, colors = None):
+        if panel is None and filename is not None:
+            from diodberg.core.spec import read_panel
+            panel = read_panel(filename, panel_id)
+            share_layout = True
+        if panel is not None:
+            size = (panel.width, panel.height)
         self.__dim = size
         x, y = self.__dim
-        color = Color(0, 0, 0, 0)
-        address = DMXAddress(0, 0)
-        live = False
-        group = 0
-        alloc = [[Pixel(color, address, live, group) for i in xrange(x)] for j in xrange(y)]
-        self.__pixels = np.matrix(alloc, dtype = object).transpose()
+        if colors is None:
+            self.__colors = np.zeros((y, x, 3), dtype = np.uint8)
+        else:
+            assert colors.shape == (y, x, 3) and colors.dtype == np.uint8, \
+                "Color plane must be a (height, width, 3) uint8 array."
+            self.__colors = colors
         if panel is not None:
-            assert False, "TODO: Add custom copy"
-            # self.__pixels = deepcopy(panel.__pixels)
-        elif filename is not None:
-            assert False, "TODO: Replace with json decoder."
+            self.__colors[:] = panel.color_plane
+            if share_layout:
+                self.__layout = panel.layout
+            else:
+                self.__layout = PanelLayout(size, layout = panel.layout)
+        else:
+            self.__layout = PanelLayout(size, Panel.__base_group)
+
+    @property
+    def color_plane(self):
+        """ (height, width, 3) uint8 array of RGB values.
+        """
+        return self.__colors
+
+    @property
+    def layout(self):
+        """ The PanelLayout holding the non-color planes.
+        """
+        return self.__layout
+
+    @property
+    def universe_plane(self):
+        """ Read-only (height, width) array of DMX universes.
+        """
+        return self.__layout.universe_plane
+
+    @property
+    def address_plane(self):
+        """ Read-only (height, width) array of DMX start addresses.
+        """
+        return self.__layout.address_plane
+
+    @property
+    def live_plane(self):
+        """ Read-only (height, width) boolean array of live pixels.
+        """
+        return self.__layout.live_plane
+
+    @property
+    def group_plane(self):
+        """ Read-only (height, width) array of pixel group ids.
+        """
+        return self.__layout.group_plane
+
+    @property
+    def revision(self):
+        """ The layout revision; see PanelLayout.
+        """
+        return self.__layout.revision
+
+    @property
+    def index(self):
+        """ The layout's PanelIndex; see PanelLayout.index.
+        """
+        return self.__layout.index
+
+    def set_pixel(self, x, y, universe = None, address = None, live = None, 
+                  group = None):
+        """ Sets the non-color fields of the pixel at (x, y). Fields left as None
+        are unchanged.
+        """
+        self.__layout.set_pixel(x, y, universe, address, live, group)
+
+    def set_planes(self, universes = None, addresses = None, live = None, 
+                   groups = None, mask = None):
+        """ Bulk version of set_pixel; see PanelLayout.set_planes.
+        """
+        self.__layout.set_planes(universes, addresses, live, groups, mask)
+
+    def set_groups(self, x, y, groups):
+        """ Puts the pixel at (x, y) in groups; see PanelLayout.set_groups.
+        """
+        self.__layout.set_groups(x, y, groups)
+
+    def group_pixels(self, group):
+        """ Returns the (x, y) arrays of the pixels in a group, from the
+        layout's GroupIndex.
+        """
+        return np.divmod(self.__layout.group_index.members(group), self.width)[::-1]
+
+    def group_mask(self, group):
+        """ Returns a (height, width) boolean mask of the pixels in a group.
+        """
+        mask = np.zeros((self.height, self.width), dtype = np.bool_)
+        mask.reshape(-1)[self.__layout.group_index.members(group)] = True
+        return mask
+
+    def set_group_color(self, group, color):
+        """ Sets every pixel in a group to color, a Color or an RGB triple.
+        """
+        if isinstance(color, Color):
+            color = (color.red, color.green, color.blue)
+        x, y = self.group_pixels(group)
+        self.__colors[y, x] = np.clip(color, COLOR_MIN, COLOR_MAX)
+
+    def fade_group(self, group, factor):
+        """ Scales the colors of a group's pixels by factor, saturating.
+        """
+        x, y = self.group_pixels(group)
+        self.__colors[y, x] = scale_brightness(self.__colors[y, x], factor)
+
+    @property
+    def live_cells(self):
+        """ Sorted flat indices of the live pixels; see PanelLayout.live_cells.
+        """
+        return self.__layout.live_cells
+
+    def live_positions(self, cells = None):
+        """ Returns the (x, y) arrays of the live pixels (or of the given flat
+        cells).
+        """
+        if cells is None:
+            cells = self.__layout.live_cells
+        y, x = np.divmod(cells, self.width)
+        return x, y
+
+    def live_colors(self, cells = None):
+        """ Returns an (N, 3) copy of the colors of the live pixels (or of the
+        given flat cells, e.g. a live_cells snapshot).
+        """
+        if cells is None:
+            cells = self.__layout.live_cells
+        return self.__colors.reshape(-1, 3)[cells]
+
+    def set_live_colors(self, colors, cells = None):
+        """ Writes an (N, 3) array of colors back to the live pixels (or to
+        the given flat cells), as returned by live_colors.
+        """
+        if cells is None:
+            cells = self.__layout.live_cells
+        self.__colors.reshape(-1, 3)[cells] = colors
 
     @property
     def locations(self):
         """ Returns an array of (x, y) tuple locations for pixels.
         """
-        return self.__pixels.keys()
+        return [(x, y) for x in xrange(self.width) for y in xrange(self.height)]
 
     @property
     def addresses(self):
         """ Returns a dictionary, keyed by DMX universe, of available DMX
-        addresses.
-        """
-        address_dict = dict()
-        for loc, pixel in self.__pixels.items():
-            address = pixel.address.address
-            universe = pixel.address.universe
-            if universe not in address_dict:
-                address_dict[universe] = [address]
-            else:
-                address_dict[universe].append(address)
-        return address_dict
+        addresses for live pixels.
+        """
+        live = self.live_plane
+        universes = self.universe_plane[live]
+        order = np.argsort(universes, kind = 'mergesort')
+        keys, starts = np.unique(universes[order], return_index = True)
+        groups = np.split(self.address_plane[live][order], starts[1:])
+        return dict((int(u), a.tolist()) for u, a in zip(keys, groups))
 
     @property
     def width(self):
@@ -249,10 +837,14 @@ class Panel(object):
 
     @property 
     def raw(self):
-        return self.__panel
+        return self.__colors
 
-    def write(self, filename, panel_id):
-        assert False, "TODO: Replace with json decoder."
+    def write(self, filename, panel_id = 0):
+        """ Saves the panel into a wall specification file as panel_id,
+        keeping the file's other panels; see diodberg.core.spec.
+        """
+        from diodberg.core.spec import write_panel
+        write_panel(filename, self, panel_id)
 
     def show(self, debug = True):
         """ Convenience method for viewing panel.
@@ -265,30 +857,161 @@ class Panel(object):
             except KeyboardInterrupt:
                 print "\nQuiting!"
                 exit()
+
+    def iteritems(self):
+        """ Iterates over ((x, y), PixelView) pairs.
+        """ 
+        for x in xrange(self.width):
+            for y in xrange(self.height):
+                yield (x, y), PixelView(self, x, y)
+
+    def iterlive(self):
+        """ Iterates over ((x, y), PixelView) pairs of the live pixels only, in
+        row order.
+        """
+        width = self.width
+        for cell in self.__layout.live_cells.tolist():
+            y, x = divmod(cell, width)
+            yield (x, y), PixelView(self, x, y)
     
     def __contains__(self, key):
-        try:
-            return self.__pixels[key] is not None
-        except IndexError:
-            return False
+        x, y = key
+        return 0 <= x < self.width and 0 <= y < self.height
 
     def __getitem__(self, key):
-        return self.__pixels[key]
+        if key not in self:
+            raise IndexError("Pixel location out of range: " + str(key))
+        x, y = key
+        return PixelView(self, x, y)
 
     def __setitem__(self, key, value):
-        self.__pixels[key] = value
+        pixel = self[key]
+        pixel.color = value.color
+        x, y = key
+        self.set_pixel(x, y, 
+                       universe = value.address.universe, 
+                       address = value.address.address, 
+                       live = value.live)
+        self.set_groups(x, y, value.groups)
 
     def __delitem__(self, key):
-        del self.__pixels[key]
+        self[key] = Pixel(Color(0, 0, 0, 0), DMXAddress(0, 0), False, Panel.__base_group)
 
     def __len__(self):
-        return len(self.__pixels)
+        return self.width*self.height
 
     def __iter__(self):
-        return iter(self.__pixels)
+        return iter(self.locations)
+
+    def __repr__(self):
+        return "".join(["Panel<", str(self.__dim), ">"])
+
+
+class PanelBuffers(object):
+    """ PanelBuffers is a swap chain of two or three Panels that share one
+    layout, so that filling and rendering can run on different threads. The
+    filler draws into back and calls publish() when the frame is complete; the
+    output thread takes the newest published frame with acquire() and hands it
+    back with release(). Publishing copies the finished colors into the new back
+    buffer, so effects that update the previous frame in place keep working.
+
+    With two buffers the filler waits in publish() while the front buffer is
+    still being rendered. With three it never waits, and frames the output
+    thread didn't get to are dropped in favour of the newest one.
+    """
+
+    __slots__ = {'__panels', '__back', '__ready', '__front', '__cond', 
+                 '__closed', '__published', '__dropped'}
+
+    def __init__(self, panel, count = 2):
+        assert count in (2, 3), "Only double or triple buffering is supported."
+        self.__panels = [panel] + [Panel(panel = panel, share_layout = True) 
+                                   for i in xrange(count - 1)]
+        self.__back = 0
+        self.__ready = None
+        self.__front = None
+        self.__cond = threading.Condition()
+        self.__closed = False
+        self.__published = 0
+        self.__dropped = 0
+
+    @property
+    def back(self):
+        """ The Panel currently being filled.
+        """
+        return self.__panels[self.__back]
+
+    @property
+    def panels(self):
+        return list(self.__panels)
+
+    def publish(self):
+        """ Marks the back buffer as the newest complete frame and returns the
+        new back buffer, initialized with a copy of that frame's colors.
+        """
+        with self.__cond:
+            if self.__ready is not None:
+                self.__dropped += 1
+            completed = self.__panels[self.__back]
+            self.__ready = self.__back
+            self.__published += 1
+            self.__cond.notify_all()
+            while not self.__closed:
+                free = [i for i in xrange(len(self.__panels)) 
+                        if i not in (self.__ready, self.__front)]
+                if free:
+                    break
+                self.__cond.wait()
+            if self.__closed:
+                return self.back
+            self.__back = free[0]
+        back = self.__panels[self.__back]
+        back.color_plane[...] = completed.color_plane
+        return back
+
+    def acquire(self, timeout = None):
+        """ Waits for a published frame and returns it as the front buffer, or
+        None if the buffers were closed or the timeout expired.
+        """
+        with self.__cond:
+            if self.__ready is None and not self.__closed:
+                self.__cond.wait(timeout)
+            if self.__ready is None or self.__closed:
+                return None
+            self.__front = self.__ready
+            self.__ready = None
+            return self.__panels[self.__front]
+
+    def release(self):
+        """ Hands the front buffer back once it has been rendered.
+        """
+        with self.__cond:
+            self.__front = None
+            self.__cond.notify_all()
+
+    def close(self):
+        """ Wakes up and releases any thread waiting on the buffers.
+        """
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+
+    @property
+    def closed(self):
+        return self.__closed
+
+    @property
+    def stats(self):
+        """ Frames published, and frames dropped because a newer one replaced
+        them before they were rendered.
+        """
+        return {'published': self.__published, 'dropped': self.__dropped}
+
+    def __len__(self):
+        return len(self.__panels)
 
     def __repr__(self):
-        return "".join(["Panel<", str(self.__pixels), ">"])
+        return "PanelBuffers<%d x %s>" % (len(self.__panels), self.__panels[0])
 
 
 def random_color():
@@ -313,10 +1036,13 @@ def random_panel(size = (640, 480), num_pixels = 200, live = False):
     x, y = size 
     assert x*y >= num_pixels, "Number of pixels exceed snumber of slots."
     panel = Panel(size)
-    for i in xrange(num_pixels):
+    # Pixels take 3 channels each, so pack them into consecutive universes.
+    per_universe = (DMX_UPPER - DMX_LOWER)/3
+    slots = random.sample(xrange(x*y), num_pixels)
+    for i, slot in enumerate(slots):
         color = random_color()
-        location = random_location(x, y)
-        address = DMXAddress(0, i)
+        location = (slot % x, slot/x)
+        address = DMXAddress(i/per_universe, 3*(i % per_universe))
         group = 0
         live = True
         panel[location] = Pixel(color, address, live, group)
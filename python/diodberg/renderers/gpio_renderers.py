@@ -1,94 +1,596 @@
+from diodberg.core.instrumentation import ENCODE
+from diodberg.core.instrumentation import WRITE
+from diodberg.core.patch import DMX_CHANNELS_PER_PIXEL
+from diodberg.core.patch import DMX_UNIVERSE_SIZE
+from diodberg.core.patch import DMXPatchMap
 from diodberg.core.renderer import Renderer
-import serial
+from diodberg.core.calibration import Calibration
+from diodberg.util.utils import monotonic
+import numpy as np
+import sys
 try:
     import RPi.GPIO
 except ImportError as err: 
     sys.stderr.write("Error: failed to import module ({})".format(err))
+try:
+    import spidev
+except ImportError as err: 
+    sys.stderr.write("Error: failed to import module ({})".format(err))
+try:
+    import rpi_ws281x
+except ImportError as err: 
+    sys.stderr.write("Error: failed to import module ({})".format(err))
+
+
+PWM_DUTY_MAX = 100.
+
+
+class PWMBackend(object):
+    """ PWMBackend is the base of the drivers PiGPIORenderer sets duty cycles
+    through. setup() is called once with the pin of each channel, then update()
+    with the channels whose duty cycle changed, and their duty cycles as
+    percentages (0 - 100); it returns the number of driver calls it made.
+    """
+
+    def setup(self, pins, frequencyHz):
+        pass
+
+    def update(self, channels, duties):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return "PWMBackend"
+
+
+class RPiGPIOBackend(PWMBackend):
+    """ RPiGPIOBackend runs RPi.GPIO software PWM on each pin (board numbering),
+    one ChangeDutyCycle call per changed channel.
+    """
+
+    __slots__ = {'__pwm'}
+
+    def __init__(self):
+        self.__pwm = []
+
+    def setup(self, pins, frequencyHz):
+        RPi.GPIO.setmode(RPi.GPIO.BOARD)
+        RPi.GPIO.setwarnings(True)
+        for pin in pins:
+            RPi.GPIO.setup(pin, RPi.GPIO.OUT, initial = RPi.GPIO.LOW)
+            pwm = RPi.GPIO.PWM(pin, frequencyHz)
+            pwm.start(0)
+            self.__pwm.append(pwm)
+
+    def update(self, channels, duties):
+        pwm = self.__pwm
+        for channel, duty in zip(channels.tolist(), duties.tolist()):
+            pwm[channel].ChangeDutyCycle(duty)
+        return len(channels)
+
+    def close(self):
+        if not self.__pwm:
+            return
+        for pwm in self.__pwm:
+            pwm.stop()
+        self.__pwm = []
+        RPi.GPIO.cleanup()
+
+    def __repr__(self):
+        return "RPiGPIOBackend"
+
+
+class PiBlasterBackend(PWMBackend):
+    """ PiBlasterBackend drives the pins (BCM numbering) through the pi-blaster
+    daemon, which times PWM on every pin by DMA. All the channels that changed
+    in a frame go out as one write of "pin=duty" lines to its FIFO. The PWM
+    frequency is the daemon's own.
+    """
+
+    __slots__ = {'__device', '__fifo', '__pins'}
+
+    def __init__(self, device = "/dev/pi-blaster"):
+        self.__device = device
+        self.__fifo = None
+        self.__pins = []
+
+    def setup(self, pins, frequencyHz):
+        self.__pins = list(pins)
+        self.__fifo = open(self.__device, 'w', 0)
+
+    def update(self, channels, duties):
+        pins = self.__pins
+        self.__fifo.write("".join("%d=%.4f\n" % (pins[channel], duty/PWM_DUTY_MAX)
+                                  for channel, duty in zip(channels.tolist(), 
+                                                           duties.tolist())))
+        return 1
+
+    def close(self):
+        if self.__fifo is not None:
+            self.__fifo.close()
+            self.__fifo = None
+
+    def __repr__(self):
+        return "PiBlasterBackend<%s>" % self.__device
+
+
+class FakePWMBackend(PWMBackend):
+    """ FakePWMBackend keeps the duty cycles in memory, counting updates and
+    calls as RPi.GPIO would make them (one per channel), or, with batched, as
+    a single call per frame. For tests and benchmarks off the Pi.
+    """
+
+    __slots__ = {'__batched', '__duties', '__calls', '__updates'}
+
+    def __init__(self, batched = False):
+        self.__batched = batched
+        self.__duties = np.zeros(0)
+        self.__calls = 0
+        self.__updates = 0
+
+    def setup(self, pins, frequencyHz):
+        self.__duties = np.zeros(len(pins))
+
+    def update(self, channels, duties):
+        self.__duties[channels] = duties
+        calls = 1 if self.__batched else len(channels)
+        self.__calls += calls
+        self.__updates += len(channels)
+        return calls
+
+    @property
+    def duties(self):
+        """ Current duty cycle of every channel, in percent.
+        """
+        return self.__duties
+
+    @property
+    def calls(self):
+        return self.__calls
+
+    @property
+    def updates(self):
+        return self.__updates
+
+    def __repr__(self):
+        return "FakePWMBackend"
 
 
 class PiGPIORenderer(Renderer):
     """ PiGPIORenderer provides a renderer interface directly to the GPIO pins on
-    the RaspberryPi. It assumes that all the pixels on a panel here are on the
-    same universe. The GPIO is configured to reflect the pin outs on the board.
+    the RaspberryPi, one PWM channel per color channel: a pixel at DMX address
+    a drives channels a, a + 1 and a + 2. It assumes that all the pixels on a
+    panel here are on universe 0. Channel i is pin pins[i], by default pin i.
+
+    Colors are quantized to levels duty cycle steps, and only the channels
+    whose step changed since the last frame are passed to the backend, which
+    defaults to RPi.GPIO software PWM; see PWMBackend for the others.
     """ 
     
-    __num_channels = 26
-    __pwm_frequencyHz = 50
-    __pwm_init_dc = 0
-    
-    __slots__ = {'__pwm'}
+    __slots__ = {'__backend', '__channels', '__levels', '__steps', '__patch',
+                 '__stats'}
 
-    def __init__(self, channels = 26):
+    def __init__(self, channels = 26, backend = None, pins = None, levels = 100,
+                 frequency = 50):
         super(PiGPIORenderer, self).__init__()
-        RPi.GPIO.setmode(RPi.GPIO.BOARD)
-        RPi.GPIO.setwarnings(True)
-        self.__pwm = []
-        for channel in xrange(channels):
-            RPi.GPIO.setup(channel, RPi.GPIO.OUT, initial = RPi.GPIO.LOW)
-            self.__pwm.append(RPi.GPIO.PWM(channel, PiGPIORenderer.__pwm_frequencyHz))
-            self.__pwm[channel].start(PiGPIORenderer.__pwm_init_dc)
+        self.__backend = RPiGPIOBackend() if backend is None else backend
+        self.__channels = channels
+        self.__levels = levels
+        # Unknown duty cycles, so that the first frame sets every channel.
+        self.__steps = np.full(channels, -1, dtype = np.int32)
+        self.__patch = None
+        self.__backend.setup(range(channels) if pins is None else pins, frequency)
+        self.reset_stats()
+
+    def prepare(self, panel):
+        self.patch(panel)
+
+    def patch(self, panel):
+        """ Returns the DMXPatchMap for the panel, recompiling it only if the
+        panel's addressing has changed. Raises ValueError for pixels off
+        universe 0 or past the last channel.
+        """
+        if self.__patch is not None and self.__patch.is_current(panel):
+            return self.__patch
+        patch = DMXPatchMap(panel, [0])
+        if patch.universes != [0]:
+            raise ValueError("PiGPIORenderer drives universe 0 only, not %s." % 
+                             patch.universes)
+        addresses = panel.address_plane[panel.live_plane]
+        if len(addresses) and addresses.max() + DMX_CHANNELS_PER_PIXEL > self.__channels:
+            raise ValueError("DMX address %d is past the last of %d PWM channels." %
+                             (addresses.max(), self.__channels))
+        self.__patch = patch
+        return patch
         
     def render(self, panel):
-        for loc, pixel in panel.iteritems():
-            assert pixel.address.universe is 0, "All pixels on universe 0."
-            address = pixel.address.address
-            norm = 255.
-            self.__pwm[address].ChangeDutyCycle(pixel.color.red/norm)
-            self.__pwm[address + 1].ChangeDutyCycle(pixel.color.green/norm)
-            self.__pwm[address + 2].ChangeDutyCycle(pixel.color.blue/norm)
+        instruments = self.instruments
+        began = monotonic()
+        patch = self.patch(panel)
+        patch.apply(panel, self.calibration)
+        values = patch.buffers[0, :self.__channels].astype(np.int32)
+        steps = (values*self.__levels + 127)//255
+        changed = np.flatnonzero(steps != self.__steps)
+        encoded = monotonic()
+        instruments.record(ENCODE, encoded - began)
+        stats = self.__stats
+        stats['frames'] += 1
+        stats['skipped'] += self.__channels - len(changed)
+        if len(changed) == 0:
+            return
+        self.__steps[changed] = steps[changed]
+        duties = steps[changed]*(PWM_DUTY_MAX/self.__levels)
+        stats['calls'] += self.__backend.update(changed, duties)
+        stats['updates'] += len(changed)
+        instruments.record(WRITE, monotonic() - encoded)
+
+    @property
+    def stats(self):
+        """ Since the last reset_stats(): frames, channel updates issued,
+        channel updates skipped as unchanged, and backend calls.
+        """
+        return dict(self.__stats)
+
+    def reset_stats(self):
+        self.__stats = {'frames': 0, 'updates': 0, 'skipped': 0, 'calls': 0}
+
+    @property
+    def backend(self):
+        return self.__backend
+
+    def close(self):
+        self.__backend.close()
 
     def __del__(self):
-        for pwm_channel in self.__pwm:
-            pwm_channel.stop()
-        RPi.GPIO.cleanup()
+        self.close()
+
+    def __repr__(self):
+        return "PiGPIORenderer<%s>" % self.__backend
+
+
+# WS2812 timing: every bit is a 1.25 us period starting with a high pulse,
+# short for a 0 and long for a 1, and the line held low for over 280 us
+# (WS2812B; 50 us on the original part) latches the frame.
+WS2812_BIT_S = 1.25e-6
+WS2812_RESET_S = 300e-6
+WS2812_FREQUENCY_HZ = 800000
+
+# Wire order of the color channels, as indices into RGB.
+WS2812_GRB = (1, 0, 2)
+
+
+def spi_symbol_table(symbol_bits = 3):
+    """ Returns a (256, symbol_bits) uint8 table of the SPI bytes for each data
+    byte, with each WS2812 bit sent as symbol_bits SPI bits: 100 and 110 at 3
+    bits (2.4 MHz), 1000 and 1100 at 4 bits (3.2 MHz).
+    """
+    if symbol_bits not in (3, 4):
+        raise ValueError("WS2812 SPI symbols are 3 or 4 bits, not %s." % symbol_bits)
+    bits = np.unpackbits(np.arange(256, dtype = np.uint8)[:, None], axis = 1)
+    zero = np.zeros(symbol_bits, dtype = np.uint8)
+    zero[0] = 1
+    one = zero.copy()
+    one[1] = 1
+    symbols = np.where(bits[..., None] == 1, one, zero)
+    return np.packbits(symbols.reshape(256, 8*symbol_bits), axis = 1)
+
+
+class WS2812Encoder(object):
+    """ WS2812Encoder turns universe buffers, as filled in by a DMXPatchMap, into
+    WS2812 strips: one strip per universe, with pixel p of a strip being the
+    three channels at DMX address 3p. encode() reorders the channels for the
+    wire (GRB) in a single gather per frame, and spi() expands a frame into SPI
+    symbols with one table lookup. Calibration (e.g. gamma) is applied before,
+    as the universe buffers are filled.
+    """
+
+    __slots__ = {'__order', '__index', '__symbols'}
+
+    def __init__(self, order = WS2812_GRB):
+        self.__order = np.asarray(order)
+        self.__index = np.zeros(0, dtype = np.intp)
+        self.__symbols = {}
+
+    def encode(self, buffers, pixels):
+        """ Returns the (strips, 3*pixels) uint8 wire bytes of the first pixels
+        pixels of every universe buffer.
+        """
+        if len(self.__index) != DMX_CHANNELS_PER_PIXEL*pixels:
+            base = DMX_CHANNELS_PER_PIXEL*np.arange(pixels)
+            self.__index = (base[:, None] + self.__order).ravel()
+        return buffers[:, self.__index]
+
+    def spi(self, strips, symbol_bits = 3, out = None):
+        """ Expands encoded strips into (strips, symbol_bits*3*pixels) bytes of
+        SPI symbols. out may be a preallocated array at least that wide, e.g. with
+        room for the reset.
+        """
+        table = self.__symbols.get(symbol_bits)
+        if table is None:
+            table = self.__symbols[symbol_bits] = spi_symbol_table(symbol_bits)
+        symbols = table[strips].reshape(len(strips), -1)
+        if out is None:
+            return symbols
+        out[:, :symbols.shape[1]] = symbols
+        return out
+
+    def __repr__(self):
+        return "WS2812Encoder<order = %s>" % self.__order.tolist()
+
+
+class WS2812Transport(object):
+    """ WS2812Transport is the base of the ways encoded WS2812 strips get to the
+    LEDs. open() is called with the encoder and the strip layout before the
+    first frame and whenever the layout changes, then write() with every
+    frame's (strips, 3*pixels) wire bytes.
+    """
+
+    def open(self, encoder, strips, pixels):
+        pass
+
+    def write(self, strips):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __repr__(self):
+        return "WS2812Transport"
+
+
+class BufferTransport(WS2812Transport):
+    """ BufferTransport keeps the SPI symbols of the last frame in memory instead
+    of sending them, for tests and benchmarks without the hardware.
+    """
+
+    __slots__ = {'__encoder', '__symbol_bits', '__buffer', '__frames'}
+
+    def __init__(self, symbol_bits = 3):
+        self.__symbol_bits = symbol_bits
+        self.__encoder = None
+        self.__buffer = None
+        self.__frames = 0
+
+    def open(self, encoder, strips, pixels):
+        self.__encoder = encoder
+        self.__buffer = np.zeros((strips, self.__symbol_bits*3*pixels), 
+                                 dtype = np.uint8)
+
+    def write(self, strips):
+        self.__encoder.spi(strips, self.__symbol_bits, self.__buffer)
+        self.__frames += 1
+
+    @property
+    def buffer(self):
+        """ (strips, bytes) SPI symbols of the last frame.
+        """
+        return self.__buffer
+
+    @property
+    def frames(self):
+        return self.__frames
 
     def __repr__(self):
-        return "PiGPIORenderer"
+        return "BufferTransport"
+
+
+class SPITransport(WS2812Transport):
+    """ SPITransport drives each strip's data line from the MOSI of a spidev
+    device, devices being (bus, device) pairs in strip order. The SPI clock is
+    set so that symbol_bits SPI bits last one WS2812 bit, and every frame ends
+    with enough zero bytes for the reset. spidev splits writes larger than its
+    bufsiz module parameter (4096 bytes by default); raise it for long strips.
+    """
+
+    __slots__ = {'__devices', '__symbol_bits', '__spi', '__encoder', '__buffer'}
+
+    def __init__(self, devices = ((0, 0),), symbol_bits = 3):
+        self.__devices = list(devices)
+        self.__symbol_bits = symbol_bits
+        self.__spi = []
+        self.__encoder = None
+        self.__buffer = None
+
+    def open(self, encoder, strips, pixels):
+        if strips > len(self.__devices):
+            raise ValueError("%d strips but only %d SPI devices." % 
+                             (strips, len(self.__devices)))
+        self.close()
+        speedHz = int(self.__symbol_bits/WS2812_BIT_S)
+        for bus, device in self.__devices[:strips]:
+            spi = spidev.SpiDev()
+            spi.open(bus, device)
+            spi.max_speed_hz = speedHz
+            spi.mode = 0
+            self.__spi.append(spi)
+        reset = int(np.ceil(WS2812_RESET_S*speedHz/8.))
+        self.__encoder = encoder
+        self.__buffer = np.zeros((strips, self.__symbol_bits*3*pixels + reset), 
+                                 dtype = np.uint8)
+
+    def write(self, strips):
+        buf = self.__encoder.spi(strips, self.__symbol_bits, self.__buffer)
+        for spi, row in zip(self.__spi, buf):
+            spi.writebytes2(row)
+
+    def close(self):
+        for spi in self.__spi:
+            spi.close()
+        self.__spi = []
+
+    def __repr__(self):
+        return "SPITransport<%s>" % self.__devices
+
+
+class PWMTransport(WS2812Transport):
+    """ PWMTransport drives up to two strips from the Pi's PWM channels by DMA,
+    through the rpi_ws281x library, pins being the GPIO of each strip (18 or
+    12 for PWM channel 0, 13 or 19 for channel 1). The library reorders and
+    dims nothing here: the strip type is set to RGB so that the encoder's
+    wire bytes go out as they are. rpi_ws281x has no bulk setter, so each
+    pixel is still one call into the extension.
+    """
+
+    __slots__ = {'__pins', '__dma', '__strips'}
+
+    def __init__(self, pins = (18,), dma = 10):
+        self.__pins = list(pins)
+        self.__dma = dma
+        self.__strips = []
+
+    def open(self, encoder, strips, pixels):
+        if strips > len(self.__pins):
+            raise ValueError("%d strips but only %d PWM pins." % 
+                             (strips, len(self.__pins)))
+        self.__strips = []
+        for channel, pin in enumerate(self.__pins[:strips]):
+            strip = rpi_ws281x.PixelStrip(pixels, pin, WS2812_FREQUENCY_HZ, 
+                                          self.__dma, False, 255, channel, 
+                                          rpi_ws281x.WS2811_STRIP_RGB)
+            strip.begin()
+            self.__strips.append(strip)
+
+    def write(self, strips):
+        # Pack each pixel's three wire bytes into the library's 0xRRGGBB slots.
+        rows = strips.reshape(len(strips), -1, 3).astype(np.uint32)
+        packed = rows[..., 0] << 16 | rows[..., 1] << 8 | rows[..., 2]
+        for strip, values in zip(self.__strips, packed):
+            for i, value in enumerate(values.tolist()):
+                strip.setPixelColor(i, value)
+            strip.show()
+
+    def __repr__(self):
+        return "PWMTransport<%s>" % self.__pins
+
+
+class SerialBridgeTransport(WS2812Transport):
+    """ SerialBridgeTransport sends the strips to boards running the
+    WS2811Serial firmware over the DMX serial link, one universe per strip. The
+    firmware's NeoPixel library does the GRB reordering itself, so the gamma
+    corrected colors go out in RGB channel order. With framed, universes are
+    sent in the framed protocol (for firmware built with DIODBERG_FRAMED), as
+    deltas with a keyframe every keepalive seconds.
+    """
+
+    __slots__ = {'__port', '__writer', '__universes', '__buffers', '__framed',
+                 '__keepaliveS', '__last_full', '__order'}
+
+    def __init__(self, device = None, framed = False, keepalive = 1.):
+        from diodberg.core.framing import FrameEncoder
+        from diodberg.renderers.serial_renderers import DMXSerialRenderer
+        from diodberg.renderers.serial_renderers import SerialWriter
+        self.__port = DMXSerialRenderer.open_port(device)
+        self.__writer = SerialWriter(self.__port, 
+                                     encoder = FrameEncoder() if framed else None)
+        self.__writer.start()
+        self.__framed = framed
+        self.__keepaliveS = keepalive
+        self.__last_full = None
+        self.__buffers = None
+        self.__order = None
+
+    def open(self, encoder, strips, pixels):
+        self.__buffers = np.zeros((strips, DMX_UNIVERSE_SIZE), dtype = np.uint8)
+        # The wire order is a permutation of RGB; invert it.
+        wire = np.asarray(WS2812_GRB)
+        base = DMX_CHANNELS_PER_PIXEL*np.arange(pixels)
+        self.__order = (base[:, None] + np.argsort(wire)).ravel()
+        self.__last_full = None
+
+    def write(self, strips):
+        buffers = self.__buffers
+        buffers[:, :strips.shape[1]] = strips[:, self.__order]
+        now = monotonic()
+        keyframe = not self.__framed or self.__last_full is None or \
+                   now - self.__last_full >= self.__keepaliveS
+        if keyframe:
+            self.__last_full = now
+        start, stop = (None, None) if keyframe else (0, DMX_UNIVERSE_SIZE)
+        self.__writer.submit([(universe, buffers[universe].copy(), start, stop)
+                              for universe in xrange(len(buffers))])
+
+    def close(self):
+        if self.__port.is_open:
+            self.__writer.close(1.)
+            self.__port.close()
+
+    def __repr__(self):
+        return "SerialBridgeTransport<%s>" % self.__port
 
 
 class PiToWS2812Renderer(Renderer):
-    """ PiToWS2812Renderer provides a renderer interface directly to the WS2812
-    board using the GPIO pins on the RaspberryPi. The serial protocol here is 
-    described in this hilarious datasheet:
+    """ PiToWS2812Renderer drives WS2812 strips from the RaspberryPi. The serial
+    protocol here is described in this hilarious datasheet:
     http://partfusion.com/wp-uploads/2013/01/WS2812preliminary.pdf
-    """ 
-    
-    __num_channels = 26
-    __bit_width = 24
-    __sleep_resetS = 55e-6
-    __sleep_T0HS = 0.35e-6
-    __sleep_T1HS = 0.70e-6
-    __sleep_T0LS = 0.80e-6
-    __sleep_T1LS = 0.60e-6
-
-    def __init__(self, channels):
+
+    Python can't toggle a GPIO with sub-microsecond timing, so each frame is
+    encoded in one vectorized pass by a WS2812Encoder (one strip per patched
+    DMX universe, pixel p at address 3p, GRB order) and handed to a transport
+    that does the timing in hardware: SPITransport (the default),
+    PWMTransport, SerialBridgeTransport, or BufferTransport to run without
+    any hardware. The calibration defaults to a gamma of gamma on every
+    channel.
+    """
+
+    __slots__ = {'__transport', '__encoder', '__universes', '__patch', 
+                 '__pixels'}
+
+    def __init__(self, transport = None, gamma = 2.8, universes = 1):
         super(PiToWS2812Renderer, self).__init__()
-        RPi.GPIO.setmode(RPi.GPIO.BOARD)
-        RPi.GPIO.setwarnings(True)
-        assert len(channels) > 0, "Empty number of GPIO pins from RPi." 
-        for channel in channels:
-            RPi.GPIO.setup(channel, RPi.GPIO.OUT, initial = RPi.GPIO.LOW)            
-        
+        self.__transport = SPITransport() if transport is None else transport
+        self.__encoder = WS2812Encoder()
+        self.calibration = Calibration(gamma = gamma)
+        # Universes 0..universes-1 are always sent, even if nothing is patched.
+        self.__universes = xrange(universes)
+        self.__patch = None
+        self.__pixels = 0
+
+    def prepare(self, panel):
+        self.patch(panel)
+
+    def patch(self, panel):
+        """ Returns the DMXPatchMap for the panel, recompiling it and reopening
+        the transport only if the panel's addressing has changed. Raises
+        ValueError for addresses that aren't on a pixel boundary (3p).
+        """
+        if self.__patch is not None and self.__patch.is_current(panel):
+            return self.__patch
+        patch = DMXPatchMap(panel, self.__universes)
+        addresses = panel.address_plane[panel.live_plane]
+        if (addresses % DMX_CHANNELS_PER_PIXEL).any():
+            raise ValueError("WS2812 pixels need DMX addresses that are multiples "
+                             "of %d." % DMX_CHANNELS_PER_PIXEL)
+        pixels = int(addresses.max())//DMX_CHANNELS_PER_PIXEL + 1 if len(addresses) else 0
+        self.__transport.open(self.__encoder, len(patch.universes), pixels)
+        self.__patch = patch
+        self.__pixels = pixels
+        return patch
+
     def render(self, panel):
-        for loc, pixel in panel.iteritems():
-            assert pixel.address.universe is 0, "All pixels on universe 0."
-            channel = pixel.address.address
-            data = pixel.color.green << 16 | pixel.color.red << 8 | pixel.color.blue
-            for i in xrange(PiToWS2812Renderer.__bit_width, -1, -1):
-                if data & (1 << i):
-                    RPi.GPIO.output(channel, RPi.GPIO.HIGH)
-                    time.sleep(PiToWS2812Renderer.__sleep_T1HS)
-                    RPi.GPIO.output(channel, RPi.GPIO.LOW)
-                    time.sleep(PiToWS2812Renderer.__sleep_T1LS)
-                else:
-                    RPi.GPIO.output(channel, RPi.GPIO.HIGH)
-                    time.sleep(PiToWS2812Renderer.__sleep_T0HS)
-                    RPi.GPIO.output(channel, RPi.GPIO.LOW)
-                    time.sleep(PiToWS2812Renderer.__sleep_T0LS)
-            time.sleep(PiToWS2812Renderer.__sleep_resetS)
+        instruments = self.instruments
+        began = monotonic()
+        patch = self.patch(panel)
+        patch.apply(panel, self.calibration)
+        strips = self.__encoder.encode(patch.buffers, self.__pixels)
+        encoded = monotonic()
+        instruments.record(ENCODE, encoded - began)
+        self.__transport.write(strips)
+        instruments.record(WRITE, monotonic() - encoded)
+        for universe in patch.universes:
+            instruments.count_bytes(universe, strips.shape[1])
 
-    def __del__(self):
-        RPi.GPIO.cleanup()
+    @property
+    def encoder(self):
+        return self.__encoder
+
+    @property
+    def transport(self):
+        return self.__transport
+
+    def close(self):
+        self.__transport.close()
 
     def __repr__(self):
-        return "PiToWS2812Renderer"
+        return "PiToWS2812Renderer<%s>" % self.__transport
@@ -0,0 +1,164 @@
+# Headless rendering: records frames without a display, terminal or hardware,
+# for benchmarks and regression tests on build machines.
+
+import numpy as np
+import threading
+
+from diodberg.core.renderer import Renderer
+from diodberg.util.utils import monotonic
+
+
+class FrameRecorder(Renderer):
+    """ FrameRecorder is a headless Renderer that stores each rendered frame in a
+    ring buffer of the last capacity frames. The ring lives in memory, or, if a
+    filename is given, in a memory-mapped file of raw RGB frames (capacity x H x
+    W x 3 bytes, row-major), which can be read back with load_frames().
+
+    The buffer is allocated by prepare() from the panel's size; a panel of a
+    different size starts a new recording. Frames are recorded through the
+    calibration, if any, as an output would send them.
+    """
+
+    __slots__ = {'__capacity', '__filename', '__frames', '__times', '__count',
+                 '__lock'}
+
+    def __init__(self, capacity = 256, filename = None, universes = 1):
+        super(FrameRecorder, self).__init__(universes)
+        assert capacity > 0, "Capacity must be positive."
+        self.__capacity = capacity
+        self.__filename = filename
+        self.__frames = None
+        self.__times = np.zeros(capacity)
+        self.__count = 0
+        self.__lock = threading.Lock()
+
+    def prepare(self, panel):
+        shape = (self.__capacity,) + panel.color_plane.shape
+        if self.__frames is not None and self.__frames.shape == shape:
+            return
+        with self.__lock:
+            self.close()
+            if self.__filename is None:
+                self.__frames = np.zeros(shape, dtype = np.uint8)
+            else:
+                self.__frames = np.memmap(self.__filename, dtype = np.uint8,
+                                          mode = 'w+', shape = shape)
+            self.__count = 0
+
+    def render(self, panel):
+        if self.__frames is None or self.__frames.shape[1:] != panel.color_plane.shape:
+            self.prepare(panel)
+        with self.__lock:
+            slot = self.__count % self.__capacity
+            calibration = self.calibration
+            if calibration is None or calibration.identity:
+                self.__frames[slot] = panel.color_plane
+            else:
+                self.__frames[slot] = calibration.apply(panel.color_plane)
+            self.__times[slot] = monotonic()
+            self.__count += 1
+
+    def __order(self):
+        stored = min(self.__count, self.__capacity)
+        start = self.__count - stored
+        return np.arange(start, self.__count) % self.__capacity
+
+    def __check_stored(self):
+        if self.__frames is None or self.__count == 0:
+            raise IndexError("FrameRecorder has no frames stored.")
+
+    def frames(self):
+        """ Returns a copy of the stored frames, oldest first, as a (frames, H, W,
+        3) uint8 array. Raises IndexError if none are stored.
+        """
+        with self.__lock:
+            self.__check_stored()
+            return self.__frames[self.__order()]
+
+    def frame(self, index = -1):
+        """ Returns a copy of one stored frame; negative indices count back from
+        the latest. Raises IndexError if there is no such frame.
+        """
+        with self.__lock:
+            self.__check_stored()
+            order = self.__order()
+            if not -len(order) <= index < len(order):
+                raise IndexError("Frame %d is out of range: %d frames stored." %
+                                 (index, len(order)))
+            return self.__frames[order[index]].copy()
+
+    def clear(self):
+        """ Drops the stored frames, keeping the buffer.
+        """
+        with self.__lock:
+            self.__count = 0
+
+    def flush(self):
+        """ Writes a memory-mapped recording out to its file. Returns True, as
+        nothing is left pending.
+        """
+        if isinstance(self.__frames, np.memmap):
+            self.__frames.flush()
+        return True
+
+    def close(self):
+        """ Flushes and releases the frame buffer.
+        """
+        self.flush()
+        self.__frames = None
+
+    @property
+    def capacity(self):
+        return self.__capacity
+
+    @property
+    def filename(self):
+        return self.__filename
+
+    @property
+    def count(self):
+        """ Number of frames rendered since the last clear, including any that
+        have been overwritten.
+        """
+        return self.__count
+
+    @property
+    def fps(self):
+        """ Mean frame rate over the stored frames.
+        """
+        with self.__lock:
+            times = self.__times[self.__order()]
+        if len(times) < 2 or times[-1] <= times[0]:
+            return 0.
+        return (len(times) - 1)/(times[-1] - times[0])
+
+    def __len__(self):
+        return min(self.__count, self.__capacity)
+
+    def __repr__(self):
+        return "FrameRecorder<%d/%d frames>" % (len(self), self.__capacity)
+
+
+def load_frames(filename, size):
+    """ Memory-maps a raw recording written by FrameRecorder for a panel of size
+    (x, y), as a read-only (frames, y, x, 3) uint8 array in file order. Once a
+    recording has wrapped around its capacity the oldest frame is no longer
+    first; use FrameRecorder.frames() to read a live recording in order.
+    """
+    x, y = size
+    return np.memmap(filename, dtype = np.uint8, mode = 'r').reshape(-1, y, x, 3)
+
+
+def record(runner, count):
+    """ Drives a runner's fill() and its renderer synchronously for count
+    frames, without starting its thread or pacing frames, e.g. to record golden
+    frames into a FrameRecorder or to time fill + render throughput. Returns
+    the elapsed seconds.
+    """
+    runner.init()
+    runner.renderer.prepare(runner.panel)
+    start = monotonic()
+    for i in xrange(count):
+        runner.fill()
+        runner.renderer.render(runner.panel)
+    return monotonic() - start
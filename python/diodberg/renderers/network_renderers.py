@@ -0,0 +1,499 @@
+# DMX over UDP: Art-Net and sACN (E1.31) renderers. Every patched universe gets
+# a preallocated packet whose channel data is filled in place from the panel's
+# DMXPatchMap, and each frame goes out through one non-blocking socket, batched
+# into a single sendmmsg call where the platform has it.
+
+import ctypes
+import ctypes.util
+import errno
+import numpy as np
+import socket
+import sys
+import uuid
+
+from diodberg.core.instrumentation import ENCODE
+from diodberg.core.instrumentation import WRITE
+from diodberg.core.patch import DMX_UNIVERSE_SIZE
+from diodberg.core.patch import DMXPatchMap
+from diodberg.core.renderer import Renderer
+from diodberg.util.utils import monotonic
+
+
+ARTNET_PORT = 6454
+SACN_PORT = 5568
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _SockaddrIn(ctypes.Structure):
+    _fields_ = [('sin_family', ctypes.c_ushort), ('sin_port', ctypes.c_ushort),
+                ('sin_addr', ctypes.c_ubyte*4), ('sin_zero', ctypes.c_ubyte*8)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IOVec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+
+def _find_sendmmsg():
+    """ Returns libc's sendmmsg, or None if it isn't available (it is Linux
+    only, and the structures above follow the Linux layout).
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno = True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint,
+                         ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+_sendmmsg = _find_sendmmsg()
+
+
+class UDPBatch(object):
+    """ UDPBatch sends a fixed set of datagrams, each a row of a preallocated
+    uint8 array with its own destination, through one non-blocking socket.
+    With sendmmsg the message headers are built once and every send() is a
+    single system call per 1024 datagrams; otherwise it falls back to one
+    sendto() per datagram. send() stops at the first datagram that would
+    block; the caller can drop the rest or send them later from there.
+    """
+
+    __max_batch = 1024      # UIO_MAXIOV
+
+    __slots__ = {'__socket', '__packets', '__lengths', '__destinations',
+                 '__headers', '__keep', '__use_sendmmsg'}
+
+    def __init__(self, sock, packets, lengths, destinations, use_sendmmsg = True):
+        self.__socket = sock
+        self.__packets = packets
+        self.__lengths = list(lengths)
+        self.__destinations = list(destinations)
+        self.__use_sendmmsg = use_sendmmsg and _sendmmsg is not None
+        self.__headers = None
+        if self.__use_sendmmsg:
+            self.__build_headers()
+
+    def __build_headers(self):
+        count = len(self.__lengths)
+        iovecs = (_IOVec*max(count, 1))()
+        names = (_SockaddrIn*max(count, 1))()
+        headers = (_MMsgHdr*max(count, 1))()
+        base = self.__packets.ctypes.data
+        stride = self.__packets.strides[0]
+        for i, (length, (host, port)) in enumerate(zip(self.__lengths,
+                                                       self.__destinations)):
+            iovecs[i].iov_base = base + i*stride
+            iovecs[i].iov_len = length
+            names[i].sin_family = socket.AF_INET
+            names[i].sin_port = socket.htons(port)
+            names[i].sin_addr[:] = bytearray(socket.inet_aton(host))
+            header = headers[i].msg_hdr
+            header.msg_name = ctypes.addressof(names[i])
+            header.msg_namelen = ctypes.sizeof(_SockaddrIn)
+            header.msg_iov = ctypes.pointer(iovecs[i])
+            header.msg_iovlen = 1
+        self.__headers = headers
+        # The headers point into these, so they must live as long as we do.
+        self.__keep = (iovecs, names)
+
+    def send(self, first = 0):
+        """ Sends the datagrams from first on and returns how many were sent.
+        """
+        if self.__use_sendmmsg:
+            return self.__send_batched(first)
+        sent = 0
+        packets = self.__packets
+        for i, (length, destination) in enumerate(zip(self.__lengths,
+                                                      self.__destinations)):
+            if i < first:
+                continue
+            try:
+                self.__socket.sendto(packets[i, :length].data, destination)
+            except socket.error as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                    break
+                raise
+            sent += 1
+        return sent
+
+    def __send_batched(self, first):
+        fd = self.__socket.fileno()
+        count = len(self.__lengths) - first
+        size = ctypes.sizeof(_MMsgHdr)
+        base = ctypes.addressof(self.__headers) + first*size
+        sent = 0
+        while sent < count:
+            batch = min(count - sent, UDPBatch.__max_batch)
+            headers = ctypes.cast(base + sent*size, ctypes.POINTER(_MMsgHdr))
+            result = _sendmmsg(fd, headers, batch, 0)
+            if result < 0:
+                code = ctypes.get_errno()
+                if code in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                    break
+                raise socket.error(code, "sendmmsg: " + errno.errorcode.get(code, ""))
+            sent += result
+            if result < batch:
+                break
+        return sent
+
+    @property
+    def batched(self):
+        """ Is sendmmsg being used?
+        """
+        return self.__use_sendmmsg
+
+    def __len__(self):
+        return len(self.__lengths)
+
+    def __repr__(self):
+        return "UDPBatch<%d datagrams, sendmmsg = %s>" % (len(self),
+                                                         self.__use_sendmmsg)
+
+
+class UDPDMXRenderer(Renderer):
+    """ UDPDMXRenderer is the base of the network DMX renderers. For the panel's
+    DMXPatchMap it preallocates one packet per universe, rows of a single uint8
+    array, with the protocol header written once; each frame the universe
+    buffers are copied into the packets' data areas with one vectorized
+    assignment, the sequence number is bumped in place and the batch is sent.
+    With sync, a sync packet follows the data packets, so that receivers that
+    support it latch every universe at once. render_buffers sends pre-encoded
+    universe buffers (e.g. from a clip) the same way, skipping the patch.
+
+    Datagrams the socket won't take are left for flush(), which an EventLoop
+    calls when the socket is writable; if the next frame comes first they are
+    dropped in favour of it. Without an EventLoop, nothing calls flush() and
+    they are simply dropped.
+
+    Subclasses describe the protocol: header(universe), data_offset,
+    sequence_offset, destination(universe), sync_packet(sequence) and
+    sync_destination().
+    """
+
+    __slots__ = {'__socket', '__universes', '__patch', '__packets', '__batch',
+                 '__sequence', '__sync', '__sync_row', '__use_sendmmsg', '__dropped',
+                 '__packet_universes', '__unsent'}
+
+    renders_buffers = True
+    nonblocking = True
+    data_offset = 0
+    sequence_offset = 0
+
+    def __init__(self, universes = 1, sync = False, use_sendmmsg = True):
+        super(UDPDMXRenderer, self).__init__()
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.__socket.setblocking(False)
+        # Universes 0..universes-1 are always sent, even if nothing is patched.
+        self.__universes = xrange(universes)
+        self.__sync = sync
+        self.__use_sendmmsg = use_sendmmsg
+        self.__patch = None
+        self.__packets = None
+        self.__batch = None
+        self.__sequence = 0
+        self.__sync_row = None
+        self.__dropped = 0
+        self.__packet_universes = None
+        self.__unsent = None
+
+    def header(self, universe):
+        """ Returns the packet header for a universe, data_offset bytes long.
+        Defined by subclasses.
+        """
+        raise NotImplementedError
+
+    def destination(self, universe):
+        """ Returns the (host, port) a universe is sent to. Defined by
+        subclasses.
+        """
+        raise NotImplementedError
+
+    def sync_packet(self, sequence):
+        """ Returns a sync packet. Defined by subclasses.
+        """
+        raise NotImplementedError
+
+    def sync_destination(self):
+        raise NotImplementedError
+
+    def next_sequence(self, sequence):
+        """ The sequence number after sequence.
+        """
+        return (sequence + 1) % 256
+
+    def prepare(self, panel):
+        self.patch(panel)
+
+    def patch(self, panel):
+        """ Returns the DMXPatchMap for the panel, rebuilding it and the packets
+        only if the panel's addressing has changed.
+        """
+        if self.__patch is not None and self.__patch.is_current(panel):
+            return self.__patch
+        patch = DMXPatchMap(panel, self.__universes)
+        self.__build_packets(patch.universes)
+        self.__patch = patch
+        return patch
+
+    def __build_packets(self, universes):
+        width = self.data_offset + DMX_UNIVERSE_SIZE
+        sync = self.sync_packet(0) if self.__sync else None
+        rows = len(universes) + (1 if sync is not None else 0)
+        packets = np.zeros((rows, max(width, len(sync or ""))), dtype = np.uint8)
+        lengths = [width]*len(universes)
+        destinations = [self.destination(u) for u in universes]
+        for row, universe in enumerate(universes):
+            packets[row, :self.data_offset] = bytearray(self.header(universe))
+        if sync is not None:
+            packets[-1, :len(sync)] = bytearray(sync)
+            lengths.append(len(sync))
+            destinations.append(self.sync_destination())
+            self.__sync_row = len(universes)
+        self.__packets = packets
+        self.__batch = UDPBatch(self.__socket, packets, lengths, destinations,
+                                self.__use_sendmmsg)
+        self.__packet_universes = tuple(universes)
+        self.__unsent = None
+
+    def render(self, panel):
+        began = monotonic()
+        patch = self.patch(panel)
+        patch.apply(panel, self.calibration)
+        self.__send(patch.universes, patch.buffers, began)
+
+    def render_buffers(self, universes, buffers):
+        self.__send(universes, buffers, monotonic())
+
+    def __send(self, universes, buffers, began):
+        instruments = self.instruments
+        if tuple(universes) != self.__packet_universes:
+            self.__build_packets(universes)
+        if self.__unsent is not None:
+            # The rest of the last frame is superseded by this one.
+            self.__dropped += len(self.__batch) - self.__unsent
+            self.__unsent = None
+        packets = self.__packets
+        count = len(universes)
+        offset = self.data_offset
+        packets[:count, offset:offset + DMX_UNIVERSE_SIZE] = buffers
+        self.__sequence = self.next_sequence(self.__sequence)
+        packets[:count, self.sequence_offset] = self.__sequence
+        if self.__sync_row is not None:
+            sync = bytearray(self.sync_packet(self.__sequence))
+            packets[self.__sync_row, :len(sync)] = sync
+        instruments.record(ENCODE, monotonic() - began)
+        self.__write(0)
+
+    def __write(self, first):
+        # Sends the datagrams from first on, keeping track of where to resume.
+        instruments = self.instruments
+        began = monotonic()
+        sent = self.__batch.send(first)
+        instruments.record(WRITE, monotonic() - began)
+        width = self.data_offset + DMX_UNIVERSE_SIZE
+        for universe in self.__packet_universes[first:first + sent]:
+            instruments.count_bytes(universe, width)
+        stop = first + sent
+        self.__unsent = stop if stop < len(self.__batch) else None
+
+    def fileno(self):
+        return self.__socket.fileno()
+
+    def flush(self):
+        if self.__unsent is not None:
+            self.__write(self.__unsent)
+        return self.__unsent is None
+
+    @property
+    def batched(self):
+        """ Are frames sent with sendmmsg? None until the first frame.
+        """
+        return None if self.__batch is None else self.__batch.batched
+
+    @property
+    def dropped(self):
+        """ Datagrams dropped because the socket would have blocked until the
+        next frame.
+        """
+        return self.__dropped
+
+    @property
+    def socket(self):
+        return self.__socket
+
+    def close(self):
+        self.__socket.close()
+
+    def __repr__(self):
+        return "UDPDMXRenderer"
+
+
+class ArtNetRenderer(UDPDMXRenderer):
+    """ ArtNetRenderer sends each universe as an ArtDmx packet to host (by
+    default the limited broadcast address), on the Art-Net port address net +
+    universe, optionally followed by an ArtSync.
+    """
+
+    __id = b"Art-Net\x00"
+    __op_dmx = 0x5000
+    __op_sync = 0x5200
+    __version = 14
+
+    data_offset = 18
+    sequence_offset = 12
+
+    __slots__ = {'__host', '__port', '__net'}
+
+    def __init__(self, host = "255.255.255.255", universes = 1, sync = False,
+                 port = ARTNET_PORT, net = 0, use_sendmmsg = True):
+        super(ArtNetRenderer, self).__init__(universes, sync, use_sendmmsg)
+        self.__host = socket.gethostbyname(host)
+        self.__port = port
+        self.__net = net
+
+    def next_sequence(self, sequence):
+        # Sequence 0 means "not sequenced" in Art-Net, so wrap from 255 to 1.
+        return sequence % 255 + 1
+
+    def header(self, universe):
+        address = self.__net + universe
+        op, version = ArtNetRenderer.__op_dmx, ArtNetRenderer.__version
+        return ArtNetRenderer.__id + bytes(bytearray([
+            op & 0xFF, op >> 8,                 # OpCode, little-endian
+            version >> 8, version & 0xFF,       # ProtVer
+            0,                                  # Sequence
+            0,                                  # Physical
+            address & 0xFF, (address >> 8) & 0x7F,
+            DMX_UNIVERSE_SIZE >> 8, DMX_UNIVERSE_SIZE & 0xFF]))
+
+    def destination(self, universe):
+        return (self.__host, self.__port)
+
+    def sync_packet(self, sequence):
+        op, version = ArtNetRenderer.__op_sync, ArtNetRenderer.__version
+        return ArtNetRenderer.__id + bytes(bytearray([
+            op & 0xFF, op >> 8, version >> 8, version & 0xFF, 0, 0]))
+
+    def sync_destination(self):
+        return (self.__host, self.__port)
+
+    def __repr__(self):
+        return "ArtNetRenderer<%s:%d>" % (self.__host, self.__port)
+
+
+class SACNRenderer(UDPDMXRenderer):
+    """ SACNRenderer sends each universe as an E1.31 data packet, on sACN
+    universe universe + universe_offset (sACN universes start at 1). Packets go
+    to host, or, without one, to each universe's multicast group. With sync,
+    every data packet names sync_universe and an E1.31 synchronization packet
+    follows each frame.
+    """
+
+    __root_vector = 0x00000004
+    __extended_vector = 0x00000008
+    __data_vector = 0x00000002
+    __sync_vector = 0x00000001
+    __acn_id = b"\x00\x10\x00\x00ASC-E1.17\x00\x00\x00"
+
+    data_offset = 126
+    sequence_offset = 111
+
+    __slots__ = {'__host', '__port', '__cid', '__source', '__priority',
+                 '__universe_offset', '__sync_universe'}
+
+    def __init__(self, host = None, universes = 1, sync = False, port = SACN_PORT,
+                 source_name = "diodberg", priority = 100, universe_offset = 1,
+                 sync_universe = 64000 - 1, ttl = 1, cid = None,
+                 use_sendmmsg = True):
+        super(SACNRenderer, self).__init__(universes, sync, use_sendmmsg)
+        self.__host = None if host is None else socket.gethostbyname(host)
+        self.__port = port
+        self.__cid = (cid or uuid.uuid4()).bytes
+        self.__source = source_name.encode('utf-8')[:63]
+        self.__priority = priority
+        self.__universe_offset = universe_offset
+        self.__sync_universe = sync_universe if sync else 0
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+
+    @staticmethod
+    def multicast_group(universe):
+        """ The multicast address of an sACN universe.
+        """
+        return "239.255.%d.%d" % (universe >> 8, universe & 0xFF)
+
+    def __root(self, vector, length):
+        # Root layer: preamble, post-amble, ACN packet identifier, flags and
+        # length, vector and CID.
+        flags = 0x7000 | (length - 16)
+        return (SACNRenderer.__acn_id +
+                bytes(bytearray([flags >> 8, flags & 0xFF])) +
+                _u32(vector) + self.__cid)
+
+    def header(self, universe):
+        universe += self.__universe_offset
+        length = self.data_offset + DMX_UNIVERSE_SIZE
+        framing = 0x7000 | (length - 38)
+        dmp = 0x7000 | (length - 115)
+        slots = DMX_UNIVERSE_SIZE + 1
+        sync = self.__sync_universe
+        return (self.__root(SACNRenderer.__root_vector, length) +
+                bytes(bytearray([framing >> 8, framing & 0xFF])) +
+                _u32(SACNRenderer.__data_vector) +
+                self.__source.ljust(64, b"\x00") +
+                bytes(bytearray([self.__priority,
+                                 sync >> 8, sync & 0xFF,
+                                 0,                             # Sequence
+                                 0,                             # Options
+                                 universe >> 8, universe & 0xFF,
+                                 dmp >> 8, dmp & 0xFF,
+                                 0x02,                          # DMP vector
+                                 0xA1,                          # Address/data type
+                                 0, 0,                          # First address
+                                 0, 1,                          # Increment
+                                 slots >> 8, slots & 0xFF,
+                                 0])))                          # Start code
+
+    def destination(self, universe):
+        if self.__host is not None:
+            return (self.__host, self.__port)
+        return (SACNRenderer.multicast_group(universe + self.__universe_offset),
+                self.__port)
+
+    def sync_packet(self, sequence):
+        length = 49
+        framing = 0x7000 | (length - 38)
+        sync = self.__sync_universe
+        return (self.__root(SACNRenderer.__extended_vector, length) +
+                bytes(bytearray([framing >> 8, framing & 0xFF])) +
+                _u32(SACNRenderer.__sync_vector) +
+                bytes(bytearray([sequence, sync >> 8, sync & 0xFF, 0, 0])))
+
+    def sync_destination(self):
+        if self.__host is not None:
+            return (self.__host, self.__port)
+        return (SACNRenderer.multicast_group(self.__sync_universe), self.__port)
+
+    def __repr__(self):
+        return "SACNRenderer<%s:%d>" % (self.__host or "multicast", self.__port)
+
+
+def _u32(value):
+    """ A 32-bit big-endian field.
+    """
+    return bytes(bytearray([(value >> 24) & 0xFF, (value >> 16) & 0xFF,
+                            (value >> 8) & 0xFF, value & 0xFF]))
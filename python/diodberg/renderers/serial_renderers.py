@@ -1,20 +1,260 @@
+from diodberg.core.framing import FrameEncoder
+from diodberg.core.instrumentation import ENCODE
+from diodberg.core.instrumentation import WRITE
+from diodberg.core.patch import DMX_UNIVERSE_SIZE
+from diodberg.core.patch import DMXPatchMap
 from diodberg.core.renderer import Renderer
+from diodberg.util.utils import monotonic
+import errno
+import fcntl
+import numpy as np
+import os
 import sys
+import threading
+import time
 try:
     import serial
 except ImportError as err: 
     sys.stderr.write("Error: failed to import module ({})".format(err))
 
 
+# Alternate DMX start code for a partial frame: a 2-byte big-endian channel
+# offset and a 2-byte big-endian channel count follow, then the channel data.
+# Receivers that only understand start code 0 (e.g. DMXSerial) ignore it.
+DMX_START_CODE = 0
+DMX_PARTIAL_START_CODE = 0xD0
+
+
+def dmx_packet(buf, start = None, stop = None):
+    """ Returns the bytes of a DMX packet, without the break: start code 0 and
+    the universe's channels, or, given a [start, stop) channel range, a
+    DMX_PARTIAL_START_CODE packet carrying only those channels.
+    """
+    if start is None:
+        return chr(DMX_START_CODE) + np.asarray(buf, dtype = np.uint8).tobytes()
+    count = stop - start
+    header = bytearray([DMX_PARTIAL_START_CODE, 
+                        start >> 8, start & 0xFF, 
+                        count >> 8, count & 0xFF])
+    return bytes(header) + np.asarray(buf[start:stop], dtype = np.uint8).tobytes()
+
+
+class SerialWriter(threading.Thread):
+    """ SerialWriter owns the writes to a DMX serial port, so that rendering
+    never blocks on the UART. Frames are handed over with submit() as a list
+    of universe updates, (universe, channels, start, stop), where channels is
+    the universe's full 512-channel buffer and [start, stop) the range to send,
+    or start = None to send the whole universe.
+
+    The queue is bounded and latest-wins: at most one frame is pending, and a
+    frame submitted before the previous one was written is merged into it.
+    Each universe keeps its newest channels and the union of the two ranges,
+    so changes in a dropped frame are never lost, even with delta updates.
+
+    Every packet is preceded by a break (break_condition held for breakS,
+    then a mark-after-break of mabS), after waiting for the previous bytes to
+    drain. With batched, the packets of a frame follow a single break and go
+    out in one write; only for firmware that parses back-to-back packets.
+
+    With an encoder (a diodberg.core.framing.FrameEncoder), universes are sent
+    as framed protocol frames instead of DMX packets: start = None asks for a
+    keyframe and anything else for a delta against what the encoder last
+    wrote. Frames carry their own sync, so a frame is one write with no break.
+
+    write() sends a frame synchronously from the calling thread, for use
+    without starting the thread. flush() writes framed output from an
+    EventLoop instead, without blocking.
+    """
+
+    __slots__ = {'__port', '__breakS', '__mabS', '__batched', '__pending',
+                 '__instruments', '__cond', '__closed', '__stats', '__encoder',
+                 '__output'}
+
+    def __init__(self, port, batched = False, breakS = 100e-6, mabS = 12e-6,
+                 encoder = None):
+        super(SerialWriter, self).__init__()
+        self.daemon = True
+        self.__port = port
+        self.__batched = batched
+        self.__encoder = encoder
+        self.__breakS = breakS
+        self.__mabS = mabS
+        self.__pending = None
+        self.__instruments = None
+        self.__cond = threading.Condition()
+        self.__closed = False
+        self.__stats = {'frames': 0, 'merged': 0, 'packets': 0, 'bytes': 0}
+        self.__output = b""
+
+    def submit(self, updates, instruments = None):
+        """ Queues a frame of universe updates without blocking. Write times
+        and bytes per universe are recorded into instruments, if given.
+        """
+        if not updates:
+            return
+        with self.__cond:
+            if self.__pending is None:
+                self.__pending = dict((u[0], u) for u in updates)
+            else:
+                self.__stats['merged'] += 1
+                for universe, channels, start, stop in updates:
+                    old = self.__pending.get(universe)
+                    if old is not None and start is not None:
+                        if old[2] is None:
+                            start = stop = None
+                        else:
+                            start, stop = min(start, old[2]), max(stop, old[3])
+                    self.__pending[universe] = (universe, channels, start, stop)
+            self.__instruments = instruments
+            self.__cond.notify()
+
+    def write(self, updates, instruments = None):
+        """ Writes a frame of universe updates, blocking until it has been
+        handed to the port.
+        """
+        began = monotonic()
+        if self.__encoder is not None:
+            packets = self.__encode(updates)
+            if packets:
+                self.__port.write(b"".join(packet for universe, packet in packets))
+        else:
+            packets = [(universe, dmx_packet(channels, start, stop)) 
+                       for universe, channels, start, stop in updates]
+            self.__write_dmx(packets)
+        self.__count(packets, instruments)
+        if instruments is not None:
+            instruments.record(WRITE, monotonic() - began)
+
+    def flush(self):
+        """ Writes pending frames to the port as far as it takes them without
+        blocking, for driving the writer from an EventLoop rather than its
+        thread; frames submitted meanwhile are merged as usual. Only framed
+        output can be written this way, since a DMX break has to wait for the
+        port to drain. Returns True once everything has been written.
+        """
+        assert self.__encoder is not None, "Only framed output can be flushed."
+        while True:
+            if not self.__output:
+                with self.__cond:
+                    pending, self.__pending = self.__pending, None
+                    instruments = self.__instruments
+                if pending is None:
+                    return True
+                packets = self.__encode(sorted(pending.values()))
+                self.__count(packets, instruments)
+                self.__output = b"".join(packet for universe, packet in packets)
+                continue
+            began = monotonic()
+            try:
+                written = os.write(self.__port.fileno(), self.__output)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return False
+                raise
+            finally:
+                if self.__instruments is not None:
+                    self.__instruments.record(WRITE, monotonic() - began)
+            self.__output = self.__output[written:]
+            if self.__output:
+                return False
+
+    def __encode(self, updates):
+        # The framed packets of a frame's updates, leaving out empty deltas.
+        encoder = self.__encoder
+        packets = [(universe, encoder.encode(universe, channels, start is None))
+                   for universe, channels, start, stop in updates]
+        return [(universe, packet) for universe, packet in packets if packet]
+
+    def __count(self, packets, instruments):
+        self.__stats['frames'] += 1
+        self.__stats['packets'] += len(packets)
+        self.__stats['bytes'] += sum(len(packet) for universe, packet in packets)
+        if instruments is not None:
+            for universe, packet in packets:
+                instruments.count_bytes(universe, len(packet))
+
+    def __write_dmx(self, packets):
+        port = self.__port
+        if self.__batched and packets:
+            self.__break()
+            port.write(b"".join(packet for universe, packet in packets))
+        else:
+            for universe, packet in packets:
+                self.__break()
+                port.write(packet)
+
+    def __break(self):
+        # Let the previous packet leave the UART before asserting the break.
+        port = self.__port
+        port.flush()
+        port.break_condition = True
+        time.sleep(self.__breakS)
+        port.break_condition = False
+        time.sleep(self.__mabS)
+
+    def run(self):
+        while True:
+            with self.__cond:
+                while self.__pending is None and not self.__closed:
+                    self.__cond.wait()
+                if self.__pending is None:
+                    return
+                updates = sorted(self.__pending.values())
+                instruments = self.__instruments
+                self.__pending = None
+            self.write(updates, instruments)
+
+    def close(self, timeout = None):
+        """ Writes any pending frame and stops the thread.
+        """
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify()
+        if self.is_alive():
+            self.join(timeout)
+
+    @property
+    def stats(self):
+        """ Frames, packets and bytes written, and frames merged into a later
+        one.
+        """
+        with self.__cond:
+            return dict(self.__stats)
+
+    def __repr__(self):
+        return "SerialWriter<%s>" % self.__port
+
+
 class DMXSerialRenderer(Renderer):
     """ DMXSerialRenderer provides a renderer interface to a custom DMX shield 
-    using the RaspberryPi serial port.
+    using the RaspberryPi serial port (or any serial device).
+
+    Only universes whose channels changed since they were last sent are
+    transmitted. Every universe is still sent in full at least once per
+    keepalive seconds so that fixtures don't time out (keepalive = 0 sends
+    everything every frame). With partial_frames, changed universes are sent as
+    a DMX_PARTIAL_START_CODE packet carrying only the changed channel range.
+
+    The port is written by a SerialWriter thread, so render() only encodes and
+    queues a frame; with threaded = False, render() writes it synchronously.
+    batched sends each frame's packets after a single break in one write.
+
+    render_buffers sends pre-encoded universe buffers (e.g. from a clip) the
+    same way, skipping the patch.
+
+    With framed, universes are sent in the compact framed protocol of
+    diodberg.core.framing instead of DMX (for firmware built with
+    DIODBERG_FRAMED): changed channels as run-length or XOR delta frames, and
+    keep-alives as keyframes. Only universes 0 - 255 can be framed.
+
+    With nonblocking (framed only), there is no writer thread: the port is put
+    in non-blocking mode and render() writes what it takes, leaving the rest
+    to flush(), for an EventLoop. A frame rendered before the last one is out
+    is merged into the pending one, as with the writer thread.
     TODO: The baudrate on the Pi currently ceilings at 115200 baud. Change back to 
     250000 baud when fixed on the Pi-side.
     """ 
 
-    __dmx_buffer_size = 512
-    __default_channel_val = 0
     __device_name = "/dev/ttyAMA0"
     __baud_rateHz = 115200
     __timeout = 3.
@@ -22,48 +262,183 @@ class DMXSerialRenderer(Renderer):
     __parity = serial.PARITY_NONE
     __stopbits = serial.STOPBITS_TWO
 
-    __slots__ = {'__port', '__buffer'}
+    __header_bytes = 1          # start code
+    __partial_header_bytes = 5  # start code, offset and count
+
+    __slots__ = {'__port', '__universes', '__patch', '__keepaliveS', 
+                 '__partial_frames', '__sent', '__last_full', '__stats',
+                 '__writer', '__threaded', '__framed', '__written_base', 
+                 '__tracked', '__nonblocking'}
+
+    renders_buffers = True
     
-    def __init__(self, universes = 1):
+    def __init__(self, universes = 1, keepalive = 1., partial_frames = False, 
+                 device = None, threaded = True, batched = False, framed = False,
+                 nonblocking = False):
         super(DMXSerialRenderer, self).__init__()
-        self.__port = serial.Serial(port = DMXSerialRenderer.__device_name)
-        self.__port.baudrate = DMXSerialRenderer.__baud_rateHz
-        self.__port.bytesize = DMXSerialRenderer.__bytesize
-        self.__port.parity = DMXSerialRenderer.__parity
-        self.__port.stopbits = DMXSerialRenderer.__stopbits
-        self.__port.timeout = DMXSerialRenderer.__timeout
-        # Initialize a shared storage buffer
-        default_buffer = [DMXSerialRenderer.__default_channel_val]*DMXSerialRenderer.__dmx_buffer_size
-        self.__buffer = {}
-        for i in xrange(universes):
-            self.__buffer[i] = bytearray(default_buffer)            
+        self.__port = None
+        if nonblocking and not framed:
+            raise ValueError("Only framed output can be written without blocking: "
+                             "DMX breaks wait for the port to drain.")
+        self.__port = DMXSerialRenderer.open_port(device)
+        # Universes 0..universes-1 are always sent, even if nothing is patched.
+        self.__universes = xrange(universes)
+        self.__patch = None
+        self.__keepaliveS = keepalive
+        self.__partial_frames = partial_frames
+        self.__sent = None
+        self.__last_full = None
+        self.__tracked = None
+        self.__framed = framed
+        encoder = FrameEncoder() if framed else None
+        self.__writer = SerialWriter(self.__port, batched, encoder = encoder)
+        self.__nonblocking = nonblocking
+        self.__threaded = threaded and not nonblocking
+        if nonblocking:
+            fd = self.__port.fileno()
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        elif threaded:
+            self.__writer.start()
+        self.reset_stats()
+
+    @staticmethod
+    def open_port(device = None):
+        """ Opens a serial device (by default the Pi's UART) configured for
+        DMX.
+        """
+        port = serial.Serial(port = device or DMXSerialRenderer.__device_name)
+        port.baudrate = DMXSerialRenderer.__baud_rateHz
+        port.bytesize = DMXSerialRenderer.__bytesize
+        port.parity = DMXSerialRenderer.__parity
+        port.stopbits = DMXSerialRenderer.__stopbits
+        port.timeout = DMXSerialRenderer.__timeout
+        return port
+
+    def prepare(self, panel):
+        self.patch(panel)
+
+    def patch(self, panel):
+        """ Returns the DMXPatchMap for the panel, recompiling it only if the
+        panel's addressing has changed. Raises ValueError for bad addressing.
+        """
+        if self.__patch is None or not self.__patch.is_current(panel):
+            self.__patch = DMXPatchMap(panel, self.__universes)
+            # Nothing is known to be on the wire for a new patch.
+            self.__track(self.__patch.universes)
+        return self.__patch
+
+    def __track(self, universes):
+        # Starts tracking what is on the wire for a set of universes.
+        self.__tracked = tuple(universes)
+        self.__sent = np.zeros((len(universes), DMX_UNIVERSE_SIZE), dtype = np.uint8)
+        self.__last_full = [None]*len(universes)
         
     def render(self, panel):
-        # Fill in the buffer.
-        for loc, pixel in panel.iteritems():
-            if pixel.live:
-                universe = pixel.address.universe
-                address = pixel.address.address
-                self.__buffer[universe][address] = pixel.color.red
-                self.__buffer[universe][address + 1] = pixel.color.green
-                self.__buffer[universe][address + 2] = pixel.color.blue
-        # Send the buffer over DMX.
-        for universe, buf in self.__buffer.iteritems():
-            self.send_dmx(universe, buf)
-
-    def send_dmx(self, universe, buf):
-        """ Sends the DMX packet over serial.
-        """ 
-        self.__port.baudrate = DMXSerialRenderer.__baud_rateHz/2
-        self.__port.write(chr(0))
-        self.__port.baudrate = DMXSerialRenderer.__baud_rateHz
-        self.__port.write(chr(0))
-        self.__port.write(buf)
+        # Fill in the buffers with a single scatter, then send them.
+        began = monotonic()
+        patch = self.patch(panel)
+        patch.apply(panel, self.calibration)
+        self.__send(patch.universes, patch.buffers, began)
+
+    def render_buffers(self, universes, buffers):
+        self.__send(universes, buffers, monotonic())
+
+    def __send(self, universes, buffers, began):
+        # Queues the universes that changed or are due for a keep-alive refresh.
+        if tuple(universes) != self.__tracked:
+            self.__track(universes)
+        changed = buffers != self.__sent
+        now = monotonic()
+        full_bytes = DMXSerialRenderer.__header_bytes + buffers.shape[1]
+        updates = []
+        written = 0
+        for row, universe in enumerate(universes):
+            last_full = self.__last_full[row]
+            start = stop = None
+            if last_full is None or now - last_full >= self.__keepaliveS:
+                self.__last_full[row] = now
+                sent = full_bytes
+            else:
+                channels = np.flatnonzero(changed[row])
+                if len(channels) == 0:
+                    self.__stats['universes_skipped'] += 1
+                    continue
+                if self.__partial_frames or self.__framed:
+                    start, stop = int(channels[0]), int(channels[-1]) + 1
+                    sent = DMXSerialRenderer.__partial_header_bytes + stop - start
+                else:
+                    self.__last_full[row] = now
+                    sent = full_bytes
+            self.__sent[row] = buffers[row]
+            updates.append((universe, self.__sent[row].copy(), start, stop))
+            written += sent
+        self.instruments.record(ENCODE, monotonic() - began)
+        if self.__nonblocking:
+            self.__writer.submit(updates, self.instruments)
+            self.__writer.flush()
+        elif self.__threaded:
+            self.__writer.submit(updates, self.instruments)
+        else:
+            self.__writer.write(updates, self.instruments)
+        self.__stats['frames'] += 1
+        self.__stats['bytes_written'] += written
+        self.__stats['bytes_saved'] += full_bytes*len(universes) - written
+
+    @property
+    def stats(self):
+        """ Transmission statistics since the last reset_stats(): frames,
+        bytes_written, bytes_saved (versus sending every universe in full each
+        frame), universes_skipped and bytes_saved_per_s, plus the writer's
+        frames_merged (frames that were superseded before they were written).
+        With framed, the frame sizes are only known once written, so
+        bytes_written counts what the writer has written so far.
+        """
+        stats = dict(self.__stats)
+        writer = self.__writer.stats
+        if self.__framed:
+            written = writer['bytes'] - self.__written_base
+            stats['bytes_saved'] += stats['bytes_written'] - written
+            stats['bytes_written'] = written
+        elapsed = time.time() - stats.pop('start')
+        stats['bytes_saved_per_s'] = stats['bytes_saved']/elapsed if elapsed > 0 else 0.
+        stats['frames_merged'] = writer['merged']
+        return stats
+
+    def reset_stats(self):
+        """ Zeroes the transmission statistics.
+        """
+        self.__written_base = self.__writer.stats['bytes']
+        self.__stats = {'start': time.time(), 
+                        'frames': 0, 
+                        'bytes_written': 0, 
+                        'bytes_saved': 0, 
+                        'universes_skipped': 0}
+
+    @property
+    def nonblocking(self):
+        # Handing a frame to the writer thread doesn't block either.
+        return self.__nonblocking or self.__threaded
+
+    def fileno(self):
+        return self.__port.fileno() if self.__nonblocking else None
+
+    def flush(self):
+        return self.__writer.flush() if self.__nonblocking else True
+
+    @property
+    def writer(self):
+        return self.__writer
 
     def close(self):
-        """ Close the serial port.
+        """ Writes any pending frame (waiting at most the port timeout, or
+        as far as the port takes it with nonblocking) and closes the serial
+        port.
         """
-        self.__port.close()
+        if self.__port is not None and self.__port.is_open:
+            if self.__nonblocking:
+                self.__writer.flush()
+            self.__writer.close(DMXSerialRenderer.__timeout)
+            self.__port.close()
         
     def __del__(self):
         self.close()
@@ -80,7 +455,7 @@ def pi_serial_main(num = 1):
     panel = random_panel(size = (num, 1), num_pixels = num, live = True)
     renderer = DMXSerialRenderer()
     runner = CycleHue(panel, renderer, sleep = 1.)
-    controller = Controller(panel, renderer)
+    controller = Controller(panel, renderer, sleep = 1.)
     controller.run(runner)
     
 
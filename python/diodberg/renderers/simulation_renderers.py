@@ -1,66 +1,166 @@
 import curses
+import numpy as np
 import pygame
+import pygame.surfarray
+from diodberg.core.instrumentation import ENCODE
+from diodberg.core.instrumentation import WRITE
 from diodberg.core.renderer import Renderer
 from diodberg.core.types import Color
+from diodberg.util.utils import monotonic
 
 
 class PyGameRenderer(Renderer):
     """ PyGameRenderer provides a renderer interface to a PyGame simulation client.
     Active (inactive) pixels are rendered as circles (squares).
+
+    The sprites are rasterized once into an index map from screen pixels to
+    panel cells, so each frame is a gather of the visible cells' colors (through
+    the calibration, if any) and one of screen pixels from those, blitted with
+    pygame.surfarray. The debug labels (DMX addresses of live pixels) are
+    drawn once onto a cached overlay, and only the screen rectangles of cells
+    whose colors changed are updated. Both caches are rebuilt when the panel
+    layout changes. With live_only, only the live pixels are drawn, and each
+    frame gathers just those.
     """
 
     __black = Color(0, 0, 0, 0).rgba
     __font_color = Color(255, 255, 0, 0).rgba
     __font_size = 10
     __default_font = "monospace"
+    __pitch = 20                # screen pixels between cell centers
+    __max_dirty_rects = 256     # above this, update the whole display
     
-    __slots__ = {'__screen', '__font', '__scale', '__debug'}
+    __slots__ = {'__screen', '__font', '__scale', '__debug', '__key', 
+                 '__cells', '__covered', '__sources', '__rects', '__frame', 
+                 '__overlay', '__last', '__canvas', '__live_only'}
 
     def __init__(self, 
                  size = (640, 480),
                  scale = 6, 
                  debug = False, 
-                 universes = 1):
+                 universes = 1, 
+                 live_only = False):
         super(PyGameRenderer, self).__init__(universes)
         pygame.init()
         self.__screen = pygame.display.set_mode(size)
         self.__screen.fill(PyGameRenderer.__black)
+        # surfarray needs a true-color surface, whatever the display depth.
+        self.__canvas = pygame.Surface(size, 0, 32)
         self.__font = pygame.font.SysFont(PyGameRenderer.__default_font, 
                                           PyGameRenderer.__font_size)
         self.__scale = scale
         self.__debug = debug
+        self.__live_only = live_only
+        self.__key = None
 
-    def render(self, panel):
-        self.__screen.fill(PyGameRenderer.__black)
+    def prepare(self, panel):
+        """ Rasterizes the sprites and debug labels for the panel's layout.
+        """
+        pitch = PyGameRenderer.__pitch
         width = self.__scale
-        for i in xrange(panel.width):
-            for j in xrange(panel.height):
-                loc = (i, j)
-                pixel = panel[loc]
-                loc = (20*i, 20*j)
-                if pixel.live:
-                    pygame.draw.circle(self.__screen, pixel.color.rgba, loc, width)
-                else:
-                    x, y = loc
-                    rect = pygame.Rect(x - width, y + width, width, width)
-                    pygame.draw.rect(self.__screen, pixel.color.rgba, rect, width)
-                    # Print DMX address info in addition to color.
-                if self.__debug:
-                    universe = pixel.address.universe
-                    address = pixel.address.address
-                    info = (universe, address)
-                    label = self.__font.render(str(info), 
-                                               True,
-                                               PyGameRenderer.__font_color)
-                    self.__screen.blit(label, loc)
-        pygame.display.update()
+        screen_x, screen_y = self.__screen.get_size()
+        # Only cells whose sprites can reach the screen are drawn.
+        cols = min(panel.width, (screen_x + width)/pitch + 1)
+        rows = min(panel.height, (screen_y + width)/pitch + 1)
+        if self.__live_only:
+            cells_x, cells_y = panel.live_positions()
+            near = (cells_x < cols) & (cells_y < rows)
+            cells_x, cells_y = cells_x[near], cells_y[near]
+        else:
+            cells_y, cells_x = np.mgrid[0:rows, 0:cols]
+            cells_x = cells_x.ravel()
+            cells_y = cells_y.ravel()
+        cells = cells_y*panel.width + cells_x
+        live = panel.live_plane[cells_y, cells_x]
+        # Sprite offsets from the cell center: a disc for live pixels and a
+        # square below-left of the center for the rest.
+        circle = self.__sprite(lambda surface, center: pygame.draw.circle(
+            surface, PyGameRenderer.__font_color, center, width))
+        square = self.__sprite(lambda surface, center: pygame.draw.rect(
+            surface, PyGameRenderer.__font_color, 
+            pygame.Rect(center[0] - width, center[1] + width, width, width)))
+        index = -np.ones((screen_x, screen_y), dtype = np.int32)
+        for selected, (off_x, off_y) in [(~live, square), (live, circle)]:
+            n = np.flatnonzero(selected)
+            px = (pitch*cells_x[n])[:, None] + off_x
+            py = (pitch*cells_y[n])[:, None] + off_y
+            slot = np.broadcast_to(n[:, None], px.shape)
+            visible = (px >= 0) & (px < screen_x) & (py >= 0) & (py < screen_y)
+            index[px[visible], py[visible]] = slot[visible]
+        self.__cells = cells
+        self.__covered = np.nonzero(index >= 0)
+        self.__sources = index[self.__covered]
+        self.__rects = [pygame.Rect(pitch*x - width, pitch*y - width, 
+                                    2*width + 1, 3*width + 1) 
+                        for x, y in zip(cells_x, cells_y)]
+        self.__frame = np.zeros((screen_x, screen_y, 3), dtype = np.uint8)
+        self.__overlay = None
+        if self.__debug:
+            self.__overlay = pygame.Surface((screen_x, screen_y))
+            self.__overlay.set_colorkey(PyGameRenderer.__black)
+            for n in np.flatnonzero(live):
+                x, y = cells_x[n], cells_y[n]
+                info = (int(panel.universe_plane[y, x]), 
+                        int(panel.address_plane[y, x]))
+                label = self.__font.render(str(info), True, 
+                                           PyGameRenderer.__font_color)
+                self.__overlay.blit(label, (pitch*x, pitch*y))
+        self.__last = None
+        self.__key = (panel.layout, panel.revision, panel.width, panel.height)
+
+    def __sprite(self, draw):
+        # Rasterizes a sprite with pygame itself and returns its pixels as
+        # (x, y) offsets from the cell center.
+        center = 2*self.__scale
+        surface = pygame.Surface((2*center + 1, 2*center + 1), 0, 32)
+        surface.fill(PyGameRenderer.__black)
+        draw(surface, (center, center))
+        xs, ys = np.nonzero(pygame.surfarray.array3d(surface).any(axis = 2))
+        return xs - center, ys - center
+
+    def render(self, panel):
+        key = (panel.layout, panel.revision, panel.width, panel.height)
+        if key != self.__key:
+            self.prepare(panel)
+        start = monotonic()
+        visible = panel.color_plane.reshape(-1, 3)[self.__cells]
+        calibration = self.calibration
+        if calibration is not None and not calibration.identity:
+            visible = calibration.apply(visible)
+        if self.__last is None:
+            dirty = None
+        else:
+            changed = np.flatnonzero((visible != self.__last).any(axis = 1))
+            if len(changed) == 0:
+                self.instruments.record(ENCODE, monotonic() - start)
+                return
+            dirty = None
+            if len(changed) <= PyGameRenderer.__max_dirty_rects:
+                dirty = [self.__rects[n] for n in changed]
+        self.__last = visible
+        self.__frame[self.__covered] = visible[self.__sources]
+        pygame.surfarray.blit_array(self.__canvas, self.__frame)
+        if self.__overlay is not None:
+            self.__canvas.blit(self.__overlay, (0, 0))
+        encoded = monotonic()
+        self.instruments.record(ENCODE, encoded - start)
+        if dirty is None:
+            self.__screen.blit(self.__canvas, (0, 0))
+            pygame.display.update()
+        else:
+            for rect in dirty:
+                self.__screen.blit(self.__canvas, rect, rect)
+            pygame.display.update(dirty)
+        self.instruments.record(WRITE, monotonic() - encoded)
 
     def __repr__(self):
         return "PyGameRenderer"
 
 
 class CursesRenderer(Renderer):
-    """ CursesRenderer is provides an in-terminal, curses-based renderer. 
+    """ CursesRenderer is provides an in-terminal, curses-based renderer. Only
+    the live pixels are visited, unless debug is set, which draws the dead
+    ones too.
     """ 
 
     __n_background = 0
@@ -88,30 +188,30 @@ class CursesRenderer(Renderer):
     def render(self, panel):        
         self.__win.erase()
         self.__stdscr.clear()
+        if self.__debug:
+            cells = np.arange(panel.width*panel.height)
+        else:
+            cells = panel.live_cells
+        xs, ys = panel.live_positions(cells)
+        colors = panel.live_colors(cells)
+        if self.calibration is not None:
+            colors = self.calibration.apply(colors)
+        # curses colors range 0-1000
+        colors = (colors*CursesRenderer.__fg_scale).astype(int).tolist()
         # fg_pair corresponds to pixel, which is foregrounded.
-        fg_pair = 1
-        for loc, pixel in panel.iteritems():
-            x, y = loc
-            if pixel.live or self.__debug:
-                try:
-                    if self.__has_color:
-                        scale = CursesRenderer.__fg_scale
-                        # curses colors range 0-1000
-                        color = tuple(c/scale for p in pixel.color.rgba)                        
-                        fg_color = curses.COLOR_WHITE + i
-                        curses.init_color(fg_color, r, g, b)
-                        curses.init_pair(fg_pair, fg_color, curses.COLOR_BLACK)
-                        self.__win.addstr(y, x, 'X', curses.color_pair(fg_pair))
-                    else: 
-                        self.__win.addstr(y, x, 'X', curses.COLOR_WHITE)
-                except curses.error:
-                    print "curses error: TODO add proper logging!"
-            if self.__debug:
-                universe = pixel.address.universe
-                address = pixel.address.address
-                info = (universe, address)
-                # TODO: Show the address here somewhere.
-            fg_pair += 1
+        for fg_pair, (x, y, (r, g, b)) in enumerate(zip(xs.tolist(), ys.tolist(), 
+                                                        colors), 1):
+            try:
+                if self.__has_color:
+                    fg_color = curses.COLOR_WHITE + fg_pair
+                    curses.init_color(fg_color, r, g, b)
+                    curses.init_pair(fg_pair, fg_color, curses.COLOR_BLACK)
+                    self.__win.addstr(y, x, 'X', curses.color_pair(fg_pair))
+                else: 
+                    self.__win.addstr(y, x, 'X', curses.COLOR_WHITE)
+            except curses.error:
+                print "curses error: TODO add proper logging!"
+            # TODO: Show the DMX address of live pixels in debug mode.
         self.__win.refresh()
     
     def __del__(self):
@@ -132,8 +232,8 @@ def simulation_main():
     from diodberg.user_plugins.examples import CycleHue
     from diodberg.renderers.simulation_renderers import PyGameRenderer    
     panel = random_panel()
-    renderer = PyGameRenderer(debug = True)
-    runner = CycleHue(panel, renderer)
+    renderer = PyGameRenderer(debug = True, live_only = True)
+    runner = CycleHue(panel, renderer, live_only = True)
     controller = Controller(panel, renderer)
     controller.run(runner)
 
@@ -4,58 +4,126 @@
 # executable.
 
 
+import numpy as np
+
+from diodberg.core import kernels
 from diodberg.core.runner import Runner
-from diodberg.core.types import Color
-from diodberg.core.types import random_color
+from diodberg.core.runner import ShardedRunner
+from diodberg.core.types import hsv_to_rgb
 
 
 class ToggleColors(Runner):
-    """ Random toggles colors. """
+    """ Random toggles colors. Supports live_only. """
 
-    def __init__(self, panel, renderer, sleep = 1):
+    def __init__(self, panel, renderer, sleep = 1, **kwargs):
         name = "ToggerColors"
-        super(ToggleColors, self).__init__(panel, name, renderer, sleep)
+        super(ToggleColors, self).__init__(panel, name, renderer, sleep, **kwargs)
+
+    def open(self):
+        # Picks (and compiles) the kernel backends now, not in the first frame.
+        kernels.selected()
     
     def init(self):
-        pass
+        self.__frame = 0
 
     def fill(self):
-        for loc, pixel in self.panel.iteritems():
-            r, g, b, alpha = random_color().rgba
-            pixel.color.set_rgb(r, g, b)
+        if self.live_only:
+            kernels.run_live('noise', self.panel, self.__frame)
+        else:
+            colors = self.panel.color_plane.reshape(-1, 3)
+            kernels.get('noise')(colors, self.panel.width, self.__frame)
+        self.__frame += 1
 
     def __repr__(self):
         return super(ToggleColors, self).__repr__() + ":" + self.name
 
 
 class CycleHue(Runner):
-    """ Cycles hues. """
+    """ Cycles hues. Supports live_only. """
 
-    def __init__(self, panel, renderer, sleep = 0.01):
+    def __init__(self, panel, renderer, sleep = 0.01, **kwargs):
         name = "CycleHue"
-        super(CycleHue, self).__init__(panel, name, renderer, sleep)
+        super(CycleHue, self).__init__(panel, name, renderer, sleep, **kwargs)
+
+    def open(self):
+        kernels.selected()
     
     def init(self):
         pass
 
+    __hue_step = 20
+
     def fill(self):
-        for loc, pixel in self.panel.iteritems():
-            h, s, v = pixel.color.hsv
-            h = (h + 20) % 360
-            pixel.color.set_hsv(h, s, v)
+        step = float(CycleHue.__hue_step)
+        if self.live_only:
+            kernels.run_live('hue_cycle', self.panel, step)
+        else:
+            colors = self.panel.color_plane.reshape(-1, 3)
+            kernels.get('hue_cycle')(colors, self.panel.width, step)
 
     def __repr__(self):
         return super(CycleHue, self).__repr__() + ":" + self.name
 
 
+def plasma_colors(x, y, frame):
+    """ Returns the plasma colors at float arrays of positions x and y: a hue
+    field from summed sine waves. Deliberately per-pixel heavy; see Plasma.
+    """
+    t = 0.1*frame
+    field = (np.sin(0.03*x + t) + np.sin(0.05*y - t) + 
+             np.sin(0.02*(x + y) + t) + np.sin(0.04*np.hypot(x - 320, y - 240) - t))
+    hsv = np.ones(field.shape + (3,))
+    hsv[..., 0] = 45*(field + 4)
+    return hsv_to_rgb(hsv)
+
+
+def plasma_tile(colors, rows, frame):
+    """ Fills a band of rows with an animated plasma.
+    """
+    start, stop = rows
+    height, width = colors.shape[:2]
+    y, x = np.mgrid[start:stop, 0:width].astype(np.float64)
+    colors[...] = plasma_colors(x, y, frame)
+
+
+class Plasma(ShardedRunner):
+    """ Animated plasma, filled in parallel by a process pool. With live_only
+    the live pixels are filled in process instead, and no pool is started:
+    on a sparse wall there are too few of them to be worth sharding.
+    """
+
+    def __init__(self, panel, renderer, sleep = 0.04, workers = None, **kwargs):
+        name = "Plasma"
+        super(Plasma, self).__init__(panel, name, renderer, sleep, plasma_tile, 
+                                     workers, **kwargs)
+        self.__frame = 0
+
+    def open(self):
+        if not self.live_only:
+            super(Plasma, self).open()
+
+    def fill(self):
+        if not self.live_only:
+            return super(Plasma, self).fill()
+        cells = self.panel.live_cells
+        x, y = self.panel.live_positions(cells)
+        colors = plasma_colors(x.astype(np.float64), y.astype(np.float64), 
+                               self.__frame)
+        self.panel.set_live_colors(colors, cells)
+        self.__frame += 1
+
+    def __repr__(self):
+        return super(Plasma, self).__repr__() + ":" + self.name
+
+
 def simulation_main():
     """ Runs a simulation test routine for watching examples. """
     from diodberg.core.runner import Controller
     from diodberg.core.types import random_panel
     from diodberg.renderers.simulation_renderers import PyGameRenderer
     panel = random_panel()
-    renderer = PyGameRenderer(debug = True)
-    runner = CycleHue(panel, renderer)
+    renderer = PyGameRenderer(debug = True, live_only = True)
+    runner = CycleHue(panel, renderer, live_only = True)
     controller = Controller(panel, renderer)
     controller.run(runner)
 
@@ -0,0 +1,626 @@
+# Benchmarks for panel manipulation. Run this module directly to time the suite
+# and print the results:
+#
+#   python -m diodberg.util.benchmarks [--output results.json] [--sharded]
+#
+# With --output the results are also written as JSON, to compare against
+# earlier runs.
+
+import argparse
+import json
+import os
+import platform
+import time
+import numpy as np
+
+
+def best_of(func, repeat = 3):
+    """ Returns the best wall-clock time, in seconds, of repeated calls to func.
+    """
+    best = float("inf")
+    for i in xrange(repeat):
+        start = time.time()
+        func()
+        best = min(best, time.time() - start)
+    return best
+
+
+def bench_color_kernels(sizes = (10000, 100000, 300000)):
+    """ Times one CycleHue frame (RGB -> HSV -> rotate -> RGB) through the
+    per-pixel colorsys path and through the batched kernels, for panels of
+    sizes pixels. Returns a list of (pixels, colorsys_s, vectorized_s).
+    """
+    from diodberg.core.types import Color
+    from diodberg.core.types import random_colors
+    from diodberg.core.types import rotate_hue
+    results = []
+    for size in sizes:
+        plane = random_colors((size, 1))
+        colors = [Color(*row[0].tolist()) for row in plane]
+        def per_pixel():
+            for color in colors:
+                h, s, v = color.hsv
+                color.set_hsv((h + 20) % 360, s, v)
+        def vectorized():
+            plane[...] = rotate_hue(plane, 20)
+        results.append((size, best_of(per_pixel, 1), best_of(vectorized)))
+    return results
+
+
+def bench_sharded_fill(workers = (1, 2, 4), size = (640, 480), seconds = 2.):
+    """ Runs the Plasma example for a few seconds per worker count and returns
+    a list of (workers, mean fill seconds, achieved fps), plus the single
+    process fill time as workers = 0.
+    """
+    from diodberg.core.renderer import Renderer
+    from diodberg.core.types import Panel
+    from diodberg.user_plugins.examples import Plasma
+    from diodberg.user_plugins.examples import plasma_tile
+    x, y = size
+    colors = np.zeros((y, x, 3), dtype = np.uint8)
+    results = [(0, best_of(lambda: plasma_tile(colors, (0, y), 0)), 0.)]
+    for count in workers:
+        runner = Plasma(Panel(size), Renderer(), sleep = 0, workers = count)
+        runner.start()
+        time.sleep(seconds)
+        runner.stop()
+        stats = runner.scheduler.stats
+        results.append((count, stats['fill_s'], stats['fps']))
+    return results
+
+
+# Panel sizes, in pixels, for the suite.
+SIZES = (100, 10000, 300000)
+
+# Pixels per DMX universe, 3 channels each.
+_pixels_per_universe = 170
+
+
+def panel_size(pixels):
+    """ Returns a near-square (x, y) panel size with about pixels cells.
+    """
+    x = int(np.ceil(np.sqrt(pixels)))
+    return (x, max(pixels//x, 1))
+
+
+def patched_panel(size):
+    """ Returns a panel with every cell live, patched onto consecutive DMX
+    universes, and random colors.
+    """
+    from diodberg.core.types import Panel
+    from diodberg.core.types import random_colors
+    x, y = size
+    panel = Panel(size)
+    index = np.arange(x*y).reshape(y, x)
+    panel.set_planes(universes = index//_pixels_per_universe,
+                     addresses = 3*(index % _pixels_per_universe),
+                     live = True)
+    panel.color_plane[...] = random_colors((y, x))
+    return panel
+
+
+class _NullPort(object):
+    """ Stands in for serial.Serial so that renderers can be timed without the
+    hardware; writes are discarded.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    def __setattr__(self, name, val):
+        pass
+
+
+def _serial_renderer(**kwargs):
+    from diodberg.renderers import serial_renderers
+    real = serial_renderers.serial.Serial
+    serial_renderers.serial.Serial = _NullPort
+    try:
+        return serial_renderers.DMXSerialRenderer(**kwargs)
+    finally:
+        serial_renderers.serial.Serial = real
+
+
+def _calibrated(factory):
+    from diodberg.core.calibration import Calibration
+    def calibrated():
+        renderer = factory()
+        renderer.calibration = Calibration(gamma = (2.2, 2.4, 2.6), 
+                                           white = (1., 0.9, 0.8), 
+                                           brightness = 0.75)
+        return renderer
+    return calibrated
+
+
+def _frame_recorder():
+    from diodberg.renderers.headless_renderers import FrameRecorder
+    return FrameRecorder(capacity = 16)
+
+
+def _network_renderer(name):
+    from diodberg.renderers import network_renderers
+    cls = getattr(network_renderers, name)
+    return lambda: cls(host = "127.0.0.1", port = 9)
+
+
+def _ws2812_renderer(symbol_bits):
+    from diodberg.renderers.gpio_renderers import BufferTransport
+    from diodberg.renderers.gpio_renderers import PiToWS2812Renderer
+    return lambda: PiToWS2812Renderer(BufferTransport(symbol_bits))
+
+
+def _pygame_renderer():
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    from diodberg.renderers.simulation_renderers import PyGameRenderer
+    return PyGameRenderer()
+
+
+# Renderers to time, as (name, factory). Factories that raise (e.g. on a
+# missing module) are reported as skipped.
+RENDERERS = [("FrameRecorder", _frame_recorder),
+             ("DMXSerialRenderer", lambda: _serial_renderer(keepalive = 0)),
+             ("DMXSerialRenderer/delta", lambda: _serial_renderer()),
+             ("DMXSerialRenderer/calibrated", 
+              _calibrated(lambda: _serial_renderer(keepalive = 0))),
+             ("DMXSerialRenderer/framed", 
+              lambda: _serial_renderer(framed = True, threaded = False)),
+             ("ArtNetRenderer", _network_renderer("ArtNetRenderer")),
+             ("SACNRenderer", _network_renderer("SACNRenderer")),
+             ("PiToWS2812Renderer/spi3", _ws2812_renderer(3)),
+             ("PiToWS2812Renderer/spi4", _ws2812_renderer(4)),
+             ("PyGameRenderer", _pygame_renderer)]
+
+
+def _runner_fill(cls, **kwargs):
+    def fill(panel):
+        from diodberg.core.renderer import Renderer
+        runner = cls(panel, Renderer(), **kwargs)
+        runner.init()
+        return runner.fill
+    return fill
+
+
+def _plasma_fill(panel):
+    from diodberg.user_plugins.examples import plasma_tile
+    frame = [0]
+    def fill():
+        plasma_tile(panel.color_plane, (0, panel.height), frame[0])
+        frame[0] += 1
+    return fill
+
+
+def _example_fills():
+    from diodberg.user_plugins.examples import CycleHue
+    from diodberg.user_plugins.examples import ToggleColors
+    return [("ToggleColors", _runner_fill(ToggleColors)),
+            ("CycleHue", _runner_fill(CycleHue)),
+            ("Plasma (in process)", _plasma_fill)]
+
+
+def _chase_fill(panel):
+    # A single lit pixel stepping along the panel: the sparse end of the range.
+    colors = panel.color_plane.reshape(-1, 3)
+    frame = [0]
+    def fill():
+        colors[...] = 0
+        colors[frame[0] % len(colors)] = 255
+        frame[0] += 1
+    return fill
+
+
+def _prepared_render(factory, panel):
+    """ Builds a renderer, prepares it for the panel and renders one frame, then
+    returns its render step for timing. If any of that fails, the returned step
+    raises the same error.
+    """
+    try:
+        renderer = factory()
+        renderer.prepare(panel)
+        renderer.render(panel)
+    except Exception as err:
+        def failed():
+            raise err
+        return failed
+    return lambda: renderer.render(panel)
+
+
+def bench_framing(size = (100, 100), frames = 60):
+    """ Encodes frames of each example fill, and of a single pixel chase, on a
+    patched panel with the framed protocol, checking every frame with the reference decoder. Returns a list of
+    (fill, DMX bytes per frame, framed bytes per frame, encode seconds per
+    frame).
+    """
+    from diodberg.core.framing import FrameDecoder
+    from diodberg.core.framing import FrameEncoder
+    from diodberg.core.patch import DMXPatchMap
+    results = []
+    for name, make_fill in _example_fills() + [("Chase", _chase_fill)]:
+        panel = patched_panel(size)
+        fill = make_fill(panel)
+        patch = DMXPatchMap(panel)
+        encoder = FrameEncoder()
+        decoder = FrameDecoder()
+        encode_s = 0.
+        for frame in xrange(frames):
+            fill()
+            patch.apply(panel)
+            start = time.time()
+            data = b"".join(encoder.encode(universe, patch.buffer(universe), 
+                                           frame == 0)
+                            for universe in patch.universes)
+            encode_s += time.time() - start
+            decoder.feed(data)
+            for universe in patch.universes:
+                assert (decoder.universe(universe) == patch.buffer(universe)).all()
+        dmx_bytes = (1 + patch.buffers.shape[1])*len(patch.universes)
+        results.append((name, dmx_bytes, encoder.stats['bytes']/float(frames),
+                        encode_s/frames))
+    return results
+
+
+def bench_pwm(pixels = 8, frames = 200):
+    """ Renders frames of each example fill, and of the single pixel chase, to
+    a FakePWMBackend through PiGPIORenderer, against setting every channel
+    every frame as the renderer used to. Returns a list of (fill, calls per
+    frame, seconds per frame) for every channel, change detection, and change
+    detection with a batched backend.
+    """
+    from diodberg.core.types import Panel
+    from diodberg.renderers.gpio_renderers import FakePWMBackend
+    from diodberg.renderers.gpio_renderers import PiGPIORenderer
+    channels = 3*pixels
+    index = np.arange(pixels).reshape(1, pixels)
+    results = []
+    for name, make_fill in _example_fills() + [("Chase", _chase_fill)]:
+        panel = Panel((pixels, 1))
+        panel.set_planes(universes = 0*index, addresses = 3*index, live = True)
+        fill = make_fill(panel)
+        every = FakePWMBackend()
+        every.setup(range(channels), 0)
+        everything = np.arange(channels)
+        def set_every():
+            fill()
+            every.update(everything, panel.color_plane.reshape(-1)*(100./255))
+        row = [name]
+        for step, backend in [(set_every, every), 
+                              (None, FakePWMBackend()),
+                              (None, FakePWMBackend(batched = True))]:
+            if step is None:
+                renderer = PiGPIORenderer(channels, backend = backend)
+                def step():
+                    fill()
+                    renderer.render(panel)
+            start = time.time()
+            for frame in xrange(frames):
+                step()
+            row.append((backend.calls/float(frames), (time.time() - start)/frames))
+        results.append(tuple(row))
+    return results
+
+
+def bench_spec(pixels = 300000, queries = 1000, radius = 10.):
+    """ Saves a patched panel as a wall specification, then times loading it
+    by parsing the JSON and from the binary cache, and radius queries through
+    the panel index against a scan of every live pixel. Returns a list of
+    (name, seconds per load or query).
+    """
+    import shutil
+    import tempfile
+    from diodberg.core.spec import read_panel
+    from diodberg.core.spec import write_spec
+    panel = patched_panel(panel_size(pixels))
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "wall.json")
+        write_spec(filename, {0: panel})
+        results = [("load/json", best_of(lambda: read_panel(filename, cache = False))),
+                   ("load/cache (first)", best_of(lambda: read_panel(filename), 1)),
+                   ("load/cache", best_of(lambda: read_panel(filename)))]
+    finally:
+        shutil.rmtree(directory)
+    rng = np.random.RandomState(0)
+    points = rng.uniform(0, 1, (queries, 2))*(panel.width, panel.height)
+    index = panel.index
+    live = np.flatnonzero(panel.live_plane)
+    def scan():
+        for x, y in points:
+            px, py = live % panel.width, live//panel.width
+            live[(px - x)**2 + (py - y)**2 <= radius*radius]
+    def indexed():
+        for x, y in points:
+            index.within(x, y, radius)
+    results.append(("within/scan", best_of(scan, 1)/queries))
+    results.append(("within/index", best_of(indexed)/queries))
+    return results
+
+
+def bench_groups(pixels = 300000, routes = 50, holds = 20):
+    """ Highlights one route (group) of holds on a patched panel: through the
+    group index (set_group_color and fade_group), against a scan of a group
+    plane mask and a scan of every pixel. Also times moving a hold to another
+    route, then highlighting it. Returns a list of (name, seconds).
+    """
+    from diodberg.core.types import Color
+    panel = patched_panel(panel_size(pixels))
+    rng = np.random.RandomState(0)
+    cells = rng.choice(panel.width*panel.height, routes*holds, replace = False)
+    for route, cell in zip(np.repeat(np.arange(1, routes + 1), holds), cells):
+        panel.set_pixel(cell % panel.width, cell//panel.width, group = route)
+    color = (255, 0, 0)
+    panel.set_group_color(1, color)
+    def scan_pixels():
+        for location, pixel in panel.iteritems():
+            if pixel.group == 1:
+                pixel.color = Color(*color)
+    def scan_mask():
+        panel.color_plane[panel.group_plane == 1] = color
+    def move():
+        cell = cells[0]
+        panel.set_pixel(cell % panel.width, cell//panel.width, group = 2)
+        panel.set_group_color(2, color)
+        panel.set_pixel(cell % panel.width, cell//panel.width, group = 1)
+        panel.set_group_color(1, color)
+    return [("scan/pixels", best_of(scan_pixels, 1)),
+            ("scan/mask", best_of(scan_mask)),
+            ("set_group_color", best_of(lambda: panel.set_group_color(1, color))),
+            ("fade_group", best_of(lambda: panel.fade_group(1, 0.9))),
+            ("move hold", best_of(move)/2)]
+
+
+def bench_live(size = (640, 480), pixels = 200):
+    """ Times each example fill on a random_panel with a few live pixels, over
+    every cell and with live_only, and visiting the live pixels through
+    iteritems against iterlive. Returns a list of (name, seconds for every
+    cell, seconds for the live pixels).
+    """
+    from diodberg.core.renderer import Renderer
+    from diodberg.core.types import random_panel
+    from diodberg.user_plugins.examples import CycleHue
+    from diodberg.user_plugins.examples import Plasma
+    from diodberg.user_plugins.examples import ToggleColors
+    panel = random_panel(size, pixels)
+    results = []
+    for name, cls in [("ToggleColors", ToggleColors), ("CycleHue", CycleHue)]:
+        every = _runner_fill(cls)(panel)
+        live = _runner_fill(cls, live_only = True)(panel)
+        results.append((name, best_of(every), best_of(live)))
+    # Without start(), a live_only Plasma fills in process.
+    plasma = Plasma(panel, Renderer(), live_only = True)
+    results.append(("Plasma", best_of(_plasma_fill(panel)), best_of(plasma.fill)))
+    def visit_every():
+        for location, pixel in panel.iteritems():
+            if pixel.live:
+                pixel.color
+    def visit_live():
+        for location, pixel in panel.iterlive():
+            pixel.color
+    results.append(("visit pixels", best_of(visit_every, 1), best_of(visit_live)))
+    return results
+
+
+def bench_clips(size = (640, 480), pixels = 200, frames = 100):
+    """ Records CycleHue into a clip (live pixels and DMX), then times a live
+    CycleHue fill against a ClipRunner fill, and a serial render of the
+    panel against sending the clip's DMX frame. Returns (list of (name, live
+    seconds, clip seconds), clip file bytes).
+    """
+    import shutil
+    import tempfile
+    from diodberg.core.clip import ClipRunner
+    from diodberg.core.clip import record_clip
+    from diodberg.core.renderer import Renderer
+    from diodberg.core.types import random_panel
+    from diodberg.user_plugins.examples import CycleHue
+    panel = random_panel(size, pixels)
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "cycle_hue.clip")
+        universes = len(panel.index.universes)
+        clip = record_clip(CycleHue(panel, Renderer(), live_only = True), filename,
+                           frames, dmx = True, universes = universes)
+        file_bytes = os.path.getsize(filename)
+        live = _runner_fill(CycleHue, live_only = True)(panel)
+        # Step the clip a frame per fill, as at its frame rate.
+        now = [0.]
+        def clock():
+            now[0] += 1./clip.fps
+            return now[0]
+        player = ClipRunner(panel, Renderer(), clip, clock = clock)
+        player.init()
+        results = [("fill", best_of(live), best_of(player.fill))]
+        renderer = _serial_renderer(universes = universes, threaded = False)
+        renderer.prepare(panel)
+        output = ClipRunner(panel, renderer, clip, clock = clock)
+        output.init()
+        def render_live():
+            live()
+            renderer.render(panel)
+        def render_clip():
+            output.fill()
+            output.renderer.render(panel)
+        results.append(("fill + render", best_of(render_live), best_of(render_clip)))
+    finally:
+        shutil.rmtree(directory)
+    return results, file_bytes
+
+
+def _counting_renderer(seconds = 0.):
+    """ Returns a renderer that counts its frames and takes seconds to render
+    each; one that takes no time is nonblocking.
+    """
+    from diodberg.core.renderer import Renderer
+    class CountingRenderer(Renderer):
+        nonblocking = seconds == 0
+        frames = 0
+        def render(self, panel):
+            if seconds:
+                time.sleep(seconds)
+            self.frames += 1
+    return CountingRenderer()
+
+
+def bench_event_loop(seconds = 2., slow = 0.05, sleep = 0.01):
+    """ Composites a live CycleHue at 1/sleep fps to a fast output and to one
+    that takes slow seconds a frame, for seconds seconds each: stepping the
+    Controller in a plain loop, which renders to the outputs in turn, and
+    under run_loop. Returns a list of (mode, controller fps, fast output
+    fps, slow output fps).
+    """
+    from diodberg.core.eventloop import EventLoop
+    from diodberg.core.renderer import Renderer
+    from diodberg.core.runner import Controller
+    from diodberg.core.types import random_panel
+    from diodberg.user_plugins.examples import CycleHue
+    results = []
+    for mode in ("threads", "event loop"):
+        panel = random_panel((640, 480), 200)
+        fast, slower = _counting_renderer(), _counting_renderer(slow)
+        controller = Controller(panel, fast, sleep)
+        controller.add_output(slower)
+        runner = CycleHue(panel, Renderer(), sleep, live_only = True)
+        if mode == "threads":
+            controller.add_runner(runner)
+            runner.start()
+            scheduler = controller.scheduler
+            scheduler.start()
+            end = time.time() + seconds
+            while time.time() < end:
+                scheduler.begin_frame()
+                controller.step()
+                scheduler.end_frame()
+        else:
+            loop = EventLoop()
+            controller.run_loop(runner, loop)
+            loop.call_later(seconds, loop.stop)
+            loop.run()
+        fps = controller.scheduler.stats['fps']
+        controller.stop()
+        if mode != "threads":
+            loop.close()
+        results.append((mode, fps, fast.frames/seconds, slower.frames/seconds))
+    return results
+
+
+def bench_suite(sizes = SIZES, repeat = 3):
+    """ Times Panel construction, random_panel, Panel.addresses, each example
+    runner's fill() and each renderer in RENDERERS across panel sizes. Returns
+    a list of result dicts with benchmark, pixels, size and seconds (best of
+    repeat), or skipped with the reason.
+    """
+    from diodberg.core.types import Panel
+    from diodberg.core.types import random_panel
+    results = []
+    def record(name, size, func):
+        x, y = size
+        result = {'benchmark': name, 'pixels': x*y, 'size': [x, y]}
+        try:
+            result['seconds'] = best_of(func, repeat)
+        except Exception as err:
+            result['skipped'] = "%s: %s" % (type(err).__name__, err)
+        results.append(result)
+    for pixels in sizes:
+        size = panel_size(pixels)
+        record("Panel", size, lambda: Panel(size))
+        record("random_panel", size, 
+               lambda: random_panel(size, min(pixels, 200)))
+        panel = patched_panel(size)
+        record("Panel.addresses", size, lambda: panel.addresses)
+        for name, make_fill in _example_fills():
+            fill = make_fill(panel)
+            fill()
+            record("fill/" + name, size, fill)
+        for name, factory in RENDERERS:
+            record("render/" + name, size, _prepared_render(factory, panel))
+    return results
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Runs the diodberg benchmarks.")
+    parser.add_argument("--output", help = "Also write the results to this JSON file.")
+    parser.add_argument("--sizes", type = int, nargs = "+", default = SIZES,
+                        help = "Panel sizes, in pixels.")
+    parser.add_argument("--repeat", type = int, default = 3,
+                        help = "Keep the best of this many runs.")
+    parser.add_argument("--sharded", action = "store_true",
+                        help = "Also time the process pool Plasma fill.")
+    args = parser.parse_args(argv)
+    results = bench_suite(args.sizes, args.repeat)
+    print "Suite: benchmark, pixels, best (ms)"
+    for result in results:
+        if 'skipped' in result:
+            print "%-36s %8d   skipped (%s)" % (result['benchmark'], result['pixels'],
+                                              result['skipped'])
+        else:
+            print "%-36s %8d %10.3f" % (result['benchmark'], result['pixels'],
+                                        1e3*result['seconds'])
+    print "Color kernels: pixels, colorsys (s), vectorized (s), speedup"
+    for size, slow, fast in bench_color_kernels():
+        print "%8d %10.4f %10.4f %8.1fx" % (size, slow, fast, slow/fast)
+        results.append({'benchmark': "color_kernels/colorsys", 'pixels': size,
+                        'seconds': slow})
+        results.append({'benchmark': "color_kernels/vectorized", 'pixels': size,
+                        'seconds': fast})
+    print "Framed protocol, 100x100: fill, DMX bytes, framed bytes, ratio, encode (ms)"
+    for name, dmx_bytes, framed_bytes, encode_s in bench_framing():
+        print "%-24s %8d %10.1f %7.2fx %8.3f" % (name, dmx_bytes, framed_bytes,
+                                                 dmx_bytes/framed_bytes, 1e3*encode_s)
+        results.append({'benchmark': "framing/" + name, 'pixels': 100*100,
+                        'seconds': encode_s, 'dmx_bytes': dmx_bytes,
+                        'framed_bytes': framed_bytes})
+    print "PWM, 8 pixels: fill, calls per frame and ms per frame for every channel, changed, batched"
+    for name, every, changed, batched in bench_pwm():
+        print "%-24s %6.1f %7.3f %6.1f %7.3f %6.1f %7.3f" % ((name,) + every + 
+                                                           changed + batched)
+        for mode, (calls, seconds) in [("every", every), ("changed", changed),
+                                       ("batched", batched)]:
+            results.append({'benchmark': "pwm/%s/%s" % (mode, name), 
+                            'pixels': 8, 'seconds': seconds, 'calls': calls})
+    print "Wall specification, 300000 pixels: step, ms (per query for within)"
+    for name, seconds in bench_spec():
+        print "%-24s %10.3f" % (name, 1e3*seconds)
+        results.append({'benchmark': "spec/" + name, 'pixels': 300000,
+                        'seconds': seconds})
+    print "Route highlight, 300000 pixels, 50 routes of 20 holds: method, ms"
+    for name, seconds in bench_groups():
+        print "%-24s %10.3f" % (name, 1e3*seconds)
+        results.append({'benchmark': "groups/" + name, 'pixels': 300000,
+                        'seconds': seconds})
+    print "Live pixels, 200 of 640x480: fill, every cell (ms), live only (ms), speedup"
+    for name, every, live in bench_live():
+        print "%-24s %10.3f %10.3f %8.1fx" % (name, 1e3*every, 1e3*live, every/live)
+        for mode, seconds in [("every", every), ("live", live)]:
+            results.append({'benchmark': "live/%s/%s" % (mode, name), 
+                            'pixels': 640*480, 'seconds': seconds})
+    clips, file_bytes = bench_clips()
+    print "Clip playback, CycleHue on 200 of 640x480 (%d bytes/100 frames): step, live (ms), clip (ms), speedup" % file_bytes
+    for name, live, clip in clips:
+        print "%-24s %10.3f %10.3f %8.1fx" % (name, 1e3*live, 1e3*clip, live/clip)
+        for mode, seconds in [("live", live), ("clip", clip)]:
+            results.append({'benchmark': "clip/%s/%s" % (mode, name),
+                            'pixels': 640*480, 'seconds': seconds})
+    print "Controller at 100 fps with a 50 ms output: mode, fps, fast output fps, slow output fps"
+    for mode, fps, fast, slow in bench_event_loop():
+        print "%-24s %8.1f %8.1f %8.1f" % (mode, fps, fast, slow)
+        results.append({'benchmark': "outputs/" + mode, 'pixels': 640*480,
+                        'fps': fps, 'fast_fps': fast, 'slow_fps': slow})
+    if args.sharded:
+        print "Sharded Plasma fill, 640x480: workers (0 = in process), fill (s), fps"
+        for count, fill, fps in bench_sharded_fill():
+            print "%8d %10.4f %8.1f" % (count, fill, fps)
+            results.append({'benchmark': "fill/Plasma (workers = %d)" % count,
+                            'pixels': 640*480, 'seconds': fill, 'fps': fps})
+    if args.output:
+        report = {'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  'python': platform.python_version(),
+                  'numpy': np.__version__,
+                  'machine': platform.machine(),
+                  'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 2, sort_keys = True)
+
+
+if __name__ == "__main__":
+    main()
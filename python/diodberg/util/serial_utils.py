@@ -1,6 +1,10 @@
 # Utilities for testing the serial protocol.
 
+import os
+import select
 import sys
+import time
+import tty
 try:
     import serial
 except ImportError as err:
@@ -25,11 +29,70 @@ def write_dmx(baudrate = 115200, buf = bytearray([255, 255, 255])):
     port.stopbits = serial.STOPBITS_TWO
     port.timeout = 3.
     # Write break and mark-after-break
-    port.baudrate = baudrate/2
-    port.write(chr(0))
+    port.break_condition = True
+    time.sleep(100e-6)
+    port.break_condition = False
+    time.sleep(12e-6)
     # Write start and then values to address 0, 1, 2 
     # on universe 0
-    port.baudrate = baudrate
     port.write(chr(0))
     port.write(buf)
     port.close()
+
+
+class PtySerialDevice(object):
+    """ PtySerialDevice is a pseudo-terminal that stands in for a DMX serial
+    device in tests: open name as the serial port (e.g. DMXSerialRenderer(device
+    = pty.name)) and read what was written from this end. A pty doesn't carry
+    breaks, so packets arrive back to back; read_packets() splits them by start
+    code.
+    """
+
+    __universe_size = 512
+    __slots__ = {'__master', '__slave', '__name'}
+
+    def __init__(self):
+        self.__master, self.__slave = os.openpty()
+        tty.setraw(self.__master)
+        self.__name = os.ttyname(self.__slave)
+
+    @property
+    def name(self):
+        return self.__name
+
+    def read(self, timeout = 0.1):
+        """ Returns everything written until nothing more arrives for timeout
+        seconds.
+        """
+        chunks = []
+        while select.select([self.__master], [], [], timeout)[0]:
+            chunks.append(os.read(self.__master, 4096))
+        return b"".join(chunks)
+
+    def read_packets(self, timeout = 0.1):
+        """ Reads and splits DMX packets: returns a list of (start code, first
+        channel, channel bytes). Packets with start code 0 carry a whole
+        universe; 0xD0 partial packets carry their offset and count.
+        """
+        data = bytearray(self.read(timeout))
+        packets = []
+        i = 0
+        while i < len(data):
+            code = data[i]
+            if code == 0xD0:
+                offset = data[i + 1] << 8 | data[i + 2]
+                count = data[i + 3] << 8 | data[i + 4]
+                packets.append((code, offset, bytes(data[i + 5:i + 5 + count])))
+                i += 5 + count
+            else:
+                size = PtySerialDevice.__universe_size
+                packets.append((code, 0, bytes(data[i + 1:i + 1 + size])))
+                i += 1 + size
+        return packets
+
+    def close(self):
+        os.close(self.__master)
+        os.close(self.__slave)
+
+    def __repr__(self):
+        return "PtySerialDevice<%s>" % self.__name
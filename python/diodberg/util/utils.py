@@ -1,29 +1,42 @@
 # Random maybe useful utilities for panel manipulation.
 
+import ctypes
+import ctypes.util
+import time
 
-class ConditionalDecorator(object):
-    """ ConditionalDecorator allows conditional decoration at import time. It can
-    be used to turn off numba's LLVM jit optimizations if you're you not using 
-    them.
-    """
-    
-    __slots__ = {'__condition', '__decorator'}
 
-    def __init__(self, condition, decorator):
-        self.__condition = condition
-        self.__decorator = decorator
+def read_file(filename):
+    """ Reads a file containing a specification of (possible multiple) panels,
+    as {panel id: Panel}. See diodberg.core.spec.
+    """ 
+    from diodberg.core.spec import read_file as read_spec_file
+    return read_spec_file(filename)
 
-    def __call__(self, func):
-        if not self.__condition:
-            return func
-        else:
-            return self.__decorator(func)
 
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
 
-def read_file(filename):
-    """ Reads a file containing a specification of (possible multiple) panels. 
-    TODO: Being changed to a JSON representation.
-    """ 
-    assert 0, "Not implemented yet."
-    panels = dict()
-    return panels
+
+def _posix_monotonic():
+    """ Returns a monotonic() built on clock_gettime(CLOCK_MONOTONIC), or None if
+    it isn't available on this platform.
+    """
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', 
+                            use_errno = True)
+        clock_gettime = librt.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+    clock_monotonic = 1
+    def monotonic():
+        spec = _Timespec()
+        if clock_gettime(clock_monotonic, ctypes.byref(spec)) != 0:
+            return time.time()
+        return spec.tv_sec + spec.tv_nsec*1e-9
+    return monotonic
+
+
+# monotonic() returns seconds from a clock that never goes backwards, for
+# measuring intervals and scheduling frame deadlines.
+monotonic = getattr(time, 'monotonic', None) or _posix_monotonic() or time.time
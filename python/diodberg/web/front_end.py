@@ -2,10 +2,9 @@ from flask import Flask
 from flask import render_template
 from flask import request
 from flask import url_for
-from copy import deepcopy
 import os.path
 from diodberg.core.types import Panel
-from diodberg.util.utils import readfile
+from diodberg.util.utils import read_file
 
 # TODO: Limit global state in this application.
 # TODO: Move d3.js to local installation
@@ -38,7 +37,7 @@ state = AppState()
 def is_valid_filename(filename):
     """ Is this a valid local filename?
     """ 
-    return path.exists(filename)
+    return os.path.exists(filename)
 
 
 @app.route('/', methods=['GET', 'POST'])
@@ -50,7 +49,7 @@ def main_page(name = None):
         if is_valid_filename(filename):
             app.logger.debug("Reading filename: " + filename)
             print filename
-            state.panels = deepcopy(readfile(filename))
+            state.panels = read_file(filename)
             return render_template('main.html', name = "Post")
     return render_template('main.html', name = "Else")
 
@@ -12,14 +12,30 @@ setup(name = 'diodberg',
       url = 'http://spin-one.org',
       packages = ['diodberg', 
                   'diodberg.core.types', 
+                  'diodberg.core.calibration',
+                  'diodberg.core.clip',
+                  'diodberg.core.compositor',
+                  'diodberg.core.eventloop',
+                  'diodberg.core.framing',
+                  'diodberg.core.index',
+                  'diodberg.core.instrumentation',
+                  'diodberg.core.kernels',
                   'diodberg.core.runner',
                   'diodberg.core.renderer',
+                  'diodberg.core.patch',
+                  'diodberg.core.scheduler',
+                  'diodberg.core.spec',
+                  'diodberg.core.transitions',
                   'diodberg.renderers.serial_renderers', 
                   'diodberg.renderers.simulation_renderers',
                   'diodberg.renderers.gpio_renderers',
+                  'diodberg.renderers.headless_renderers',
+                  'diodberg.renderers.network_renderers',
                   'diodberg.user_plugins.examples',
                   'diodberg.util.utils',
-                  'diodberg.util.serial_utils'],
+                  'diodberg.util.serial_utils',
+                  'diodberg.util.benchmarks'],
+      requires = ['numpy (>=1.13, <1.17)'],
       classifiers = ["Development Status :: 2 - Pre-Alpha",
                      "Environment :: Console"]
   )
@@ -0,0 +1,38 @@
+# Unit tests for the diodberg package. Run them from the python/ directory:
+#
+#   python -m unittest discover -t . -s tests
+#
+# Tests that need an optional module (e.g. pyserial) are skipped without it.
+
+import os
+import numpy as np
+
+from diodberg.core.types import Panel
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+WALL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, os.pardir, "data", "test_wall.json")
+
+
+def sample_panel(size = (16, 12), pixels = 40, universes = 2, seed = 0):
+    """ Returns a reproducible panel: pixels live cells picked at random,
+    spread round-robin over universes 0..universes-1 at consecutive 3-channel
+    addresses, with random colors.
+    """
+    rng = np.random.RandomState(seed)
+    x, y = size
+    cells = np.sort(rng.choice(x*y, pixels, replace = False))
+    order = np.arange(pixels)
+    live = np.zeros(x*y, dtype = np.bool_)
+    live[cells] = True
+    planes = {}
+    for name, values in [("universes", order % universes),
+                         ("addresses", 3*(order // universes))]:
+        plane = np.zeros(x*y, dtype = np.int32)
+        plane[cells] = values
+        planes[name] = plane.reshape(y, x)
+    panel = Panel(size)
+    panel.set_planes(live = live.reshape(y, x), **planes)
+    panel.color_plane[...] = rng.randint(256, size = (y, x, 3))
+    return panel
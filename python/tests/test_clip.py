@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from diodberg.core.calibration import Calibration
+from diodberg.core.clip import Clip
+from diodberg.core.clip import ClipRunner
+from diodberg.core.clip import record_clip
+from diodberg.core.patch import DMXPatchMap
+from diodberg.core.renderer import Renderer
+from diodberg.core.runner import Controller
+from diodberg.core.types import Panel
+from diodberg.user_plugins.examples import CycleHue
+from tests import sample_panel
+
+
+class BufferRenderer(Renderer):
+    """ Keeps the last DMX buffers it was sent.
+    """
+
+    renders_buffers = True
+
+    def __init__(self):
+        super(BufferRenderer, self).__init__()
+        self.buffers = None
+
+    def render_buffers(self, universes, buffers):
+        self.buffers = np.array(buffers)
+
+
+class TestClip(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.panel = sample_panel(universes = 2)
+        self.time = 0.
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, name = "clip", **kwargs):
+        runner = CycleHue(Panel(panel = self.panel), Renderer(), live_only = True)
+        return record_clip(runner, os.path.join(self.directory, name), 10, **kwargs)
+
+    def player(self, clip, renderer, **kwargs):
+        player = ClipRunner(Panel(panel = self.panel, share_layout = True), renderer,
+                            clip, clock = lambda: self.time, **kwargs)
+        player.init()
+        return player
+
+    def seek_time(self, clip, frame):
+        self.time = (frame + 0.5)/clip.fps
+
+    def test_round_trip(self):
+        clip = self.record(loop = (2, 8))
+        self.assertEqual((len(clip), clip.size, clip.loop), (10, (16, 12), (2, 8)))
+        np.testing.assert_array_equal(clip.cells, self.panel.live_cells)
+        reopened = Clip(clip.filename)
+        np.testing.assert_array_equal(reopened.rgb(9), clip.rgb(9))
+        self.assertFalse(reopened.has_dmx)
+        self.assertRaises(ValueError, Clip, __file__)
+
+    def test_playback(self):
+        clip = self.record()
+        player = self.player(clip, Renderer())
+        for frame in (0, 3, 9):
+            self.seek_time(clip, frame)
+            player.fill()
+            self.assertEqual(player.frame, frame)
+            np.testing.assert_array_equal(player.panel.live_colors(clip.cells),
+                                          clip.rgb(frame))
+        # Looping wraps around; without, playback stops at the end.
+        self.seek_time(clip, 12)
+        player.fill()
+        self.assertEqual(player.frame, 2)
+        player.looping = False
+        self.time += 1.
+        player.fill()
+        self.assertEqual(player.frame, 9)
+        self.assertTrue(player.finished)
+
+    def test_dmx_playback_is_calibrated(self):
+        clip = self.record(dmx = True, universes = 2)
+        renderer = BufferRenderer()
+        renderer.calibration = Calibration(gamma = 2.2, white = (1., 0.8, 0.6),
+                                           brightness = 0.5)
+        player = self.player(clip, renderer)
+        self.seek_time(clip, 4)
+        player.fill()
+        player.renderer.render(player.panel)
+        # The same as rendering the recorded colors through the calibration.
+        panel = Panel(panel = self.panel, share_layout = True)
+        panel.set_live_colors(clip.rgb(4), clip.cells)
+        patch = DMXPatchMap(panel, xrange(2))
+        patch.apply(panel, renderer.calibration)
+        np.testing.assert_array_equal(renderer.buffers, patch.buffers)
+        renderer.calibration = None
+        player.renderer.render(player.panel)
+        np.testing.assert_array_equal(renderer.buffers, clip.dmx(4))
+
+    def test_dmx_only(self):
+        clip = self.record(rgb = False, dmx = True)
+        self.assertRaises(ValueError, ClipRunner, self.panel, Renderer(), clip)
+        controller = Controller(self.panel, Renderer())
+        self.assertRaises(ValueError, controller.add_runner,
+                          ClipRunner(self.panel, BufferRenderer(), clip))
+        self.assertEqual(controller.runners, [])
+
+    def test_layer(self):
+        clip = self.record(dmx = True)
+        controller = Controller(self.panel, Renderer())
+        layer = controller.add_runner(ClipRunner(self.panel, BufferRenderer(), clip))
+        player = controller.runners[0]
+        self.assertIs(player.renderer, layer)
+        player.init()
+        player.fill()
+        np.testing.assert_array_equal(player.panel.live_colors(clip.cells), clip.rgb(0))
+
+
+if __name__ == "__main__":
+    unittest.main()
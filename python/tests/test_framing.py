@@ -0,0 +1,119 @@
+import unittest
+
+import numpy as np
+
+from diodberg.core.framing import FRAME_KEY
+from diodberg.core.framing import FRAME_OVERHEAD
+from diodberg.core.framing import FRAME_RAW
+from diodberg.core.framing import FrameDecoder
+from diodberg.core.framing import FrameEncoder
+from diodberg.core.framing import crc16
+from diodberg.core.framing import fuzz
+from diodberg.core.framing import rle_decode
+from diodberg.core.framing import rle_encode
+from diodberg.core.patch import DMX_UNIVERSE_SIZE
+
+
+class TestRLE(unittest.TestCase):
+
+    def assertRoundTrip(self, data):
+        data = np.asarray(data, dtype = np.uint8)
+        decoded = rle_decode(rle_encode(data), len(data))
+        np.testing.assert_array_equal(decoded, data)
+
+    def test_edge_cases(self):
+        self.assertEqual(rle_encode([]), b"")
+        for data in ([7], [1, 2], [5]*3, [5]*130, [5]*131, [5]*133, [9]*512,
+                     range(128), range(129), [1, 1, 2, 2, 3, 3, 3]):
+            self.assertRoundTrip(data)
+
+    def test_runs_are_compact(self):
+        # 512 equal channels: three full repeat blocks and one of 122.
+        self.assertEqual(len(rle_encode(np.zeros(DMX_UNIVERSE_SIZE))), 8)
+
+    def test_random(self):
+        rng = np.random.RandomState(0)
+        for i in xrange(200):
+            size = rng.randint(1, DMX_UNIVERSE_SIZE + 1)
+            # Mix runs of random lengths with noise.
+            data = np.repeat(rng.randint(4, size = size), rng.randint(1, 8, size = size))
+            self.assertRoundTrip(data[:DMX_UNIVERSE_SIZE])
+
+    def test_bad_payloads(self):
+        payload = rle_encode(np.arange(10))
+        self.assertRaises(ValueError, rle_decode, payload, 9)
+        self.assertRaises(ValueError, rle_decode, payload, 11)
+        self.assertRaises(ValueError, rle_decode, payload[:-1], 10)
+
+
+class TestFrames(unittest.TestCase):
+
+    def test_crc(self):
+        # The CRC-16/CCITT-FALSE check value.
+        self.assertEqual(crc16(b"123456789"), 0x29B1)
+
+    def test_round_trip(self):
+        rng = np.random.RandomState(1)
+        encoder = FrameEncoder()
+        decoder = FrameDecoder()
+        channels = np.zeros((3, DMX_UNIVERSE_SIZE), dtype = np.uint8)
+        for n in xrange(60):
+            universe = n % 3
+            index = rng.randint(DMX_UNIVERSE_SIZE, size = 5)
+            channels[universe, index] = rng.randint(256, size = 5)
+            packet = encoder.encode(universe, channels[universe], n < 3)
+            if packet:
+                self.assertEqual(decoder.feed(packet), [universe])
+            np.testing.assert_array_equal(decoder.universe(universe),
+                                          channels[universe])
+        self.assertEqual(decoder.stats['crc_errors'], 0)
+        self.assertEqual(decoder.pending, 0)
+
+    def test_unchanged_universe_is_not_sent(self):
+        encoder = FrameEncoder()
+        channels = np.arange(DMX_UNIVERSE_SIZE, dtype = np.uint8)
+        self.assertTrue(encoder.encode(0, channels))
+        self.assertFalse(encoder.encode(0, channels))
+        self.assertTrue(encoder.encode(0, channels, keyframe = True))
+
+    def test_split_stream(self):
+        # Frames split across reads, with garbage in between.
+        encoder = FrameEncoder()
+        decoder = FrameDecoder()
+        channels = np.random.RandomState(2).randint(256, size = DMX_UNIVERSE_SIZE)
+        packet = encoder.encode(4, channels.astype(np.uint8), keyframe = True)
+        self.assertEqual(bytearray(packet)[2], FRAME_KEY | FRAME_RAW)
+        self.assertEqual(len(packet), FRAME_OVERHEAD + DMX_UNIVERSE_SIZE)
+        stream = b"\x00\xD1junk" + packet
+        updated = []
+        for i in xrange(0, len(stream), 7):
+            updated += decoder.feed(stream[i:i + 7])
+        self.assertEqual(updated, [4])
+        np.testing.assert_array_equal(decoder.universe(4), channels)
+
+    def test_corrupt_frame_is_rejected(self):
+        encoder = FrameEncoder()
+        decoder = FrameDecoder()
+        packet = bytearray(encoder.encode(0, np.ones(DMX_UNIVERSE_SIZE, dtype = np.uint8),
+                                          keyframe = True))
+        packet[20] ^= 0x10
+        self.assertEqual(decoder.feed(bytes(packet)), [])
+        self.assertEqual(decoder.stats['crc_errors'], 1)
+        self.assertFalse(decoder.universe(0).any())
+
+    def test_fuzz(self):
+        for universes, seed in [(1, 0), (4, 1), (16, 2)]:
+            encoded, decoded = fuzz(frames = 400, universes = universes, seed = seed)
+            self.assertGreater(decoded['frames'], 0)
+            # Every universe gets its own keyframes.
+            self.assertGreaterEqual(encoded['keyframes'], universes*(400//universes//16))
+
+    def test_fuzz_without_corruption(self):
+        encoded, decoded = fuzz(frames = 300, universes = 3, corrupt = 0.)
+        self.assertEqual(decoded['frames'], encoded['frames'])
+        self.assertEqual(decoded['crc_errors'], 0)
+        self.assertEqual(decoded['out_of_sequence'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from diodberg.core.calibration import Calibration
+from diodberg.core.runner import Runner
+from diodberg.renderers.headless_renderers import FrameRecorder
+from diodberg.renderers.headless_renderers import load_frames
+from diodberg.renderers.headless_renderers import record
+from diodberg.user_plugins.examples import CycleHue
+from diodberg.user_plugins.examples import ToggleColors
+from tests import DATA_DIR
+from tests import sample_panel
+
+
+GOLDEN_FILE = os.path.join(DATA_DIR, "golden_frames.npz")
+GOLDEN_FRAMES = 8
+
+
+def golden_frames():
+    """ Records the golden frames of each example runner on the sample panel,
+    as {runner name: (frames, H, W, 3) array}.
+    """
+    frames = {}
+    for runner in (CycleHue, ToggleColors):
+        recorder = FrameRecorder(capacity = GOLDEN_FRAMES)
+        record(runner(sample_panel(), recorder), GOLDEN_FRAMES)
+        frames[runner.__name__] = recorder.frames()
+    return frames
+
+
+class Counter(Runner):
+    """ Fills every pixel with the frame number.
+    """
+
+    def __init__(self, panel, renderer):
+        super(Counter, self).__init__(panel, "Counter", renderer, 0.01)
+
+    def init(self):
+        self.frame = 0
+
+    def fill(self):
+        self.panel.color_plane[...] = self.frame
+        self.frame += 1
+
+
+class TestGoldenFrames(unittest.TestCase):
+    """ Compares the example runners' output with the frames recorded in
+    tests/data. Backends may round differently, so values may be off by one.
+    After a deliberate change to an effect, regenerate them with
+
+        python -m tests.test_headless_renderers regenerate
+    """
+
+    def test_golden_frames(self):
+        golden = np.load(GOLDEN_FILE)
+        for name, frames in golden_frames().iteritems():
+            expected = golden[name]
+            self.assertEqual(frames.shape, expected.shape)
+            difference = np.abs(frames.astype(np.int16) - expected).max()
+            self.assertLessEqual(difference, 1, "%s frames differ by %d." %
+                                 (name, difference))
+
+    def test_live_only(self):
+        # Hue cycling is the same on the live pixels alone.
+        panel = sample_panel()
+        cells = panel.live_cells
+        recorder = FrameRecorder(capacity = GOLDEN_FRAMES)
+        record(CycleHue(panel, recorder, live_only = True), GOLDEN_FRAMES)
+        expected = np.load(GOLDEN_FILE)["CycleHue"]
+        frames = recorder.frames().reshape(GOLDEN_FRAMES, -1, 3)[:, cells]
+        difference = np.abs(frames.astype(np.int16) -
+                            expected.reshape(GOLDEN_FRAMES, -1, 3)[:, cells]).max()
+        self.assertLessEqual(difference, 1)
+
+
+class TestFrameRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.panel = sample_panel(size = (5, 4), pixels = 6)
+
+    def test_ring(self):
+        recorder = FrameRecorder(capacity = 4)
+        record(Counter(self.panel, recorder), 6)
+        self.assertEqual((len(recorder), recorder.count), (4, 6))
+        self.assertEqual([int(frame[0, 0, 0]) for frame in recorder.frames()], [2, 3, 4, 5])
+        self.assertEqual(recorder.frame()[0, 0, 0], 5)
+        self.assertEqual(recorder.frame(0)[0, 0, 0], 2)
+        self.assertEqual(recorder.frame(-4)[0, 0, 0], 2)
+        self.assertRaises(IndexError, recorder.frame, 4)
+        self.assertRaises(IndexError, recorder.frame, -5)
+        self.assertGreater(recorder.fps, 0)
+
+    def test_empty(self):
+        recorder = FrameRecorder()
+        self.assertRaises(IndexError, recorder.frame)
+        self.assertRaises(IndexError, recorder.frames)
+        recorder.render(self.panel)
+        recorder.frame()
+        recorder.clear()
+        self.assertRaises(IndexError, recorder.frame)
+        self.assertRaises(IndexError, recorder.frames)
+
+    def test_frames_are_copies(self):
+        recorder = FrameRecorder()
+        recorder.render(self.panel)
+        recorder.frame()[...] = 0
+        np.testing.assert_array_equal(recorder.frame(), self.panel.color_plane)
+
+    def test_calibration(self):
+        recorder = FrameRecorder()
+        recorder.calibration = Calibration(gamma = 2.2, white = (1., 0.5, 0.25))
+        recorder.render(self.panel)
+        np.testing.assert_array_equal(recorder.frame(),
+                                      recorder.calibration.apply(self.panel.color_plane))
+
+    def test_new_size_starts_over(self):
+        recorder = FrameRecorder()
+        recorder.render(self.panel)
+        recorder.render(sample_panel(size = (3, 3), pixels = 2))
+        self.assertEqual(len(recorder), 1)
+        self.assertEqual(recorder.frame().shape, (3, 3, 3))
+
+    def test_memory_mapped(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "frames.raw")
+            recorder = FrameRecorder(capacity = 3, filename = filename)
+            record(Counter(self.panel, recorder), 3)
+            self.assertTrue(recorder.flush())
+            recorder.close()
+            frames = load_frames(filename, (5, 4))
+            self.assertEqual(frames.shape, (3, 4, 5, 3))
+            self.assertEqual([int(frame[0, 0, 0]) for frame in frames], [0, 1, 2])
+            del frames
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["regenerate"]:
+        np.savez_compressed(GOLDEN_FILE, **golden_frames())
+        print "Wrote %s." % GOLDEN_FILE
+    else:
+        unittest.main()
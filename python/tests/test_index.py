@@ -0,0 +1,82 @@
+import unittest
+
+import numpy as np
+
+from diodberg.core.index import GroupIndex
+from diodberg.core.index import PanelIndex
+from tests import sample_panel
+
+
+class TestPanelIndex(unittest.TestCase):
+    """ Checks the grid queries against brute force over every live pixel.
+    """
+
+    def setUp(self):
+        self.panel = sample_panel(size = (70, 45), pixels = 400, universes = 3)
+        self.live = self.panel.live_cells
+        self.x, self.y = self.panel.live_positions(self.live)
+        self.queries = np.random.RandomState(6).uniform(-10, 80, size = (60, 2))
+
+    def distances(self, x, y, cells):
+        cx, cy = cells % self.panel.width, cells // self.panel.width
+        return (cx - x)**2 + (cy - y)**2
+
+    def test_within(self):
+        for cell in (1, 5, 16, 64):
+            index = PanelIndex(self.panel.layout, cell)
+            for (x, y), radius in zip(self.queries, [0, 1.5, 4, 9, 30]*12):
+                found = index.within(x, y, radius)
+                expected = self.live[(self.x - x)**2 + (self.y - y)**2 <= radius*radius]
+                self.assertEqual(sorted(found), sorted(expected))
+                distance = self.distances(x, y, found)
+                self.assertTrue((np.diff(distance) >= 0).all())
+
+    def test_nearest(self):
+        index = self.panel.index
+        everything = (self.x[:, None], self.y[:, None])
+        for (x, y), count in zip(self.queries, [1, 3, 10, 50]*15):
+            found = index.nearest(x, y, count)
+            self.assertEqual(len(found), count)
+            self.assertEqual(len(set(found.tolist())), count)
+            # Ties may come in any order, but the distances must match.
+            expected = np.sort((self.x - x)**2 + (self.y - y)**2)[:count]
+            np.testing.assert_array_equal(self.distances(x, y, found), expected)
+
+    def test_nearest_more_than_live(self):
+        found = self.panel.index.nearest(0, 0, len(self.live) + 10)
+        self.assertEqual(sorted(found), sorted(self.live))
+
+    def test_universes(self):
+        index = self.panel.index
+        self.assertEqual(index.universes, [0, 1, 2])
+        for universe in index.universes:
+            pixels, addresses = index.universe(universe)
+            mask = self.panel.universe_plane.reshape(-1)[self.live] == universe
+            self.assertEqual(sorted(pixels), sorted(self.live[mask]))
+            self.assertTrue((np.diff(addresses) > 0).all())
+        self.assertEqual(len(index.universe(9)[0]), 0)
+
+    def test_rebuilt_when_layout_changes(self):
+        index = self.panel.index
+        self.assertTrue(index.is_current(self.panel.layout))
+        x, y = self.x[0], self.y[0]
+        self.panel.set_pixel(x, y, live = False)
+        self.assertFalse(index.is_current(self.panel.layout))
+        self.assertNotIn(y*self.panel.width + x, self.panel.index.within(x, y, 0))
+
+
+class TestGroupIndex(unittest.TestCase):
+
+    def test_members(self):
+        groups = np.array([[0, 1, 1], [2, 0, 1]])
+        index = GroupIndex(groups)
+        np.testing.assert_array_equal(index.members(1), [1, 2, 5])
+        index.remove(1, 2)
+        index.add(2, 0)
+        np.testing.assert_array_equal(index.members(1), [1, 5])
+        np.testing.assert_array_equal(index.members(2), [0, 3])
+        self.assertEqual(len(index.members(7)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
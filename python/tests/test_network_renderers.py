@@ -0,0 +1,142 @@
+import socket
+import unittest
+
+import numpy as np
+
+from diodberg.core.patch import DMXPatchMap
+from diodberg.renderers.network_renderers import ArtNetRenderer
+from diodberg.renderers.network_renderers import SACNRenderer
+from tests import sample_panel
+
+
+class UDPListener(object):
+    """ A UDP socket on a free localhost port that collects datagrams.
+    """
+
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.settimeout(1.)
+        self.port = self.socket.getsockname()[1]
+
+    def receive(self, count):
+        return [bytearray(self.socket.recv(2048)) for i in xrange(count)]
+
+    def close(self):
+        self.socket.close()
+
+
+class NetworkRendererTest(object):
+    """ Sends frames of a two-universe panel to a local listener. Mixed into
+    a TestCase per protocol.
+    """
+
+    def setUp(self):
+        self.listener = UDPListener()
+        self.panel = sample_panel(universes = 2)
+        self.renderers = []
+
+    def tearDown(self):
+        for renderer in self.renderers:
+            renderer.close()
+        self.listener.close()
+
+    def expected(self):
+        patch = DMXPatchMap(self.panel, xrange(2))
+        patch.apply(self.panel)
+        return patch.buffers
+
+    def test_data(self):
+        for use_sendmmsg in (True, False):
+            renderer = self.renderer(use_sendmmsg = use_sendmmsg)
+            renderer.render(self.panel)
+            self.assertTrue(renderer.flush())
+            packets = self.listener.receive(2)
+            for universe, (packet, channels) in enumerate(zip(packets, self.expected())):
+                self.check_header(packet, universe)
+                offset = renderer.data_offset
+                self.assertEqual(len(packet), offset + 512)
+                self.assertEqual(bytes(packet[offset:]), channels.tobytes())
+
+    def test_sequence(self):
+        renderer = self.renderer()
+        sequences = []
+        for i in xrange(3):
+            renderer.render(self.panel)
+            sequences.append([packet[renderer.sequence_offset]
+                              for packet in self.listener.receive(2)])
+        self.assertEqual(sequences, [[1, 1], [2, 2], [3, 3]])
+
+    def test_render_buffers(self):
+        renderer = self.renderer()
+        buffers = np.random.RandomState(5).randint(256, size = (2, 512)).astype(np.uint8)
+        renderer.render_buffers([0, 1], buffers)
+        packets = self.listener.receive(2)
+        for packet, channels in zip(packets, buffers):
+            self.assertEqual(bytes(packet[renderer.data_offset:]), channels.tobytes())
+
+    def test_sync(self):
+        renderer = self.renderer(sync = True)
+        renderer.render(self.panel)
+        packets = self.listener.receive(3)
+        self.check_sync(packets[2])
+
+
+class TestArtNetRenderer(NetworkRendererTest, unittest.TestCase):
+
+    def renderer(self, **kwargs):
+        renderer = ArtNetRenderer(host = "127.0.0.1", port = self.listener.port,
+                                  universes = 2, **kwargs)
+        self.renderers.append(renderer)
+        return renderer
+
+    def check_header(self, packet, universe):
+        self.assertEqual(bytes(packet[:8]), b"Art-Net\x00")
+        # OpCode is little-endian, the protocol version big-endian.
+        self.assertEqual(packet[8] | packet[9] << 8, 0x5000)
+        self.assertEqual(packet[10] << 8 | packet[11], 14)
+        self.assertEqual(packet[14] | packet[15] << 8, universe)
+        self.assertEqual(packet[16] << 8 | packet[17], 512)
+
+    def check_sync(self, packet):
+        self.assertEqual(bytes(packet[:8]), b"Art-Net\x00")
+        self.assertEqual(packet[8] | packet[9] << 8, 0x5200)
+
+    def test_sequence_skips_zero(self):
+        renderer = self.renderer()
+        self.assertEqual(renderer.next_sequence(255), 1)
+
+
+class TestSACNRenderer(NetworkRendererTest, unittest.TestCase):
+
+    def renderer(self, **kwargs):
+        renderer = SACNRenderer(host = "127.0.0.1", port = self.listener.port,
+                                universes = 2, **kwargs)
+        self.renderers.append(renderer)
+        return renderer
+
+    def check_header(self, packet, universe):
+        self.assertEqual(bytes(packet[4:16]), b"ASC-E1.17\x00\x00\x00")
+        # Root, framing and DMP layer lengths.
+        self.assertEqual((packet[16] << 8 | packet[17]) & 0xFFF, len(packet) - 16)
+        self.assertEqual((packet[38] << 8 | packet[39]) & 0xFFF, len(packet) - 38)
+        self.assertEqual((packet[115] << 8 | packet[116]) & 0xFFF, len(packet) - 115)
+        self.assertEqual(bytes(packet[44:52]), b"diodberg")
+        # sACN universes start at 1.
+        self.assertEqual(packet[113] << 8 | packet[114], universe + 1)
+        self.assertEqual(packet[123] << 8 | packet[124], 513)
+        self.assertEqual(packet[125], 0)
+
+    def check_sync(self, packet):
+        self.assertEqual(len(packet), 49)
+        self.assertEqual(bytes(packet[4:16]), b"ASC-E1.17\x00\x00\x00")
+        self.assertEqual(bytes(packet[18:22]), b"\x00\x00\x00\x08")
+
+    def test_multicast_group(self):
+        self.assertEqual(SACNRenderer.multicast_group(1), "239.255.0.1")
+        self.assertEqual(SACNRenderer.multicast_group(300), "239.255.1.44")
+
+
+if __name__ == "__main__":
+    unittest.main()
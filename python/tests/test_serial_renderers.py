@@ -0,0 +1,157 @@
+import time
+import unittest
+
+import numpy as np
+
+from diodberg.core.calibration import Calibration
+from diodberg.core.framing import FrameDecoder
+from diodberg.core.patch import DMXPatchMap
+from diodberg.util.serial_utils import PtySerialDevice
+from tests import sample_panel
+
+try:
+    from diodberg.renderers.serial_renderers import DMXSerialRenderer
+    from diodberg.renderers.serial_renderers import DMX_PARTIAL_START_CODE
+    from diodberg.renderers.serial_renderers import DMX_START_CODE
+    use_serial = True
+except (ImportError, NameError):
+    use_serial = False
+
+
+@unittest.skipUnless(use_serial, "pyserial isn't installed")
+class TestDMXSerialRenderer(unittest.TestCase):
+    """ Renders through a pseudo-terminal and checks the packets that come out
+    of the other end.
+    """
+
+    def setUp(self):
+        self.device = PtySerialDevice()
+        self.panel = sample_panel(universes = 2)
+        self.renderers = []
+
+    def tearDown(self):
+        for renderer in self.renderers:
+            renderer.close()
+        self.device.close()
+
+    def renderer(self, **kwargs):
+        kwargs.setdefault('threaded', False)
+        renderer = DMXSerialRenderer(universes = 2, device = self.device.name, **kwargs)
+        self.renderers.append(renderer)
+        return renderer
+
+    def expected(self, calibration = None):
+        patch = DMXPatchMap(self.panel, xrange(2))
+        patch.apply(self.panel, calibration)
+        return patch.buffers
+
+    def test_full_frames(self):
+        renderer = self.renderer(keepalive = 0)
+        for i in xrange(2):
+            renderer.render(self.panel)
+            packets = self.device.read_packets()
+            self.assertEqual(len(packets), 2)
+            for (code, offset, data), channels in zip(packets, self.expected()):
+                self.assertEqual((code, offset), (DMX_START_CODE, 0))
+                self.assertEqual(data, channels.tobytes())
+        self.assertEqual(renderer.stats['frames'], 2)
+
+    def test_calibration(self):
+        renderer = self.renderer()
+        renderer.calibration = Calibration(gamma = 2.2, brightness = 0.5)
+        renderer.render(self.panel)
+        packets = self.device.read_packets()
+        expected = self.expected(renderer.calibration)
+        self.assertEqual([data for code, offset, data in packets],
+                         [channels.tobytes() for channels in expected])
+
+    def test_unchanged_universes_are_skipped(self):
+        renderer = self.renderer(keepalive = 60.)
+        renderer.render(self.panel)
+        self.assertEqual(len(self.device.read_packets()), 2)
+        renderer.render(self.panel)
+        self.assertEqual(self.device.read_packets(), [])
+        self.assertEqual(renderer.stats['universes_skipped'], 2)
+
+    def test_partial_frames(self):
+        renderer = self.renderer(keepalive = 60., partial_frames = True)
+        renderer.render(self.panel)
+        self.device.read_packets()
+        # Change one live pixel: only its universe goes out, as a partial
+        # packet of its three channels.
+        cell = self.panel.live_cells[5]
+        y, x = divmod(int(cell), self.panel.width)
+        self.panel.color_plane[y, x] = 255 - self.panel.color_plane[y, x]
+        renderer.render(self.panel)
+        packets = self.device.read_packets()
+        self.assertEqual(len(packets), 1)
+        code, offset, data = packets[0]
+        universe = self.panel.universe_plane[y, x]
+        address = self.panel.address_plane[y, x]
+        self.assertEqual((code, offset), (DMX_PARTIAL_START_CODE, address))
+        self.assertEqual(data, self.expected()[universe, address:address + 3].tobytes())
+
+    def test_keepalive(self):
+        renderer = self.renderer(keepalive = 0.5, partial_frames = True)
+        renderer.render(self.panel)
+        self.device.read_packets()
+        renderer.render(self.panel)
+        self.assertEqual(self.device.read_packets(), [])
+        time.sleep(0.5)
+        renderer.render(self.panel)
+        packets = self.device.read_packets()
+        self.assertEqual([(code, offset) for code, offset, data in packets],
+                         [(DMX_START_CODE, 0)]*2)
+
+    def test_render_buffers(self):
+        renderer = self.renderer(keepalive = 0)
+        buffers = np.random.RandomState(3).randint(256, size = (2, 512)).astype(np.uint8)
+        renderer.render_buffers([0, 1], buffers)
+        packets = self.device.read_packets()
+        self.assertEqual([data for code, offset, data in packets],
+                         [channels.tobytes() for channels in buffers])
+
+    def test_threaded(self):
+        renderer = self.renderer(threaded = True, keepalive = 0)
+        renderer.render(self.panel)
+        renderer.writer.close(1.)
+        packets = self.device.read_packets()
+        self.assertEqual([data for code, offset, data in packets],
+                         [channels.tobytes() for channels in self.expected()])
+
+    def test_framed_deltas(self):
+        renderer = self.renderer(framed = True, keepalive = 60.)
+        decoder = FrameDecoder()
+        rng = np.random.RandomState(4)
+        cells = self.panel.live_cells
+        for i in xrange(10):
+            colors = self.panel.live_colors(cells)
+            colors[rng.randint(len(cells))] = rng.randint(256, size = 3)
+            self.panel.set_live_colors(colors, cells)
+            renderer.render(self.panel)
+            decoder.feed(self.device.read())
+            for universe, channels in enumerate(self.expected()):
+                np.testing.assert_array_equal(decoder.universe(universe), channels)
+        stats = decoder.stats
+        self.assertEqual((stats['crc_errors'], stats['out_of_sequence']), (0, 0))
+        writer = renderer.writer.stats
+        self.assertEqual((writer['frames'], writer['merged']), (10, 0))
+
+    def test_nonblocking(self):
+        renderer = self.renderer(framed = True, nonblocking = True)
+        self.assertTrue(renderer.nonblocking)
+        self.assertIsNotNone(renderer.fileno())
+        decoder = FrameDecoder()
+        renderer.render(self.panel)
+        while not renderer.flush():
+            decoder.feed(self.device.read(0.01))
+        decoder.feed(self.device.read())
+        for universe, channels in enumerate(self.expected()):
+            np.testing.assert_array_equal(decoder.universe(universe), channels)
+
+    def test_nonblocking_needs_framed(self):
+        self.assertRaises(ValueError, self.renderer, nonblocking = True)
+
+
+if __name__ == "__main__":
+    unittest.main()
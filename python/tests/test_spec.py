@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from diodberg.core.spec import cache_filename
+from diodberg.core.spec import read_panel
+from diodberg.core.spec import read_spec
+from diodberg.core.spec import write_panel
+from diodberg.core.spec import write_spec
+from tests import WALL_FILE
+from tests import sample_panel
+
+
+class TestSpec(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def assertSameLayout(self, a, b):
+        self.assertEqual((a.width, a.height), (b.width, b.height))
+        for plane in ("universe_plane", "address_plane", "live_plane", "group_plane"):
+            np.testing.assert_array_equal(getattr(a, plane), getattr(b, plane))
+        self.assertEqual(a.layout.extra_groups, b.layout.extra_groups)
+
+    def test_sample_wall(self):
+        metadata, panels = read_spec(WALL_FILE, cache = False)
+        self.assertEqual(metadata["name"], "test_wall")
+        panel = panels[0]
+        self.assertEqual((panel.width, panel.height), (4, 3))
+        self.assertEqual(len(panel.live_cells), 12)
+        # A serpentine strip, 0-based, three channels per pixel.
+        np.testing.assert_array_equal(panel.address_plane,
+                                      [[0, 3, 6, 9], [21, 18, 15, 12], [24, 27, 30, 33]])
+        np.testing.assert_array_equal(panel.group_mask(1), [[1, 1, 1, 1], [0, 0, 0, 0],
+                                                            [0, 0, 0, 0]])
+
+    def test_round_trip(self):
+        panel = sample_panel(pixels = 30, universes = 3)
+        panel.set_groups(2, 3, [4, 5])
+        write_spec(self.path("wall.json"), {0: panel, 7: sample_panel(seed = 1)},
+                   {"name": "round trip"})
+        metadata, panels = read_spec(self.path("wall.json"), cache = False)
+        self.assertEqual(metadata["name"], "round trip")
+        self.assertEqual(sorted(panels), [0, 7])
+        self.assertSameLayout(panels[0], panel)
+        self.assertSameLayout(panels[7], sample_panel(seed = 1))
+
+    def test_write_panel_keeps_others(self):
+        filename = self.path("wall.json")
+        shutil.copy(WALL_FILE, filename)
+        write_panel(filename, sample_panel(), panel_id = 1)
+        metadata, panels = read_spec(filename, cache = False)
+        self.assertEqual(metadata["name"], "test_wall")
+        self.assertSameLayout(panels[0], read_panel(WALL_FILE, cache = False))
+        self.assertSameLayout(panels[1], sample_panel())
+
+    def test_cache(self):
+        filename = self.path("wall.json")
+        shutil.copy(WALL_FILE, filename)
+        first = read_panel(filename)
+        self.assertTrue(os.path.exists(cache_filename(filename)))
+        self.assertSameLayout(read_panel(filename), first)
+        # A changed file is parsed again, not read from the stale cache.
+        with open(filename) as f:
+            spec = json.load(f)
+        spec["panels"][0]["pixels"]["address"][0] = 100
+        with open(filename, "w") as f:
+            json.dump(spec, f)
+        self.assertEqual(read_panel(filename).address_plane[0, 0], 100)
+
+    def test_records(self):
+        filename = self.path("records.json")
+        with open(filename, "w") as f:
+            json.dump({"panels": [{"id": 0, "size": [3, 2], "pixels": [
+                {"x": 0, "y": 0, "universe": 1, "address": 6},
+                {"x": 2, "y": 1, "universe": 0, "address": 9, "live": False,
+                 "group": 3}]}]}, f)
+        panel = read_panel(filename, cache = False)
+        np.testing.assert_array_equal(panel.live_plane, [[1, 0, 0], [0, 0, 0]])
+        self.assertEqual(panel.universe_plane[0, 0], 1)
+        self.assertEqual(panel.address_plane[1, 2], 9)
+        self.assertEqual(panel.group_plane[1, 2], 3)
+
+    def test_malformed(self):
+        filename = self.path("bad.json")
+        def pixels(x, y):
+            return {"panels": [{"id": 0, "size": [2, 2], "pixels": {
+                "x": x, "y": y, "universe": [0]*len(x), "address": [0]*len(x)}}]}
+        overlapping = pixels([0, 0], [1, 1])
+        outside = pixels([0, 5], [0, 0])
+        short = pixels([0, 1], [0])
+        for spec in ([], {"version": 99}, overlapping, outside, short):
+            with open(filename, "w") as f:
+                json.dump(spec, f)
+            self.assertRaises(ValueError, read_spec, filename, False)
+        self.assertRaises(ValueError, read_panel, WALL_FILE, 3, False)
+
+
+if __name__ == "__main__":
+    unittest.main()